@@ -0,0 +1,100 @@
+"""
+Admission control for upstream LLM calls
+Description: Bounds concurrent chat-completion calls with a semaphore and a bounded wait queue.
+Requests beyond the queue, requests whose deadline would expire while waiting, and requests that
+arrive while the provider is rate-limiting us are rejected immediately, so the caller can answer
+with a fast 429/503 or fall back to retrieval-only results instead of timing out slowly.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ADMITTED = REGISTRY.gauge("traffic_admission_inflight", "Calls holding an admission slot", ["pool"])
+WAITING = REGISTRY.gauge("traffic_admission_waiting", "Calls waiting for an admission slot", ["pool"])
+WAIT_SECONDS = REGISTRY.histogram(
+    "traffic_admission_wait_seconds", "Time spent waiting for an admission slot", ["pool"]
+)
+REJECTED = REGISTRY.counter(
+    "traffic_admission_rejected_total", "Calls rejected by admission control", ["pool", "reason"]
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a call is not admitted; carries the HTTP status and Retry-After to surface"""
+
+    def __init__(self, reason: str, status_code: int = 503, retry_after: float = 1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def headers(self):
+        return {"Retry-After": str(max(1, int(round(self.retry_after))))}
+
+
+class AdmissionController:
+    """Concurrency limiter with a bounded wait queue, deadlines and an upstream cool-down"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._waiting = 0
+        self._cooldown_until = 0.0
+
+    def _reject(self, reason: str, status_code: int = 503, retry_after: float = 1.0) -> AdmissionRejected:
+        REJECTED.labels(self.name, reason).inc()
+        return AdmissionRejected(reason, status_code, retry_after)
+
+    def cool_down(self, seconds: float) -> None:
+        """Reject new calls for `seconds` (e.g. after the provider answered 429)"""
+        until = time.monotonic() + seconds
+        if until > self._cooldown_until:
+            logger.warning(f"⚠️ {self.name}: upstream rate-limited, shedding new calls for {seconds:.1f}s")
+            self._cooldown_until = until
+
+    @asynccontextmanager
+    async def slot(self, deadline: Optional[float] = None) -> AsyncIterator[None]:
+        """Hold one slot for the duration of the block; `deadline` is a time.monotonic() value"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Semaphores bind to one event loop; tools that call asyncio.run() repeatedly get a fresh one
+            self._semaphore, self._loop = asyncio.Semaphore(self.max_concurrent), loop
+
+        now = time.monotonic()
+        if now < self._cooldown_until:
+            raise self._reject("upstream_rate_limited", 429, self._cooldown_until - now)
+        if deadline is not None and deadline <= now:
+            raise self._reject("deadline")
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            raise self._reject("queue_full")
+
+        self._waiting += 1
+        WAITING.labels(self.name).inc()
+        started = time.perf_counter()
+        try:
+            timeout = None if deadline is None else deadline - now
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise self._reject("deadline")
+        finally:
+            self._waiting -= 1
+            WAITING.labels(self.name).dec()
+            WAIT_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+
+        ADMITTED.labels(self.name).inc()
+        try:
+            yield
+        finally:
+            ADMITTED.labels(self.name).dec()
+            self._semaphore.release()
@@ -20,17 +20,26 @@ def display_health_check():
     """Display system health and database information"""
     try:
         health_response = requests.get(f"{API_BASE_URL}/health")
-        embeddings_info = requests.get(f"{API_BASE_URL}/embeddings/info")
+        # Revalidate instead of refetching on every rerun: 304 while the index snapshot is unchanged
+        cached = st.session_state.get("embeddings_info")
+        headers = {"If-None-Match": cached["etag"]} if cached and cached["url"] == API_BASE_URL else {}
+        embeddings_info = requests.get(f"{API_BASE_URL}/embeddings/info", headers=headers)
+        if embeddings_info.status_code == 200:
+            st.session_state["embeddings_info"] = {
+                "url": API_BASE_URL, "etag": embeddings_info.headers.get("ETag", ""), "data": embeddings_info.json()
+            }
 
-        if health_response.status_code == 200 and embeddings_info.status_code == 200:
+        if health_response.status_code == 200 and embeddings_info.status_code in (200, 304):
             health_data = health_response.json()
-            info_data = embeddings_info.json()
+            info_data = st.session_state["embeddings_info"]["data"]
 
             st.sidebar.success("✅ System Health: Operational")
             st.sidebar.write("### Embeddings Database")
             st.sidebar.write(f"**Total Segments:** {info_data['total_segments']}")
             st.sidebar.write(f"**Available Years:** {', '.join(map(str, info_data['available_years']))}")
             st.sidebar.write(f"**Available Months:** {', '.join(info_data['available_months'])}")
+        elif health_response.status_code == 200 and health_response.json().get("index_state") in ("starting", "loading", "warming"):
+            st.sidebar.info("⏳ Embeddings database is loading...")
     except requests.exceptions.ConnectionError:
         st.sidebar.error("❌ Cannot connect to API. Ensure FastAPI server is running.")
 
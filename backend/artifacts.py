@@ -0,0 +1,109 @@
+"""
+Versioned, read-only index artifacts
+Description: An artifact is a directory produced offline by build_index.py and only ever mapped by
+serving processes: the FAISS index (whose flat storage doubles as the vector array), the segment
+store with its table and geometry columns, the per-month shards, precomputed /embeddings/info stats
+and the embedding space, plus a manifest with the size and SHA-256 of every file. Builds land in
+<root>/<version>/ and `publish` atomically repoints <root>/current at one of them.
+
+Layout:
+    <root>/<version>/manifest.json      {"version", "created_at", "files": {path: {"bytes", "sha256"}}, ...}
+    <root>/<version>/index.bin
+    <root>/<version>/metadata/          SegmentStore (+ segments/, geometry/)
+    <root>/<version>/shards/            per-month shards
+    <root>/<version>/stats.json         /embeddings/info body
+    <root>/<version>/index_info.json    embedding space
+    <root>/current -> <version>
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_LINK = "current"
+
+
+def new_version() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def artifact_paths(directory: str) -> Dict[str, str]:
+    """CONFIG keys pointing into an artifact directory"""
+    root = Path(directory)
+    return {
+        "faiss_index_path": str(root / "index.bin"),
+        "metadata_store_dir": str(root / "metadata"),
+        "shard_dir": str(root / "shards"),
+        "index_info_path": str(root / "index_info.json"),
+        "stats_path": str(root / "stats.json"),
+    }
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_manifest(directory: str, version: str, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Checksum every file in the artifact; written last, so a manifest means a complete build"""
+    root = Path(directory)
+    files = {
+        str(path.relative_to(root)): {"bytes": path.stat().st_size, "sha256": _sha256(path)}
+        for path in sorted(root.rglob("*"))
+        if path.is_file() and path.name != MANIFEST_FILE and ".tmp" not in path.name
+    }
+    manifest = {"version": version, "created_at": datetime.now(timezone.utc).isoformat(), **(extra or {}), "files": files}
+    tmp = root / f"{MANIFEST_FILE}.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, root / MANIFEST_FILE)
+    return manifest
+
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    return json.loads((Path(directory) / MANIFEST_FILE).read_text())
+
+
+def verify(directory: str, checksums: bool = True) -> List[str]:
+    """Problems found in an artifact (missing files, size or checksum mismatches); empty if sound
+
+    Sizes are cheap and checked on every server start; full checksums read every byte and are for
+    `build_index.py verify` / CI.
+    """
+    root = Path(directory)
+    try:
+        manifest = read_manifest(directory)
+    except (OSError, ValueError) as e:
+        return [f"manifest unreadable: {e}"]
+    problems = []
+    for name, expected in manifest["files"].items():
+        path = root / name
+        if not path.is_file():
+            problems.append(f"{name}: missing")
+        elif path.stat().st_size != expected["bytes"]:
+            problems.append(f"{name}: {path.stat().st_size} bytes, manifest says {expected['bytes']}")
+        elif checksums and _sha256(path) != expected["sha256"]:
+            problems.append(f"{name}: checksum mismatch")
+    return problems
+
+
+def publish(directory: str) -> Path:
+    """Atomically point <root>/current at this artifact (servers pick it up on their next start)"""
+    target = Path(directory).resolve()
+    link = target.parent / CURRENT_LINK
+    tmp = target.parent / f".{CURRENT_LINK}.tmp"
+    if tmp.is_symlink() or tmp.exists():
+        tmp.unlink()
+    os.symlink(target.name, tmp)
+    os.replace(tmp, link)
+    return link
+
+
+def is_artifact(directory: str) -> bool:
+    return (Path(directory) / MANIFEST_FILE).is_file()
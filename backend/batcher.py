@@ -0,0 +1,97 @@
+"""
+Dynamic micro-batching for query embeddings
+Description: Concurrent /chat and /retrieve requests each need one query embedding. Rather than one
+upstream call per request, texts submitted within a short window (or until the batch is full) are
+sent as a single multi-input embeddings call and the vectors are fanned back out to the callers.
+The window only opens when a request arrives, so an idle server adds no latency beyond it.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = REGISTRY.histogram(
+    "traffic_microbatch_size", "Items per flushed micro-batch", ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+BATCH_WAIT_SECONDS = REGISTRY.histogram(
+    "traffic_microbatch_wait_seconds", "Time items waited for their batch to be flushed", ["batcher"]
+)
+FLUSHES = REGISTRY.counter(
+    "traffic_microbatch_flushes_total", "Micro-batch flushes by trigger (window or full)", ["batcher", "reason"]
+)
+
+
+class MicroBatcher:
+    """Collects submitted items for up to `window_ms` or `max_batch` items, then runs one batch call
+
+    `batch_fn` receives the list of items and must return one result per item, in order.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List[Any]], Awaitable[List[Any]]],
+                 max_batch: int = 64, window_ms: float = 5.0):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch = max(1, max_batch)
+        self.window_ms = window_ms
+        self._pending: List[Tuple[Any, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue `item` for the next batch and await its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush("full")
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_ms / 1000, self._flush, "window")
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Drop the item if its batch hasn't been sent yet
+            self._pending = [p for p in self._pending if p[1] is not future]
+            raise
+
+    def _flush(self, reason: str) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if self._pending:
+            # Overflow beyond max_batch starts its own window
+            self._timer = asyncio.get_running_loop().call_later(self.window_ms / 1000, self._flush, "window")
+        if not batch:
+            return
+
+        FLUSHES.labels(self.name, reason).inc()
+        BATCH_SIZE.labels(self.name).observe(len(batch))
+        now = time.perf_counter()
+        for _, _, queued_at in batch:
+            BATCH_WAIT_SECONDS.labels(self.name).observe(now - queued_at)
+
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future, float]]) -> None:
+        try:
+            results = await self.batch_fn([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,422 @@
+"""
+Benchmark suite for ingestion, search and chat
+Description: Times download, parse, text conversion, embedding, index build, /retrieve, /chat and
+startup against synthetic GeoJSON and a local OpenAI stand-in, and writes machine-readable JSON so
+results can be compared between commits.
+
+Usage (from the backend directory):
+    python bench.py run --sizes 1k,10k --schemas legacy,dash --out bench-head.json
+    python bench.py compare bench-base.json bench-head.json --threshold 1.10
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from fake_openai import FakeOpenAIServer, LatencyModel
+from synthetic import SCHEMAS, parse_size, write_geojson
+
+logger = logging.getLogger("bench")
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+QUERIES = [
+    "How was traffic on Sheikh Zayed Rd in Sep 2023?",
+    "Worst congestion on Al Khail Rd during weekday mornings",
+    "Average speed near Dubai Marina on weekends",
+    "Compare Emirates Rd traffic between Oct 2022 and Oct 2023",
+    "Which segments of Al Wasl Rd are free-flowing from 7 AM to 9 AM?",
+]
+# Spread over the answer cascade's tiers: lookups, rankings, comparisons and open-ended analysis
+CASCADE_QUERIES = QUERIES + [
+    "What is the average speed on Hessa St in Sep 2023?",
+    "What was the speed on Al Khail Rd?",
+    "Worst bottlenecks in Sep 2023",
+    "Which road had the highest average speed in Sep 2023?",
+    "When is Hessa Street most congested?",
+    "Why is Sheikh Zayed Rd slow in the evening and how could congestion across corridors be reduced?",
+    "Explain the weekday traffic pattern on Emirates Rd",
+]
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "max": ordered[-1],
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+class BenchRunner:
+    """Runs every scenario for one (schema, size) pair against the real backend code paths"""
+
+    def __init__(self, backend: Any, fake: FakeOpenAIServer, workdir: Path, args: argparse.Namespace):
+        self.backend = backend
+        self.fake = fake
+        self.workdir = workdir
+        self.args = args
+        self.results: List[Dict[str, Any]] = []
+
+    def record(self, scenario: str, schema: Optional[str], size: Optional[int],
+               samples: List[float], items: int = 1, extra: Optional[Dict[str, Any]] = None) -> None:
+        seconds = _summary(samples)
+        entry = {
+            "scenario": scenario,
+            "schema": schema,
+            "size": size,
+            "seconds": seconds,
+            "items": items,
+            "per_item_us": seconds["median"] / max(items, 1) * 1e6,
+            "extra": extra or {},
+        }
+        self.results.append(entry)
+        logger.info(
+            f"⏱️ {scenario:<14} {schema or '-':<6} {size or '-':>8} "
+            f"median={seconds['median'] * 1000:9.2f} ms  p95={seconds['p95'] * 1000:9.2f} ms"
+        )
+
+    async def _timed(self, fn: Callable[[], Any], repeat: int) -> List[float]:
+        samples = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = fn()
+            if asyncio.iscoroutine(result):
+                await result
+            samples.append(time.perf_counter() - t0)
+        return samples
+
+    async def run_dataset(self, schema: str, size: int) -> None:
+        import aiohttp
+        import httpx
+
+        backend = self.backend
+        args = self.args
+        repeat = args.repeat
+        wanted = set(args.scenarios)
+
+        src_dir = self.workdir / "geojson_src"
+        src_name = f"{schema}_{size}.geojson"
+        write_geojson(src_dir / src_name, size, schema, seed=args.seed)
+        url = f"{self.fake.url}/geojson/{src_name}"
+        cache_dir = self.workdir / "geojson_cache"
+        backend.CONFIG["geojson_dir"] = str(cache_dir)
+
+        # ---- download (cold = HTTP + decode + cache write, warm = cache read) ----
+        async with aiohttp.ClientSession() as session:
+            cold, warm = [], []
+            for _ in range(repeat):
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                t0 = time.perf_counter()
+                geojson_data = await backend.GeoJSONProcessor.download_geojson(url, session)
+                cold.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                await backend.GeoJSONProcessor.download_geojson(url, session)
+                warm.append(time.perf_counter() - t0)
+        if "download" in wanted:
+            file_bytes = (src_dir / src_name).stat().st_size
+            self.record("download_cold", schema, size, cold, size, {"bytes": file_bytes})
+            self.record("download_warm", schema, size, warm, size, {"bytes": file_bytes})
+
+        # ---- parse ----
+        segments: List[Dict[str, Any]] = []
+
+        def _parse() -> None:
+            nonlocal segments
+            segments = backend.GeoJSONProcessor.extract_traffic_segments(geojson_data, "Sep", 2023)
+
+        samples = await self._timed(_parse, repeat)
+        if "parse" in wanted:
+            self.record("parse", schema, size, samples, size)
+        del geojson_data
+
+        # ---- segment -> text ----
+        texts: List[str] = []
+
+        def _to_text() -> None:
+            nonlocal texts
+            texts = [backend.GeoJSONProcessor.convert_segment_to_text(s) for s in segments]
+
+        samples = await self._timed(_to_text, repeat)
+        if "text" in wanted:
+            self.record("text", schema, size, samples, size)
+
+        # ---- embed (through the real batching code, capped to keep large runs finite) ----
+        if "embed" in wanted:
+            subset = texts[: args.embed_limit]
+            samples = await self._timed(
+                lambda: backend.EmbeddingManager.create_embeddings_batch(subset), 1
+            )
+            self.record("embed", schema, size, samples, len(subset),
+                        {"embed_limit": args.embed_limit, "upstream": dict(self.fake.stats)})
+
+        # ---- index build (locally generated unit vectors, same shape as real embeddings) ----
+        dim = backend.CONFIG["embedding_dimension"]
+        rng = np.random.default_rng(args.seed)
+        vectors = rng.standard_normal((len(segments), dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        index = None
+
+        def _build() -> None:
+            nonlocal index
+            index = backend.FAISSManager.create_index(dim)
+            backend.FAISSManager.add_embeddings(index, vectors.copy())
+
+        samples = await self._timed(_build, repeat)
+        if "index_build" in wanted:
+            self.record("index_build", schema, size, samples, len(segments),
+                        {"dimension": dim, "vector_bytes": int(vectors.nbytes)})
+
+        # Install the dataset as the live database for endpoint scenarios (paths relocated in run())
+        backend.SegmentStore.write(segments, backend.CONFIG["metadata_store_dir"])
+        backend.faiss_index = index
+        backend.segment_metadata = backend.SegmentStore(backend.CONFIG["metadata_store_dir"])
+        backend.embeddings_array_global = vectors
+
+        # Endpoint scenarios go through the ASGI app, as a client would (request parsing and all)
+        transport = httpx.ASGITransport(app=backend.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120.0) as client:
+
+            async def _post(path: str, **kwargs: Any) -> Dict[str, Any]:
+                response = await client.post(path, **kwargs)
+                response.raise_for_status()
+                return response.json()
+
+            # ---- /retrieve ----
+            if "retrieve" in wanted:
+                latencies = []
+                for i in range(args.requests):
+                    t0 = time.perf_counter()
+                    await _post("/retrieve", params={"query": QUERIES[i % len(QUERIES)], "top_k": args.top_k})
+                    latencies.append(time.perf_counter() - t0)
+                self.record("retrieve", schema, size, latencies, 1, {"top_k": args.top_k})
+
+            # ---- /chat ----
+            if "chat" in wanted:
+                latencies = []
+                for i in range(args.requests):
+                    t0 = time.perf_counter()
+                    await _post("/chat", json={"query": QUERIES[i % len(QUERIES)], "top_k": args.top_k})
+                    latencies.append(time.perf_counter() - t0)
+                self.record("chat", schema, size, latencies, 1, {"top_k": args.top_k})
+
+            # ---- /chat through the answer cascade, per tier, against every answer on the full model ----
+            if "cascade" in wanted:
+                by_tier: Dict[str, List[float]] = {}
+                for i in range(args.requests):
+                    t0 = time.perf_counter()
+                    body = await _post("/chat", json={"query": CASCADE_QUERIES[i % len(CASCADE_QUERIES)],
+                                                      "top_k": args.top_k})
+                    by_tier.setdefault(body["search_metadata"]["cascade"]["tier"], []).append(time.perf_counter() - t0)
+                full = []
+                for i in range(args.requests):
+                    t0 = time.perf_counter()
+                    await _post("/chat", json={"query": CASCADE_QUERIES[i % len(CASCADE_QUERIES)],
+                                               "top_k": args.top_k, "model_tier": "full"})
+                    full.append(time.perf_counter() - t0)
+                from cascade import check_router
+
+                extra = {"top_k": args.top_k, "tiers": {tier: len(samples) for tier, samples in by_tier.items()},
+                         "misrouted_cases": check_router(backend.get_cascade_router())}
+                self.record("chat_cascade", schema, size, [s for samples in by_tier.values() for s in samples], 1, extra)
+                self.record("chat_all_full", schema, size, full, 1, {"top_k": args.top_k})
+                for tier, samples in sorted(by_tier.items()):
+                    self.record(f"chat_{tier}", schema, size, samples, 1, {"top_k": args.top_k})
+
+        # ---- startup (index + metadata mapped from disk) ----
+        if "startup" in wanted:
+            backend.FAISSManager.save_index(index, backend.CONFIG["faiss_index_path"])
+
+            async def _load() -> None:
+                backend.faiss_index = None
+                backend.segment_metadata = []
+                backend.embeddings_array_global = None
+                await backend.load_embeddings()
+
+            samples = await self._timed(_load, repeat)
+            self.record("startup", schema, size, samples, len(segments))
+
+        backend.faiss_index = None
+        backend.segment_metadata = []
+        backend.embeddings_array_global = None
+
+    def run_import(self) -> None:
+        """Cold `import main` in a fresh interpreter"""
+        env = dict(os.environ)
+        samples = []
+        for _ in range(self.args.repeat):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "import main"], cwd=BACKEND_DIR, env=env,
+                           check=True, capture_output=True)
+            samples.append(time.perf_counter() - t0)
+        self.record("import", None, None, samples)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fake = FakeOpenAIServer(
+        dimension=args.dim,
+        embed_latency=LatencyModel(args.embed_latency_ms, args.embed_jitter_ms),
+        chat_latency=LatencyModel(args.chat_latency_ms, args.chat_jitter_ms),
+    )
+    workdir = Path(tempfile.mkdtemp(prefix="traffic-bench-"))
+    fake.geojson_dir = workdir / "geojson_src"
+    fake.start_in_thread()
+
+    # The backend reads these at import time
+    os.environ["OPENAI_BASE_URL"] = fake.openai_base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    # Never load a published artifact or route through real shard servers instead of the bench data
+    os.environ.pop("INDEX_ARTIFACT_DIR", None)
+    os.environ.pop("SHARD_SERVER_URLS", None)
+    sys.path.insert(0, str(BACKEND_DIR))
+    import main as backend
+
+    if not args.verbose:
+        logging.getLogger(backend.__name__).setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    backend.CONFIG["embedding_dimension"] = args.dim
+    # Every index, metadata, shard, artifact and checkpoint path lives in the work directory, so a run
+    # from the repo root can't pick up (or migrate) the real embeddings/
+    for key in backend.BUILD_PATH_KEYS + ("metadata_path", "artifact_root", "checkpoint_dir"):
+        backend.CONFIG[key] = str(workdir / backend.CONFIG[key])
+    fake.model_latency[backend.CONFIG["cascade"]["small_model"]] = LatencyModel(
+        args.small_chat_latency_ms, args.chat_jitter_ms / 2
+    )
+
+    runner = BenchRunner(backend, fake, workdir, args)
+    try:
+        if "import" in args.scenarios:
+            runner.run_import()
+        for schema in args.schemas:
+            for label in args.sizes:
+                await runner.run_dataset(schema, parse_size(label))
+    finally:
+        fake.stop_thread()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "faiss": getattr(sys.modules.get("faiss"), "__version__", None),
+            "args": {k: v for k, v in vars(args).items() if k != "func"},
+        },
+        "results": runner.results,
+    }
+
+
+def compare(args: argparse.Namespace) -> int:
+    """Print median ratios head/base per scenario; non-zero exit when any exceeds the threshold"""
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    def _key(r: Dict[str, Any]) -> tuple:
+        return r["scenario"], r["schema"], r["size"]
+
+    base_by_key = {_key(r): r for r in base["results"]}
+    regressions = 0
+    print(f"{'scenario':<14} {'schema':<6} {'size':>8} {'base ms':>10} {'head ms':>10} {'ratio':>7}")
+    for r in head["results"]:
+        old = base_by_key.get(_key(r))
+        if not old:
+            continue
+        before, after = old["seconds"]["median"], r["seconds"]["median"]
+        ratio = after / before if before else float("inf")
+        flag = ""
+        if ratio > args.threshold:
+            regressions += 1
+            flag = "  ⚠️ regression"
+        print(f"{r['scenario']:<14} {r['schema'] or '-':<6} {r['size'] or '-':>8} "
+              f"{before * 1000:10.2f} {after * 1000:10.2f} {ratio:7.2f}{flag}")
+    return 1 if regressions else 0
+
+
+def main() -> None:
+    scenarios = ["import", "download", "parse", "text", "embed", "index_build", "retrieve", "chat", "cascade",
+                 "startup"]
+
+    parser = argparse.ArgumentParser(description="Traffic Analysis AI benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="Run benchmarks and write JSON results")
+    run_p.add_argument("--sizes", default="1k,10k", help="Comma list from 1k,10k,100k,1m (or raw counts)")
+    run_p.add_argument("--schemas", default=",".join(SCHEMAS), help="Comma list of legacy,dash")
+    run_p.add_argument("--scenarios", default=",".join(scenarios))
+    run_p.add_argument("--repeat", type=int, default=3)
+    run_p.add_argument("--requests", type=int, default=20, help="Requests per endpoint scenario")
+    run_p.add_argument("--top-k", type=int, default=5)
+    run_p.add_argument("--embed-limit", type=int, default=2_000, help="Max texts sent through the embed path")
+    run_p.add_argument("--dim", type=int, default=1536, help="Embedding dimension (lower it for 1m runs)")
+    run_p.add_argument("--embed-latency-ms", type=float, default=50.0)
+    run_p.add_argument("--embed-jitter-ms", type=float, default=10.0)
+    run_p.add_argument("--chat-latency-ms", type=float, default=400.0)
+    run_p.add_argument("--chat-jitter-ms", type=float, default=100.0)
+    run_p.add_argument("--small-chat-latency-ms", type=float, default=150.0, help="Cascade small-model latency")
+    run_p.add_argument("--seed", type=int, default=42)
+    run_p.add_argument("--out", default=None, help="Write JSON here (stdout when omitted)")
+    run_p.add_argument("--keep", action="store_true", help="Keep the temporary work directory")
+    run_p.add_argument("--verbose", action="store_true", help="Keep backend INFO logging")
+
+    cmp_p = sub.add_parser("compare", help="Compare two result files")
+    cmp_p.add_argument("base")
+    cmp_p.add_argument("head")
+    cmp_p.add_argument("--threshold", type=float, default=1.10, help="Median ratio treated as a regression")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == "compare":
+        sys.exit(compare(args))
+
+    args.sizes = [s for s in args.sizes.split(",") if s]
+    args.schemas = [s for s in args.schemas.split(",") if s]
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(scenarios)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run(args))
+    payload = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(payload)
+        logger.info(f"💾 Wrote {len(report['results'])} results to {args.out}")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
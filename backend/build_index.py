@@ -0,0 +1,136 @@
+"""
+Offline index builder
+Description: Runs the same download → parse → embed → index pipeline as /create-embeddings
+(GeoJSONProcessor, EmbeddingManager, FAISSManager via main.build_index), but as a batch job instead
+of inside a serving process. Each build is written to a fresh versioned artifact directory with
+precomputed stats and a checksummed manifest (see artifacts.py); servers map it read-only.
+
+Usage (from the directory holding embeddings/):
+    python backend/build_index.py build --file 2023_Sep=https://.../Sep.geojson \\
+                                        --file 2022_Sep=https://.../Sep.geojson --publish
+    python backend/build_index.py verify embeddings/builds/20250101T000000Z
+    python backend/build_index.py publish embeddings/builds/20250101T000000Z
+
+Servers load <artifact_root>/current (or INDEX_ARTIFACT_DIR) at startup.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import artifacts
+
+logger = logging.getLogger("build_index")
+
+
+def _parse_files(specs: List[str]) -> Tuple[List[str], List[str]]:
+    keys, urls = [], []
+    for spec in specs:
+        key, sep, url = spec.partition("=")
+        if not sep or not key or not url:
+            raise SystemExit(f"--file expects KEY=URL (e.g. 2023_Sep=https://...), got {spec!r}")
+        keys.append(key)
+        urls.append(url)
+    return keys, urls
+
+
+async def _build(args: argparse.Namespace) -> int:
+    import main
+    from metrics import request_timer
+    from shards import ShardSet
+    from store import SegmentStore
+
+    keys, urls = _parse_files(args.file)
+    version = args.version or artifacts.new_version()
+    out = Path(args.out or main.CONFIG["artifact_root"]) / version
+    if out.exists():
+        raise SystemExit(f"{out} already exists; artifacts are immutable, pick another --version")
+    staging = out.with_name(f".{version}.partial")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    paths = artifacts.artifact_paths(str(staging))
+
+    started = time.perf_counter()
+    try:
+        with request_timer("build-index") as timer:
+            result = await main.build_index(urls, keys, paths)
+        stats = main.index_stats(
+            result["index"], SegmentStore(paths["metadata_store_dir"]),
+            ShardSet(paths["shard_dir"], 0) if ShardSet.exists(paths["shard_dir"]) else None, paths
+        )
+        stats["version"] = version
+        Path(paths["stats_path"]).write_text(json.dumps(stats))
+        artifacts.write_manifest(str(staging), version, {
+            "embedding_space": result["embedding_space"],
+            "files_processed": result["files_processed"],
+            "total_embeddings": result["total_embeddings"],
+            "failed_embeddings": result["failed_embeddings"],
+            "sources": dict(zip(keys, urls)),
+        })
+        # Rename into place: a directory under its final name is always complete
+        staging.rename(out)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    finally:
+        main.search_executor.shutdown()
+
+    logger.info(
+        f"✅ Built artifact {version} in {time.perf_counter() - started:.1f}s: "
+        f"{result['total_embeddings']} embeddings ({result['resumed_embeddings']} resumed, "
+        f"{result['failed_embeddings']} failed); stages {timer.as_dict()}"
+    )
+    if result["failed_embeddings"]:
+        logger.warning("⚠️ Some segments failed to embed; re-run the same build to retry them (not published)")
+        return 2
+    if args.publish:
+        logger.info(f"🔗 {artifacts.publish(str(out))} → {version}")
+    print(out)
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build, verify and publish versioned index artifacts")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Build a new artifact from GeoJSON files")
+    build.add_argument("--file", action="append", required=True, metavar="KEY=URL",
+                       help="Month key (YYYY_Mon) and GeoJSON URL; repeat in chronological order")
+    build.add_argument("--out", help="Artifact root (default: CONFIG['artifact_root'])")
+    build.add_argument("--version", help="Version name (default: UTC timestamp)")
+    build.add_argument("--publish", action="store_true", help="Point <root>/current at the new build")
+
+    check = sub.add_parser("verify", help="Check sizes and SHA-256 of every file against the manifest")
+    check.add_argument("directory")
+
+    pub = sub.add_parser("publish", help="Atomically point <root>/current at an artifact")
+    pub.add_argument("directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "build":
+        sys.exit(asyncio.run(_build(args)))
+    if args.command == "verify":
+        problems = artifacts.verify(args.directory)
+        for problem in problems:
+            print(f"✗ {problem}")
+        if not problems:
+            print(f"✓ {args.directory}: {len(artifacts.read_manifest(args.directory)['files'])} files match the manifest")
+        sys.exit(1 if problems else 0)
+    if args.command == "publish":
+        problems = artifacts.verify(args.directory, checksums=False)
+        if problems:
+            sys.exit(f"Refusing to publish: {'; '.join(problems[:5])}")
+        print(f"{artifacts.publish(args.directory)} → {Path(args.directory).name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Client-disconnect detection and deadline propagation
+Description: A request whose client has gone away (closed tab, aborted fetch) keeps running to the
+end unless something cancels it. `run_until_disconnect` races the handler's work against the ASGI
+disconnect message and cancels the work — and with it any in-flight OpenAI call or queued search
+job — as soon as the client leaves. `within_deadline` bounds each pipeline stage by what remains
+of the request's overall deadline.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Optional
+
+from fastapi import Request
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ABANDONED = REGISTRY.counter(
+    "traffic_abandoned_requests_total", "Requests whose work was cancelled early", ["endpoint", "reason"]
+)
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before the response was ready"""
+
+
+class DeadlineExceeded(Exception):
+    """A pipeline stage could not finish within the request deadline"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"deadline exceeded during {stage}")
+        self.stage = stage
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left until `deadline` (a time.monotonic() value), or None for no deadline"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+async def within_deadline(awaitable: Awaitable[Any], deadline: Optional[float], stage: str) -> Any:
+    """Await `awaitable`, cancelling it and raising DeadlineExceeded once `deadline` passes"""
+    left = remaining(deadline)
+    if left is not None and left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(stage)
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_until_disconnect(request: Request, awaitable: Awaitable[Any], endpoint: str) -> Any:
+    """Await `awaitable`, cancelling it and raising ClientDisconnected if the client goes away"""
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if not work.done():
+            work.cancel()
+        watcher.cancel()
+
+    if work.done() and not work.cancelled():
+        return work.result()
+
+    # Let the cancelled work unwind (closing upstream connections) before reporting
+    await asyncio.gather(work, return_exceptions=True)
+    ABANDONED.labels(endpoint, "disconnect").inc()
+    logger.info(f"🔌 Client disconnected, cancelled {endpoint} work")
+    raise ClientDisconnected(endpoint)
@@ -0,0 +1,286 @@
+"""
+Model cascade for chat answers
+Description: Every /chat call used to go to the same model with the same prompt, whether the
+question was "what is the average speed on Hessa St in Aug 2023" or an open-ended corridor
+analysis. A router now classifies each request from cheap signals it already has (the QueryParser
+output, the answer kind, query length, and the shape of the retrieval scores) into one of three
+tiers:
+
+    template  answered from the retrieved data or exact hotspot features, no model call
+    small     a smaller, faster model for short factual or comparison answers
+    full      the full model, reserved for open-ended analysis
+
+Routers are pluggable (ROUTERS, chosen by CONFIG["cascade"]["router"] with options from the entry
+of the same name); "rules" is the default and "full" disables the cascade. Each tier's answer
+latency is tracked in-process (TierStats, served on /cascade/stats) and as Prometheus series, so
+tiers can be measured against fake_openai.py.
+"""
+
+from __future__ import annotations
+
+import re
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+
+from metrics import REGISTRY
+from prompt_budget import answer_kind, is_open_ended
+
+TIERS = ("template", "small", "full")
+
+CASCADE_ROUTES = REGISTRY.counter(
+    "traffic_cascade_routes_total", "Chat answers per cascade tier and routing reason", ["tier", "reason"]
+)
+CASCADE_SECONDS = REGISTRY.histogram(
+    "traffic_cascade_answer_seconds", "Answer-generation latency per cascade tier", ["tier"]
+)
+
+_MULTI_PART = re.compile(r"\b(versus|vs\.?|between|across|corridors|each|every)\b", re.I)
+# What the template tier can state: average speed, speed limit, congestion class
+_TEMPLATE_FIELDS = re.compile(r"\b(speeds?|how fast|limits?|congest\w*|how busy)\b", re.I)
+_SUPERLATIVE = re.compile(
+    r"\b(highest|lowest|fastest|slowest|quickest|busiest|most|least|best|worst|max(imum)?|min(imum)?|top)\b", re.I
+)
+_WHICH = re.compile(r"\bwhich\b", re.I)
+_TIME = re.compile(
+    r"\b(when|times?|hours?|peak|mornings?|evenings?|nights?|\d{1,2}\s*(am|pm)|cross(ing)?|duration|how long)\b", re.I
+)
+
+
+class Route:
+    """A routing decision: tier, the rule that chose it, and the signals it saw"""
+
+    def __init__(self, tier: str, reason: str, signals: Dict[str, Any]):
+        self.tier = tier
+        self.reason = reason
+        self.signals = signals
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"tier": self.tier, "reason": self.reason, "signals": self.signals}
+
+
+def query_signals(query: str, parsed: Dict[str, Any], kind: str, scores: Sequence[float],
+                  has_comparison: bool = False, has_ranking: bool = False,
+                  street: Optional[str] = None) -> Dict[str, Any]:
+    """Cheap features of one request; nothing here calls a model
+
+    `street` is the street name matched in the query (comparison.match_street), if any.
+    """
+    ordered = sorted((float(s) for s in scores), reverse=True)
+    top = ordered[0] if ordered else 0.0
+    rest = ordered[1:]
+    return {
+        "kind": kind,
+        "words": len(query.split()),
+        "filters": len(parsed.get("filters", [])),
+        "street": street,
+        "open_ended": is_open_ended(query),
+        "multi_part": bool(_MULTI_PART.search(query)),
+        "template_fields": bool(_TEMPLATE_FIELDS.search(query)),
+        "superlative": bool(_SUPERLATIVE.search(query)),
+        "which": bool(_WHICH.search(query)),
+        "time": bool(_TIME.search(query)),
+        "top_score": round(top, 4),
+        # How clearly the best match stands out from the rest of the top-k
+        "margin": round(top - sum(rest) / len(rest), 4) if rest else 0.0,
+        "comparison": has_comparison,
+        "ranking": has_ranking,
+    }
+
+
+class CascadeRouter:
+    """Picks a tier for a request; subclass and register in ROUTERS to plug in another policy"""
+
+    name = "base"
+
+    def route(self, signals: Dict[str, Any]) -> Route:
+        raise NotImplementedError
+
+
+class FullRouter(CascadeRouter):
+    """Cascade off: every answer goes to the full model"""
+
+    name = "full"
+
+    def route(self, signals: Dict[str, Any]) -> Route:
+        return Route("full", "cascade_disabled", signals)
+
+
+class RuleRouter(CascadeRouter):
+    """Threshold rules over query_signals()
+
+    The template tier only restates data, so it takes a lookup only when the question asks for
+    what a template states (average speed, limit, congestion) about a street the query names (and,
+    if given, the period the parser matched), and retrieval is confident (a high best score that
+    stands clear of the others). Superlatives ("highest", "fastest"), "which" and time questions
+    ("when", "time to cross") need an answer the retrieved rows don't spell out, so they go to the
+    small model at least.
+    """
+
+    name = "rules"
+
+    def __init__(self, min_top_score: float = 0.45, min_margin: float = 0.03, max_simple_words: int = 16,
+                 max_short_words: int = 10):
+        self.min_top_score = min_top_score
+        self.min_margin = min_margin
+        self.max_simple_words = max_simple_words
+        self.max_short_words = max_short_words
+
+    def route(self, signals: Dict[str, Any]) -> Route:
+        kind = signals["kind"]
+        if signals["open_ended"]:
+            return Route("full", "open_ended", signals)
+        if kind == "analysis":
+            # Neither a lookup nor open-ended ("How was traffic on X in Sep 2023?")
+            if signals["words"] <= self.max_short_words and not signals["multi_part"]:
+                return Route("small", "short_question", signals)
+            return Route("full", "general_analysis", signals)
+        if signals["words"] > self.max_simple_words or (signals["multi_part"] and not signals["comparison"]):
+            return Route("full", "long_or_multi_part", signals)
+        if signals["time"]:
+            return Route("small", "time_question", signals)
+        if kind == "ranking" and signals["ranking"]:
+            return Route("template", "exact_ranking", signals)
+        if signals["superlative"] or signals["which"]:
+            return Route("small", "superlative_or_which", signals)
+        if (kind == "lookup" and signals["template_fields"] and signals["street"]
+                and signals["top_score"] >= self.min_top_score and signals["margin"] >= self.min_margin):
+            return Route("template", "confident_lookup", signals)
+        return Route("small", kind, signals)
+
+
+ROUTERS = {router.name: router for router in (RuleRouter, FullRouter)}
+
+# (query, QueryParser output, matched street, exact ranking available, expected RuleRouter tier),
+# routed with confident retrieval scores; `python cascade.py` and bench.py's cascade scenario check them
+ROUTER_CASES = [
+    ("What is the average speed on Hessa St in Sep 2023?", {"filters": [{"month": "Sep", "year": 2023}]},
+     "Hessa St", False, "template"),
+    ("What was the speed limit on Al Khail Rd?", {}, "Al Khail Rd", False, "template"),
+    ("What is the average speed in Dubai?", {}, None, False, "small"),
+    ("What was the average speed in Sep 2023?", {"filters": [{"month": "Sep", "year": 2023}]}, None, False, "small"),
+    ("Which road had the highest average speed in Sep 2023?", {"filters": [{"month": "Sep", "year": 2023}]},
+     None, False, "small"),
+    ("What is the fastest time to cross Al Khail Road?", {}, "Al Khail Road", False, "small"),
+    ("When is Hessa Street most congested?", {"hotspots": "speed_ratio"}, "Hessa Street", True, "small"),
+    ("Worst bottlenecks in Sep 2023", {"filters": [{"month": "Sep", "year": 2023}], "hotspots": "speed_ratio"},
+     None, True, "template"),
+    ("Why is Sheikh Zayed Rd slow in the evening?", {}, "Sheikh Zayed Rd", False, "full"),
+]
+CONFIDENT_SCORES = (0.8, 0.5, 0.45, 0.4, 0.4)
+
+
+def make_router(config: Dict[str, Any]) -> CascadeRouter:
+    """Router named by config["router"], constructed with config[<name>] as keyword options"""
+    name = config.get("router", "rules")
+    try:
+        router = ROUTERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown cascade router {name!r} (known: {', '.join(ROUTERS)})") from None
+    return router(**config.get(name, {}))
+
+
+def check_router(router: CascadeRouter) -> List[str]:
+    """ROUTER_CASES the router sends to an unexpected tier (empty when all match)"""
+    problems = []
+    for query, parsed, street, has_ranking, expected in ROUTER_CASES:
+        kind = answer_kind(query, False, has_ranking)
+        route = router.route(query_signals(query, parsed, kind, CONFIDENT_SCORES, False, has_ranking, street))
+        if route.tier != expected:
+            problems.append(f"{query!r}: {route.tier} ({route.reason}), expected {expected}")
+    return problems
+
+
+class TierStats:
+    """Recent answer latencies per tier (the Prometheus histogram keeps the long-run view)"""
+
+    def __init__(self, window: int = 512):
+        self._latencies = {tier: deque(maxlen=window) for tier in TIERS}
+        self._counts = {tier: 0 for tier in TIERS}
+
+    def record(self, route: Route, seconds: float) -> None:
+        self._latencies[route.tier].append(seconds)
+        self._counts[route.tier] += 1
+        CASCADE_ROUTES.labels(route.tier, route.reason).inc()
+        CASCADE_SECONDS.labels(route.tier).observe(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for tier in TIERS:
+            ordered = sorted(self._latencies[tier])
+            quantile = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+            out[tier] = {
+                "answers": self._counts[tier],
+                "p50_ms": quantile(0.5) if ordered else None,
+                "p95_ms": quantile(0.95) if ordered else None,
+                "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+            }
+        return out
+
+
+# ---------- Template tier ----------
+def _speed_line(segment: Dict[str, Any], language: str) -> str:
+    features = segment.get("features") or {}
+    limit = segment.get("speed_limit")
+    congestion = features.get("congestion_class")
+    if language == "ar":
+        line = (f"* {segment['street_name']} ({segment['month']} {segment['year']}): "
+                f"متوسط السرعة {segment['average_speed']:.1f} كم/س")
+        if limit:
+            line += f" من حد {float(limit):.0f} كم/س"
+        return line
+    line = (f"* {segment['street_name']} ({segment['month']} {segment['year']}): "
+            f"avg speed {segment['average_speed']:.1f} km/h")
+    if limit:
+        line += f" against a {float(limit):.0f} km/h limit"
+    if congestion:
+        line += f", {congestion} congestion"
+    return line
+
+
+def _matches(segment: Dict[str, Any], street: str, filters: Sequence[Dict[str, Any]]) -> bool:
+    if not str(segment.get("street_name", "")).lower().startswith(street.lower()):
+        return False
+    return not filters or any(
+        str(segment.get("month", ""))[:3].lower() == f["month"].lower() and segment.get("year") == f["year"]
+        for f in filters
+    )
+
+
+def template_answer(similar_segments: List[Dict[str, Any]], ranking: Optional[Dict[str, Any]] = None,
+                    language: str = "en", max_rows: int = 3, street: Optional[str] = None,
+                    filters: Sequence[Dict[str, Any]] = ()) -> Optional[str]:
+    """Bullet answer built straight from the data, or None when there is nothing to state
+
+    Lookup rows are limited to the matched `street` and QueryParser period `filters`, so an
+    unrelated but semantically close segment is never stated as the answer; without a street
+    there is no lookup to answer.
+    """
+    if ranking and ranking.get("hotspots"):
+        rows = ranking["hotspots"][:max_rows]
+        if language == "ar":
+            lines = [f"* أكثر المقاطع ازدحامًا في {ranking['period']}:"]
+            lines += [f"* {r['street_name']} (المقطع {r['segment_id']}): {r['average_speed']} كم/س"
+                      + (f" من حد {r['speed_limit']} كم/س" if r["speed_limit"] is not None else "") for r in rows]
+        else:
+            lines = [f"* Worst segments in {ranking['period']} by {ranking['metric']}:"]
+            lines += [f"* {r['street_name']} (segment {r['segment_id']}): {r['average_speed']} km/h"
+                      + (f" of {r['speed_limit']} km/h limit" if r["speed_limit"] is not None else "")
+                      + (f", {r['congestion_class']} congestion" if r["congestion_class"] else "") for r in rows]
+        return "\n".join(lines)
+    if not street:
+        return None
+    rows = [segment for segment in similar_segments if _matches(segment, street, filters)]
+    if not rows:
+        return None
+    return "\n".join(_speed_line(segment, language) for segment in rows[:max_rows])
+
+
+if __name__ == "__main__":
+    import sys
+
+    mismatches = check_router(RuleRouter())
+    for mismatch in mismatches:
+        print(f"✗ {mismatch}")
+    if not mismatches:
+        print(f"✓ {len(ROUTER_CASES)} routing cases match")
+    sys.exit(1 if mismatches else 0)
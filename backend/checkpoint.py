@@ -0,0 +1,133 @@
+"""
+Resumable embedding checkpoints
+Description: A large /create-embeddings run used to hold every vector in memory until the very end,
+so a crash or a quota wall at 80% threw away all the paid work, and failed batches were silently
+stored as zero vectors. Here each run writes into a memory-mapped (items × dimension) array plus a
+per-item status array, flushed after every batch. A run over the same texts in the same embedding
+space reopens the checkpoint and only embeds what is still pending or previously failed.
+
+Layout (under CONFIG["checkpoint_dir"]/<run id>/):
+    vectors.npy     float32 (items × dimension), valid where status == DONE
+    status.npy      int8 per item: PENDING, DONE or FAILED
+    failures.json   last error per failed item, for inspection
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from lazy import LazyModule
+
+np = LazyModule("numpy")
+
+logger = logging.getLogger(__name__)
+
+PENDING, DONE, FAILED = 0, 1, -1
+
+
+class EmbeddingRunAborted(Exception):
+    """Too many consecutive batches failed (quota, outage); progress so far is checkpointed"""
+
+
+def run_id(texts: Sequence[str], space: str) -> str:
+    """Identity of an embedding run: the exact inputs and the embedding space they go into"""
+    digest = hashlib.sha256(space.encode())
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode()).digest())
+    return digest.hexdigest()[:24]
+
+
+class EmbeddingCheckpoint:
+    """Per-item embedding progress for one run, persisted after every batch
+
+    With `root=None` progress is only kept in memory (benchmarks, throwaway runs).
+    """
+
+    def __init__(self, root: Optional[str], texts: Sequence[str], space: str, dimension: int):
+        n = len(texts)
+        self.persistent = root is not None
+        if not self.persistent:
+            self.directory = None
+            self.vectors = np.zeros((n, dimension), dtype=np.float32)
+            self.status = np.zeros(n, dtype=np.int8)
+            self._failures: Dict[str, str] = {}
+            return
+        self.directory = Path(root) / run_id(texts, space)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        vectors_path, status_path = self.directory / "vectors.npy", self.directory / "status.npy"
+        if vectors_path.exists() and status_path.exists():
+            self.vectors = np.load(vectors_path, mmap_mode="r+")
+            self.status = np.load(status_path, mmap_mode="r+")
+            logger.info(
+                f"♻️ Resuming embedding run {self.directory.name}: {self.done_count}/{n} embedded, "
+                f"{int((self.status == FAILED).sum())} to retry"
+            )
+        else:
+            # Status is created last: a checkpoint without it is incomplete and is started over
+            self.vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(n, dimension))
+            status = np.lib.format.open_memmap(self.directory / "status.tmp.npy", mode="w+", dtype=np.int8, shape=(n,))
+            status.flush()
+            del status
+            os.replace(self.directory / "status.tmp.npy", status_path)
+            self.status = np.load(status_path, mmap_mode="r+")
+        self._failures = self._read_failures()
+
+    def _read_failures(self) -> Dict[str, str]:
+        try:
+            return json.loads((self.directory / "failures.json").read_text())
+        except (OSError, ValueError):
+            return {}
+
+    @property
+    def done(self) -> "np.ndarray":
+        return self.status == DONE
+
+    @property
+    def done_count(self) -> int:
+        return int(self.done.sum())
+
+    @property
+    def failed_count(self) -> int:
+        return int((self.status == FAILED).sum())
+
+    def pending_batches(self, batch_size: int) -> Iterator[List[int]]:
+        """Item indices still to embed (pending or failed earlier), in batches"""
+        todo = np.flatnonzero(self.status != DONE)
+        for start in range(0, len(todo), batch_size):
+            yield todo[start:start + batch_size].tolist()
+
+    def record(self, indices: Sequence[int], vectors: Sequence[Sequence[float]]) -> None:
+        # Vectors reach the disk before the status that marks them valid
+        self.vectors[indices] = np.asarray(vectors, dtype=np.float32)
+        self._flush(self.vectors)
+        self.status[indices] = DONE
+        self._flush(self.status)
+        if any([self._failures.pop(str(i), None) for i in indices]):
+            self._write_failures()
+
+    def record_failure(self, indices: Sequence[int], error: str) -> None:
+        self.status[indices] = FAILED
+        self._flush(self.status)
+        self._failures.update({str(i): error for i in indices})
+        self._write_failures()
+
+    def _flush(self, array: "np.ndarray") -> None:
+        if self.persistent:
+            array.flush()
+
+    def _write_failures(self) -> None:
+        if not self.persistent:
+            return
+        tmp = self.directory / "failures.tmp.json"
+        tmp.write_text(json.dumps(self._failures))
+        os.replace(tmp, self.directory / "failures.json")
+
+    def remove(self) -> None:
+        """Drop the checkpoint once its vectors are safely in a built index"""
+        del self.vectors, self.status
+        if self.persistent:
+            shutil.rmtree(self.directory, ignore_errors=True)
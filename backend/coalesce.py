@@ -0,0 +1,73 @@
+"""
+Single-flight request coalescing
+Description: Concurrent callers asking for the same key await one shared task instead of each
+repeating the same upstream embedding, search or LLM call (e.g. a dashboard refresh fanning out
+identical queries). The shared work is cancelled only when every waiter has gone away.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COALESCED = REGISTRY.counter(
+    "traffic_singleflight_total", "Single-flight calls by role (leader runs the work, follower shares it)",
+    ["flight", "role"]
+)
+INFLIGHT_KEYS = REGISTRY.gauge("traffic_singleflight_inflight", "Distinct keys currently in flight", ["flight"])
+
+
+def normalize_query(text: str) -> str:
+    """Whitespace-insensitive form of a user query, used in coalescing keys"""
+    return " ".join(text.split())
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls with equal keys onto one shared task"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._inflight = INFLIGHT_KEYS.labels(name)
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+            self._inflight.dec()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() — or the identical call already running for `key`"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            self._inflight.inc()
+            call.task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+            COALESCED.labels(self.name, "leader").inc()
+        else:
+            COALESCED.labels(self.name, "follower").inc()
+
+        call.waiters += 1
+        try:
+            # Shield so one waiter's cancellation doesn't cancel the result for the others
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+
+    def in_flight(self, key: Hashable) -> bool:
+        """True when a call for `key` is running (the next do() would follow it)"""
+        return key in self._calls
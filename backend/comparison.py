@@ -0,0 +1,184 @@
+"""
+Period-over-period comparison on the segment table
+Description: "How did Sep 2023 compare to Sep 2022 on this corridor?" is answered exactly rather
+than by retrieval: the two period columns of the SegmentTable are already joined on segment_id, so
+speed, travel-time and congestion-class deltas for every segment, per-street aggregates and the top
+regressions/improvements are a handful of NumPy operations.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Optional
+
+from lazy import LazyModule
+from segment_table import SegmentTable, period_key, period_label
+
+np = LazyModule("numpy")
+
+# Same thresholds (share of the speed limit) as GeoJSONProcessor.convert_segment_to_text
+CONGESTION_LABELS = ("minimal", "moderate", "heavy", "severe")
+CONGESTION_BOUNDS = (0.4, 0.6, 0.8)
+
+
+def parse_period(text: str) -> Optional[int]:
+    """period_key() for 'Sep 2023', 'September 2023', '2023_Sep' (file keys) or '2023-09'"""
+    text = text.strip()
+    m = re.fullmatch(r"(\d{4})-(\d{1,2})", text)
+    if m and 1 <= int(m.group(2)) <= 12:
+        return int(m.group(1)) * 12 + int(m.group(2)) - 1
+    m = re.fullmatch(r"([A-Za-z]+)[\s_,-]*(\d{4})", text) or re.fullmatch(r"(\d{4})[\s_,-]*([A-Za-z]+)", text)
+    if not m:
+        return None
+    month, year = (m.group(1), m.group(2)) if m.group(1).isalpha() else (m.group(2), m.group(1))
+    return period_key(month, year)
+
+
+def congestion_class(speed: np.ndarray, limit: np.ndarray) -> np.ndarray:
+    """0 = minimal … 3 = severe; -1 where speed or limit is missing"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = speed / limit
+    classes = (len(CONGESTION_BOUNDS) - np.digitize(ratio, CONGESTION_BOUNDS)).astype(np.int8)
+    classes[~np.isfinite(ratio)] = -1
+    return classes
+
+
+def match_street(query: str, table: SegmentTable) -> Optional[str]:
+    """Longest street name (without direction suffix) mentioned in the query, if any"""
+    q = query.lower()
+    names = {str(name).split(" - ")[0].strip() for name in table.street_index()[0]}
+    found = [name for name in names if len(name) > 3 and name.lower() in q]
+    return max(found, key=len) if found else None
+
+
+def _round(values: np.ndarray, digits: int = 2) -> List[Optional[float]]:
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def compare_periods(table: SegmentTable, base_key: int, target_key: int,
+                    street: Optional[str] = None, top_n: int = 10) -> Dict[str, Any]:
+    """Join two periods on segment_id and summarize the change (target minus base)"""
+    a, b = table.column(base_key), table.column(target_key)
+    if a is None or b is None:
+        missing = [period_label(k) for k, col in ((base_key, a), (target_key, b)) if col is None]
+        raise KeyError(f"No data for {', '.join(missing)}")
+
+    speed = table.measure("average_speed")
+    travel = table.measure("travel_time")
+    speed_a, speed_b = speed[:, a], speed[:, b]
+    street_names, street_codes = table.street_index()
+    limits = table.attribute("speed_limit")
+
+    mask = ~np.isnan(speed_a) & ~np.isnan(speed_b)
+    if street:
+        wanted = [i for i, name in enumerate(street_names) if street.lower() in str(name).lower()]
+        mask &= np.isin(street_codes, wanted)
+    rows = np.flatnonzero(mask)
+
+    speed_a, speed_b = speed_a[rows], speed_b[rows]
+    travel_a, travel_b = travel[rows, a], travel[rows, b]
+    class_a = congestion_class(speed_a, limits[rows])
+    class_b = congestion_class(speed_b, limits[rows])
+    d_speed = speed_b - speed_a
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pct_speed = np.where(speed_a > 0, d_speed / speed_a * 100, np.nan)
+    d_class = np.where((class_a >= 0) & (class_b >= 0), class_b.astype(np.int16) - class_a, 0)
+
+    def segment_rows(order: np.ndarray) -> List[Dict[str, Any]]:
+        picked = order[:top_n]
+        return [
+            {
+                "segment_id": str(table.segment_ids[rows[i]]),
+                "street_name": str(street_names[street_codes[rows[i]]]),
+                "speed_before": round(float(speed_a[i]), 2),
+                "speed_after": round(float(speed_b[i]), 2),
+                "speed_change": round(float(d_speed[i]), 2),
+                "speed_change_pct": None if np.isnan(pct_speed[i]) else round(float(pct_speed[i]), 1),
+                "travel_time_change": None if np.isnan(travel_b[i] - travel_a[i]) else round(float(travel_b[i] - travel_a[i]), 2),
+                "congestion_before": CONGESTION_LABELS[class_a[i]] if class_a[i] >= 0 else None,
+                "congestion_after": CONGESTION_LABELS[class_b[i]] if class_b[i] >= 0 else None,
+            }
+            for i in picked
+        ]
+
+    order = np.argsort(d_speed, kind="stable")
+    regressions = order[d_speed[order] < 0]
+    improvements = order[::-1][d_speed[order[::-1]] > 0]
+
+    # Per-street aggregates: group-by on precomputed street codes
+    present, group = np.unique(street_codes[rows], return_inverse=True)
+    names = street_names[present]
+    counts = np.bincount(group, minlength=len(names))
+    def group_mean(values: np.ndarray) -> np.ndarray:
+        ok = ~np.isnan(values)
+        n = np.bincount(group[ok], minlength=len(names))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.bincount(group[ok], weights=values[ok], minlength=len(names)) / n
+    street_before, street_after = group_mean(speed_a), group_mean(speed_b)
+    street_change = street_after - street_before
+    street_travel_change = group_mean(travel_b - travel_a)
+    street_worse = np.bincount(group, weights=d_class > 0, minlength=len(names))
+    street_order = np.argsort(street_change, kind="stable")
+    by_street = [
+        {
+            "street_name": str(names[g]),
+            "segments": int(counts[g]),
+            "avg_speed_before": round(float(street_before[g]), 2),
+            "avg_speed_after": round(float(street_after[g]), 2),
+            "avg_speed_change": round(float(street_change[g]), 2),
+            "avg_travel_time_change": _round(street_travel_change[g:g + 1])[0],
+            "segments_worse_class": int(street_worse[g]),
+        }
+        for g in street_order
+    ]
+
+    mean_a = float(speed_a.mean()) if len(rows) else float("nan")
+    mean_b = float(speed_b.mean()) if len(rows) else float("nan")
+    return {
+        "base_period": period_label(base_key),
+        "target_period": period_label(target_key),
+        "street_filter": street,
+        "segments_compared": int(len(rows)),
+        "summary": {
+            "avg_speed_before": _round(np.array([mean_a]))[0],
+            "avg_speed_after": _round(np.array([mean_b]))[0],
+            "avg_speed_change": _round(np.array([mean_b - mean_a]))[0],
+            "avg_speed_change_pct": _round(np.array([(mean_b - mean_a) / mean_a * 100 if mean_a else np.nan]), 1)[0],
+            "segments_slower": int((d_speed < 0).sum()),
+            "segments_faster": int((d_speed > 0).sum()),
+            "congestion_worse": int((d_class > 0).sum()),
+            "congestion_better": int((d_class < 0).sum()),
+        },
+        "top_regressions": segment_rows(regressions),
+        "top_improvements": segment_rows(improvements),
+        "by_street": by_street,
+    }
+
+
+def _signed(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:+}"
+
+
+def format_comparison(result: Dict[str, Any], max_rows: int = 5) -> str:
+    """Compact, exact text block for the LLM context"""
+    s = result["summary"]
+    lines = [
+        f"EXACT COMPARISON {result['base_period']} → {result['target_period']}"
+        + (f" on {result['street_filter']}" if result["street_filter"] else "")
+        + f" ({result['segments_compared']} matched segments):",
+        f"Average speed {s['avg_speed_before']} → {s['avg_speed_after']} km/h "
+        f"({_signed(s['avg_speed_change'])} km/h, {_signed(s['avg_speed_change_pct'])}%); "
+        f"{s['segments_slower']} segments slower, {s['segments_faster']} faster; "
+        f"congestion class worse on {s['congestion_worse']}, better on {s['congestion_better']}.",
+    ] if result["segments_compared"] else [
+        f"EXACT COMPARISON {result['base_period']} → {result['target_period']}: no segments present in both periods."
+    ]
+    for title, key in (("Largest slowdowns", "top_regressions"), ("Largest improvements", "top_improvements")):
+        if result[key]:
+            lines.append(f"{title}:")
+            for row in result[key][:max_rows]:
+                lines.append(
+                    f"- {row['street_name']} (segment {row['segment_id']}): "
+                    f"{row['speed_before']} → {row['speed_after']} km/h ({_signed(row['speed_change'])})"
+                )
+    return "\n".join(lines)
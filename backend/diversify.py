@@ -0,0 +1,66 @@
+"""
+Maximal-marginal-relevance re-ranking of retrieved segments
+Description: With many months in the index, a query's top-k is often the same road segment repeated
+once per month, which fills the result slots and the LLM context with near-duplicates. Here a wider
+shortlist is re-ranked greedily by MMR: each pick maximizes
+    lambda * similarity(query, candidate) - (1 - lambda) * max similarity(candidate, already picked)
+over the shortlist's embeddings, with the candidate-candidate similarities computed once as one
+matrix product. Optionally every segment_id is allowed only once.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr(query: np.ndarray, candidates: Optional[np.ndarray], k: int, lambda_: float = 0.7,
+        groups: Optional[np.ndarray] = None, relevance: Optional[np.ndarray] = None) -> np.ndarray:
+    """Positions of `k` shortlist entries in pick order
+
+    `candidates` are the shortlist's embeddings (n × d), or None to skip the diversity term and
+    only deduplicate. `groups` (n, any dtype) allows one pick per distinct value, e.g. segment_id.
+    `relevance` defaults to the cosine similarity of each candidate to `query`; lambda 1.0 is the
+    plain relevance order.
+    """
+    n = len(relevance) if relevance is not None else len(candidates)
+    if n == 0 or k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if candidates is not None:
+        vectors = _normalized(candidates)
+        if relevance is None:
+            relevance = vectors @ _normalized(query).reshape(-1)
+        similarity = vectors @ vectors.T
+    else:
+        similarity = None
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    if groups is not None:
+        _, group = np.unique(np.asarray(groups), return_inverse=True)
+    available = np.ones(n, dtype=bool)
+    redundancy = np.full(n, -np.inf if similarity is None else -1.0, dtype=np.float32)
+    picked = []
+    for _ in range(min(k, n)):
+        if similarity is None:
+            score = np.where(available, relevance, -np.inf)
+        else:
+            score = np.where(available, lambda_ * relevance - (1 - lambda_) * np.maximum(redundancy, 0), -np.inf)
+        best = int(np.argmax(score))
+        if not available[best]:
+            break  # everything left shares a segment_id with a pick
+        picked.append(best)
+        available[best] = False
+        if groups is not None:
+            available &= group != group[best]
+        if similarity is not None:
+            np.maximum(redundancy, similarity[best], out=redundancy)
+    return np.asarray(picked, dtype=np.int64)
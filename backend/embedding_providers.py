@@ -0,0 +1,245 @@
+"""
+Embedding providers with hedging, failover and health-based routing
+Description: Query latency is dominated by the slowest embedding calls. The router sends each call
+to the healthiest provider that produces vectors in the index's embedding space, fires one backup
+("hedged") request when the primary hasn't answered within its recent p95 latency, takes whichever
+answers first, and fails over to the next compatible provider on errors. Providers that keep failing
+are ejected for a back-off period. Only providers whose `space` (family, model, dimension) matches
+the index are ever used, since vectors from another model are not comparable.
+
+Any OpenAI-compatible endpoint (including fake_openai.py stubs) can be added as a provider, which
+makes routing and hedging testable locally. google-genai is optional and only imported when a
+Gemini provider is configured.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_CALLS = REGISTRY.counter(
+    "traffic_embedding_provider_calls_total", "Embedding calls per provider by outcome", ["provider", "outcome"]
+)
+PROVIDER_SECONDS = REGISTRY.histogram(
+    "traffic_embedding_provider_seconds", "Successful embedding call latency per provider", ["provider"]
+)
+PROVIDER_HEALTHY = REGISTRY.gauge(
+    "traffic_embedding_provider_healthy", "1 while a provider is routable, 0 while ejected", ["provider"]
+)
+HEDGES = REGISTRY.counter(
+    "traffic_embedding_hedges_total", "Hedged embedding requests (sent, and won by the backup)", ["event"]
+)
+
+
+class ProviderHealth:
+    """Recent latencies and consecutive-failure ejection for one provider"""
+
+    def __init__(self, name: str, window: int = 256, min_samples: int = 20, eject_after: int = 3,
+                 base_cooldown_s: float = 5.0, max_cooldown_s: float = 60.0):
+        self.name = name
+        self.min_samples = min_samples
+        self.eject_after = eject_after
+        self.base_cooldown_s = base_cooldown_s
+        self.max_cooldown_s = max_cooldown_s
+        self._latencies: deque = deque(maxlen=window)
+        self._failures = 0
+        self._ejections = 0
+        self._ejected_until = 0.0
+        PROVIDER_HEALTHY.labels(name).set_function(lambda: 1.0 if self.healthy else 0.0)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self._ejected_until
+
+    def record_success(self, seconds: float) -> None:
+        self._latencies.append(seconds)
+        self._failures = 0
+        self._ejections = 0
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._failures >= self.eject_after:
+            cooldown = min(self.max_cooldown_s, self.base_cooldown_s * (2 ** self._ejections))
+            self._ejected_until = time.monotonic() + cooldown
+            self._ejections += 1
+            self._failures = 0
+            logger.warning(f"⚠️ Embedding provider {self.name} ejected for {cooldown:.0f}s after repeated failures")
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Latency quantile over the recent window, or None until enough samples exist"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            "healthy": self.healthy,
+            "samples": len(self._latencies),
+            "p50_ms": None if p50 is None else round(p50 * 1000, 1),
+            "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+        }
+
+
+class EmbeddingProvider:
+    """One upstream that turns texts into vectors of a fixed embedding space"""
+
+    family = "base"
+
+    def __init__(self, name: str, model: str, dimension: int):
+        self.name = name
+        self.model = model
+        self.dimension = dimension
+        self.health = ProviderHealth(name)
+
+    @property
+    def space(self) -> str:
+        """Vectors are only comparable within one space"""
+        return f"{self.family}:{self.model}:{self.dimension}"
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI, or any endpoint speaking the OpenAI embeddings API"""
+
+    family = "openai"
+
+    def __init__(self, name: str, client_factory: Callable[[], Any], model: str, dimension: int):
+        super().__init__(name, model, dimension)
+        self._client_factory = client_factory
+        self._client: Any = None
+        self._base_client: Any = None
+
+    def _get_client(self) -> Any:
+        base = self._client_factory()
+        if base is not self._base_client:
+            # The router does its own failover, so SDK-level retries would only delay it
+            self._client, self._base_client = base.with_options(max_retries=0), base
+        return self._client
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        response = await self._get_client().embeddings.create(model=self.model, input=texts)
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Google Gemini embeddings via the optional google-genai package"""
+
+    family = "gemini"
+
+    def __init__(self, name: str, api_key: str, model: str = "gemini-embedding-001", dimension: int = 1536):
+        super().__init__(name, model, dimension)
+        try:
+            from google import genai
+            from google.genai import types
+        except ImportError as e:
+            raise RuntimeError("google-genai is not installed; pip install google-genai") from e
+        self._client = genai.Client(api_key=api_key)
+        self._config = types.EmbedContentConfig(output_dimensionality=dimension)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        result = await self._client.aio.models.embed_content(model=self.model, contents=texts, config=self._config)
+        return [list(e.values) for e in result.embeddings]
+
+
+class EmbeddingRouter:
+    """Routes embedding calls across compatible providers with hedging and failover"""
+
+    def __init__(self, providers: Sequence[EmbeddingProvider], hedge_quantile: float = 0.95,
+                 default_hedge_delay_s: float = 0.25, min_hedge_delay_s: float = 0.02,
+                 max_hedge_delay_s: float = 2.0):
+        if not providers:
+            raise ValueError("At least one embedding provider is required")
+        self.providers = list(providers)
+        self.hedge_quantile = hedge_quantile
+        self.default_hedge_delay_s = default_hedge_delay_s
+        self.min_hedge_delay_s = min_hedge_delay_s
+        self.max_hedge_delay_s = max_hedge_delay_s
+
+    @property
+    def primary(self) -> EmbeddingProvider:
+        return self.providers[0]
+
+    def candidates(self, space: Optional[str] = None) -> List[EmbeddingProvider]:
+        """Providers for `space` (default: the primary's), healthy ones first, in configured order"""
+        space = space or self.primary.space
+        compatible = [p for p in self.providers if p.space == space]
+        return sorted(compatible, key=lambda p: not p.health.healthy)
+
+    def hedge_delay(self, provider: EmbeddingProvider) -> float:
+        observed = provider.health.quantile(self.hedge_quantile)
+        delay = self.default_hedge_delay_s if observed is None else observed
+        return min(self.max_hedge_delay_s, max(self.min_hedge_delay_s, delay))
+
+    async def _call(self, provider: EmbeddingProvider, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        try:
+            vectors = await provider.embed(texts)
+        except asyncio.CancelledError:
+            PROVIDER_CALLS.labels(provider.name, "cancelled").inc()
+            raise
+        except Exception:
+            PROVIDER_CALLS.labels(provider.name, "error").inc()
+            provider.health.record_failure()
+            raise
+        elapsed = time.perf_counter() - started
+        provider.health.record_success(elapsed)
+        PROVIDER_CALLS.labels(provider.name, "ok").inc()
+        PROVIDER_SECONDS.labels(provider.name).observe(elapsed)
+        return vectors
+
+    async def embed(self, texts: List[str], space: Optional[str] = None, hedge: bool = True) -> List[List[float]]:
+        """Embed `texts` with the first provider to answer; raises the last error if all fail"""
+        candidates = self.candidates(space)
+        if not candidates:
+            raise RuntimeError(f"No embedding provider serves index space {space}")
+
+        # Every compatible provider gets one try; a lone provider gets a second (hedge or retry)
+        max_attempts = max(len(candidates), 2)
+        owners: Dict[asyncio.Future, EmbeddingProvider] = {}
+        pending: set = set()
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def launch() -> None:
+            provider = candidates[len(owners) % len(candidates)]
+            task = asyncio.ensure_future(self._call(provider, texts))
+            owners[task] = provider
+            pending.add(task)
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if hedge and not hedged and len(owners) < max_attempts:
+                    timeout = self.hedge_delay(candidates[0])
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    HEDGES.labels("sent").inc()
+                    launch()
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        if hedged and task is not next(iter(owners)):
+                            HEDGES.labels("backup_won").inc()
+                        return task.result()
+                    last_error = task.exception()
+                    logger.warning(f"⚠️ Embedding provider {owners[task].name} failed: {last_error}")
+                if not pending and len(owners) < max_attempts:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [{"name": p.name, "space": p.space, **p.health.snapshot()} for p in self.providers]
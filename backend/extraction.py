@@ -0,0 +1,287 @@
+"""
+Schema-compiled, columnar GeoJSON feature extraction
+Description: extract_traffic_segments used to probe up to three alternative property keys per field
+(SEGMENT_ID / segmentId / newSegmentId, …) and, for legacy files, scan every property key for WD_ /
+WE_ on every feature. Features of one file almost always share the same property layout, so here the
+layout is inspected once and compiled into a plan: the keys each field actually reads, in fallback
+order, and the legacy time-period keys. All properties a plan reads are fetched with one itemgetter
+call per feature and transposed into column lists, the fallbacks and defaults are applied per
+column, and geometry is converted in one NumPy call per file.
+
+A plan only applies to features whose property keys are exactly the layout it was compiled from, so
+the output (including time-period order, which feeds the embedding text) is identical to the
+per-feature rules in `_extract_one`; any feature with another layout is compiled separately, or
+takes the per-feature path past MAX_LAYOUTS.
+"""
+
+from __future__ import annotations
+
+import gc
+import logging
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_LAYOUTS = 32
+
+# Field → property keys in fallback order, and the default when none is truthy
+COMMON_FIELDS: Dict[str, Tuple[Tuple[str, ...], Any]] = {
+    "segment_id": (("SEGMENT_ID", "segmentId", "newSegmentId"), "unknown"),
+    "street_name": (("STREET_NAME", "streetName"), "Unknown Street"),
+    "speed_limit": (("SPEED_LIMIT", "speedLimit"), 100),
+    "distance": (("DISTANCE", "distance"), 0),
+    "sample_size": (("SAMPLE_SIZE", "sampleSize"), 0),
+}
+LEGACY_FIELDS: Dict[str, str] = {
+    "average_speed": "AVG_SPEED",
+    "median_speed": "MEDIAN_SPEED",
+    "travel_time": "AVG_TRAVEL_TIME",
+}
+TIME_RESULTS = "segmentTimeResults"
+
+# Record key order, kept identical to the historical segment dicts (records are stored as JSON)
+FIELDS = ("segment_id", "street_name", "average_speed", "median_speed", "distance", "sample_size",
+          "travel_time", "speed_limit", "time_periods")
+
+
+def _is_period_key(key: Any) -> bool:
+    return isinstance(key, str) and ("WD_" in key or "WE_" in key)
+
+
+def _extract_one(prop: Dict[str, Any]) -> Dict[str, Any]:
+    """Reference per-feature rules, for features no plan covers"""
+    values = {
+        field: next((prop.get(k) for k in keys if prop.get(k)), None) or default
+        for field, (keys, default) in COMMON_FIELDS.items()
+    }
+    avg_spd = prop.get("AVG_SPEED")
+    med_spd = prop.get("MEDIAN_SPEED")
+    travel_t = prop.get("AVG_TRAVEL_TIME")
+    time_periods: Dict[str, Any] = {}
+
+    # New schema
+    if avg_spd is None and TIME_RESULTS in prop:
+        arr = prop[TIME_RESULTS]
+        if isinstance(arr, list) and arr:
+            avg_spd, med_spd, travel_t = _head_values(arr[0])
+            time_periods = _time_sets(arr)
+
+    # Legacy schema
+    if not time_periods:
+        time_periods = {k: v for k, v in prop.items() if _is_period_key(k)}
+        avg_spd = avg_spd or prop.get("AVG_SPEED", 0)
+        med_spd = med_spd or prop.get("MEDIAN_SPEED", 0)
+        travel_t = travel_t or prop.get("AVG_TRAVEL_TIME", 0)
+
+    values.update(average_speed=avg_spd or 0, median_speed=med_spd or 0, travel_time=travel_t or 0,
+                  time_periods=time_periods)
+    return values
+
+
+def _head_values(head: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+    return (
+        head.get("averageSpeed") or head.get("harmonicAverageSpeed") or 0,
+        head.get("medianSpeed") or 0,
+        head.get("averageTravelTime") or 0,
+    )
+
+
+class _Labels(dict):
+    """time_set_<n> labels, formatted once and shared by every feature"""
+
+    def __missing__(self, key: Any) -> str:
+        label = self[key] = f"time_set_{key}"
+        return label
+
+
+_TIME_SET_LABELS = _Labels()
+
+
+def _time_sets(arr: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Only exact ints/strs are cached: True or 1.0 compare equal to 1 but format differently
+    labels = [
+        _TIME_SET_LABELS[key] if type(key) in (int, str) else f"time_set_{key}"
+        for key in (r.get("timeSet", "na") for r in arr)
+    ]
+    return {
+        label: {"AVG_SPEED": r.get("averageSpeed") or r.get("harmonicAverageSpeed"), "MEDIAN_SPEED": r.get("medianSpeed")}
+        for label, r in zip(labels, arr)
+    }
+
+
+def _first(columns: Sequence[Sequence[Any]], default: Any) -> List[Any]:
+    """First truthy value across alternative key columns (at least one), else `default`"""
+    values = columns[0]
+    for column in columns[1:]:
+        values = [v or w for v, w in zip(values, column)]
+    return [v or default for v in values]
+
+
+class ExtractionPlan:
+    """Field accessors compiled for one exact property-key layout
+
+    Every property the plan reads is fetched with one itemgetter call per feature (a C loop over
+    the dicts, touching each only once); the resulting rows are transposed into columns.
+    """
+
+    def __init__(self, layout: Tuple[str, ...]):
+        self.layout = layout
+        present = set(layout)
+        if TIME_RESULTS in present and "AVG_SPEED" not in present:
+            self.schema = "dash"
+        elif TIME_RESULTS not in present:
+            self.schema = "legacy"
+        else:
+            self.schema = None  # both shapes in one feature: per-feature rules decide
+
+        wanted: List[str] = []
+        def slots(keys: Sequence[str]) -> Tuple[int, ...]:
+            found = tuple(k for k in keys if k in present)
+            wanted.extend(found)
+            return tuple(range(len(wanted) - len(found), len(wanted)))
+        self.fields = {field: (slots(keys), default) for field, (keys, default) in COMMON_FIELDS.items()}
+        if self.schema == "dash":
+            self.results_slot = slots((TIME_RESULTS,))[0]
+        else:
+            self.legacy = {field: slots((key,)) for field, key in LEGACY_FIELDS.items()}
+            self.period_keys = tuple(k for k in layout if _is_period_key(k))
+            self.period_slots = slots(self.period_keys)
+        self.keys = tuple(wanted)
+        self._getter = itemgetter(*self.keys) if len(self.keys) > 1 else None
+
+    def _columns(self, props: List[Dict[str, Any]]) -> List[Sequence[Any]]:
+        if not self.keys:
+            return []
+        if self._getter is None:
+            key = self.keys[0]
+            return [[p[key] for p in props]]
+        return list(zip(*map(self._getter, props)))
+
+    def extract(self, props: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+        """Columns for `props`, all of which have exactly this plan's layout"""
+        n = len(props)
+        raw = self._columns(props)
+        pick = lambda slots, default: _first([raw[i] for i in slots], default) if slots else [default] * n
+        columns = {field: pick(slots, default) for field, (slots, default) in self.fields.items()}
+        if self.schema == "legacy":
+            for field, slots in self.legacy.items():
+                columns[field] = pick(slots, 0)
+            keys = self.period_keys
+            if keys:
+                columns["time_periods"] = [dict(zip(keys, values)) for values in zip(*(raw[i] for i in self.period_slots))]
+            else:
+                columns["time_periods"] = [{} for _ in range(n)]
+            return columns
+
+        # dash: a feature whose time-result list is empty or malformed falls back per feature
+        arrays = raw[self.results_slot]
+        heads = [_head_values(a[0]) if isinstance(a, list) and a else None for a in arrays]
+        columns["average_speed"] = [h[0] if h else None for h in heads]
+        columns["median_speed"] = [h[1] if h else None for h in heads]
+        columns["travel_time"] = [h[2] if h else None for h in heads]
+        columns["time_periods"] = [_time_sets(a) if h else None for a, h in zip(arrays, heads)]
+        for i, head in enumerate(heads):
+            if head is None:
+                for field, value in _extract_one(props[i]).items():
+                    columns[field][i] = value
+        return columns
+
+
+class SegmentColumns:
+    """One file's segments as parallel column lists (see FIELDS) plus raw LineString coordinates"""
+
+    def __init__(self, month: str, year: int, columns: Dict[str, List[Any]], coordinates: List[Any]):
+        self.month = month
+        self.year = year
+        self.columns = columns
+        self.coordinates = coordinates
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    def records(self, with_coordinates: bool = False) -> List[Dict[str, Any]]:
+        """Segment dicts in the historical key order"""
+        month, year = self.month, self.year
+        rows = zip(*(self.columns[field] for field in FIELDS))
+        records = [
+            {"month": month, "year": year, "segment_id": sid, "street_name": street, "average_speed": avg,
+             "median_speed": med, "distance": dist, "sample_size": samples, "travel_time": travel,
+             "speed_limit": limit, "time_periods": periods}
+            for sid, street, avg, med, dist, samples, travel, limit, periods in rows
+        ]
+        if with_coordinates:
+            for record, coords in zip(records, self.coordinates):
+                record["coordinates"] = coords
+        return records
+
+
+@contextmanager
+def gc_paused() -> Iterator[None]:
+    """Suspend the cyclic GC around bulk allocation
+
+    Building hundreds of thousands of small dicts and tuples otherwise triggers repeated full
+    collections, each rescanning the whole decoded FeatureCollection. Nothing here creates cycles.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def extract_columns(geojson_data: Dict[str, Any], month: str, year: int) -> SegmentColumns:
+    """LineString features of a FeatureCollection as columns, one compiled plan per property layout"""
+    with gc_paused():
+        return _extract_columns(geojson_data, month, year)
+
+
+def _extract_columns(geojson_data: Dict[str, Any], month: str, year: int) -> SegmentColumns:
+    empty = SegmentColumns(month, year, {field: [] for field in FIELDS}, [])
+    if not geojson_data or "features" not in geojson_data:
+        return empty
+
+    props: List[Dict[str, Any]] = []
+    coordinates: List[Any] = []
+    for feat in geojson_data["features"]:
+        if not isinstance(feat, dict):
+            continue
+        geom = feat.get("geometry") or {}
+        if geom.get("type") != "LineString":
+            continue
+        props.append(feat.get("properties") or {})
+        coordinates.append(geom.get("coordinates") or [])
+    if not props:
+        return empty
+
+    first = tuple(props[0])
+    if all(tuple(p) == first for p in props):
+        # The usual case: one layout for the whole file, no regrouping
+        plan = ExtractionPlan(first)
+        if plan.schema is not None:
+            return SegmentColumns(month, year, plan.extract(props), coordinates)
+
+    groups: Dict[Tuple[str, ...], List[int]] = {}
+    for i, layout in enumerate(map(tuple, props)):
+        groups.setdefault(layout, []).append(i)
+    columns: Dict[str, List[Any]] = {field: [None] * len(props) for field in FIELDS}
+    leftovers: List[int] = []
+    for n, (layout, rows) in enumerate(sorted(groups.items(), key=lambda item: -len(item[1]))):
+        plan = ExtractionPlan(layout) if n < MAX_LAYOUTS else None
+        if plan is None or plan.schema is None:
+            leftovers.extend(rows)
+            continue
+        extracted = plan.extract([props[i] for i in rows])
+        for field, values in extracted.items():
+            column = columns[field]
+            for i, value in zip(rows, values):
+                column[i] = value
+    for i in leftovers:
+        for field, value in _extract_one(props[i]).items():
+            columns[field][i] = value
+    if leftovers:
+        logger.info(f"ℹ️ {len(leftovers)} features extracted without a compiled plan ({len(groups)} property layouts)")
+    return SegmentColumns(month, year, columns, coordinates)
@@ -0,0 +1,266 @@
+"""
+Local OpenAI stand-in for benchmarks and load tests
+Description: Serves /v1/embeddings and /v1/chat/completions with deterministic vectors and
+configurable latency, plus static GeoJSON files so download scenarios never leave the machine.
+
+Point the backend at it with:
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=sk-local uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import logging
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+def fake_embedding(text: str, dimension: int) -> np.ndarray:
+    """Deterministic unit vector for a text (same text -> same vector across runs)"""
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    return vector
+
+
+class LatencyModel:
+    """Fixed + uniform-jitter + per-input latency, in milliseconds"""
+
+    def __init__(self, base_ms: float = 0.0, jitter_ms: float = 0.0, per_item_ms: float = 0.0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.per_item_ms = per_item_ms
+
+    async def wait(self, items: int = 1) -> None:
+        delay_ms = self.base_ms + random.uniform(0.0, self.jitter_ms) + self.per_item_ms * items
+        if delay_ms > 0:
+            await asyncio.sleep(delay_ms / 1000.0)
+
+
+class FakeOpenAIServer:
+    """aiohttp server implementing the subset of the OpenAI API used by the backend"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        dimension: int = 1536,
+        embed_latency: Optional[LatencyModel] = None,
+        chat_latency: Optional[LatencyModel] = None,
+        model_latency: Optional[Dict[str, LatencyModel]] = None,
+        chat_words: int = 120,
+        error_rate: float = 0.0,
+        geojson_dir: Optional[str] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.dimension = dimension
+        self.embed_latency = embed_latency or LatencyModel()
+        self.chat_latency = chat_latency or LatencyModel()
+        self.model_latency = model_latency or {}  # per chat model, e.g. a faster small model
+        self.chat_words = chat_words
+        self.error_rate = error_rate
+        self.geojson_dir = Path(geojson_dir) if geojson_dir else None
+        self.stats: Dict[str, int] = {
+            "embedding_requests": 0,
+            "embedding_inputs": 0,
+            "chat_requests": 0,
+            "geojson_requests": 0,
+            "injected_errors": 0,
+        }
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def openai_base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    # ---------- Handlers ----------
+    def _maybe_fail(self) -> Optional[web.Response]:
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats["injected_errors"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached (injected)", "type": "rate_limit_exceeded"}},
+                status=429,
+            )
+        return None
+
+    async def _embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimension = int(body.get("dimensions") or self.dimension)
+        self.stats["embedding_requests"] += 1
+        self.stats["embedding_inputs"] += len(inputs)
+
+        await self.embed_latency.wait(len(inputs))
+        failure = self._maybe_fail()
+        if failure is not None:
+            return failure
+
+        as_base64 = body.get("encoding_format") == "base64"
+        data: List[Dict[str, Any]] = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(str(text), dimension)
+            embedding: Any = base64.b64encode(vector.tobytes()).decode("ascii") if as_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        tokens = sum(len(str(t).split()) for t in inputs)
+        return web.json_response({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    async def _chat(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.stats["chat_requests"] += 1
+
+        await self.model_latency.get(body.get("model"), self.chat_latency).wait()
+        failure = self._maybe_fail()
+        if failure is not None:
+            return failure
+
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        words = ["traffic", "speed", "segment", "congestion", "corridor", "peak", "flow", "km/h"]
+        lines = [
+            "* " + " ".join(words[(i + j) % len(words)] for j in range(8))
+            for i in range(max(1, self.chat_words // 8))
+        ]
+        content = "\n".join(lines)
+        prompt_tokens = len(prompt.split())
+        completion_tokens = len(content.split())
+        return web.json_response({
+            "id": f"chatcmpl-local-{self.stats['chat_requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    async def _geojson(self, request: web.Request) -> web.StreamResponse:
+        self.stats["geojson_requests"] += 1
+        if not self.geojson_dir:
+            raise web.HTTPNotFound()
+        path = (self.geojson_dir / request.match_info["name"]).resolve()
+        if self.geojson_dir.resolve() not in path.parents or not path.is_file():
+            raise web.HTTPNotFound()
+        return web.FileResponse(path, headers={"Content-Type": "application/geo+json"})
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/embeddings", self._embeddings)
+        app.router.add_post("/v1/chat/completions", self._chat)
+        app.router.add_get("/geojson/{name}", self._geojson)
+        return app
+
+    # ---------- Lifecycle ----------
+    async def start(self) -> "FakeOpenAIServer":
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Resolve the real port when an ephemeral one (0) was requested
+        sockets = site._server.sockets if site._server else []
+        if sockets:
+            self.port = sockets[0].getsockname()[1]
+        logger.info(f"🧪 Fake OpenAI server listening on {self.url}")
+        return self
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self) -> "FakeOpenAIServer":
+        """Run the server on its own event loop so it never competes with the code under test"""
+        started = threading.Event()
+
+        def _run() -> None:
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=_run, name="fake-openai", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        if self._loop and self._thread:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local OpenAI stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embed-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--embed-per-item-ms", type=float, default=0.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0)
+    parser.add_argument("--chat-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--chat-words", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--geojson-dir", default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = FakeOpenAIServer(
+        host=args.host,
+        port=args.port,
+        dimension=args.dimension,
+        embed_latency=LatencyModel(args.embed_latency_ms, args.embed_jitter_ms, args.embed_per_item_ms),
+        chat_latency=LatencyModel(args.chat_latency_ms, args.chat_jitter_ms),
+        chat_words=args.chat_words,
+        error_rate=args.error_rate,
+        geojson_dir=args.geojson_dir,
+    )
+
+    async def _serve() -> None:
+        await server.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(_serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
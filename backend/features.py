@@ -0,0 +1,264 @@
+"""
+Precomputed congestion features and anomaly flags
+Description: The congestion class used to exist only inside convert_segment_to_text, so "worst
+bottlenecks" questions depended on the embedding happening to rank slow segments first. Here ingest
+computes numeric features for every SegmentStore record and stores them as typed, mmap'd columns:
+speed ratio, congestion class, travel-time index, a z-score of the month's speed against the
+segment's own history, and the speed drop of each time set (WD_AM_PEAK, time_set_3, …) below the
+segment's average. Hotspot ranking is then a vectorized top-k over one column.
+
+Layout (under <metadata_store_dir>/features/):
+    speed_ratio.npy         float32  average_speed / speed_limit
+    congestion_class.npy    int8     0 = minimal … 3 = severe, -1 unknown
+    travel_time_index.npy   float32  travel_time / free-flow travel time (distance at the speed limit)
+    speed_zscore.npy        float32  (speed - mean) / std of the segment's other ingested months
+    anomaly.npy             bool     |speed_zscore| >= ANOMALY_Z
+    time_set_drop.npy       float32  (records × time sets) 1 - time-set speed / average speed
+    time_sets.npy           str      time-set labels for the columns above
+    peak_drop.npy           float32  largest time-set drop of the record
+    peak_time_set.npy       int16    its column in time_sets (-1 when there is no time-set data)
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from comparison import CONGESTION_LABELS, congestion_class
+from lazy import LazyModule
+from segment_table import SegmentTable, _number, period_label
+
+np = LazyModule("numpy")
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_Z = 2.0
+MIN_HISTORY = 3  # other months of data before a z-score means anything
+MIN_STD_FRACTION = 0.05  # std floor, as a share of the segment's mean speed
+
+COLUMNS = ("speed_ratio", "congestion_class", "travel_time_index", "speed_zscore", "anomaly",
+           "time_set_drop", "peak_drop", "peak_time_set")
+TIME_SETS_FILE = "time_sets.npy"
+
+# /hotspots metric → (column, worst first is descending)
+METRICS = {
+    "speed_ratio": ("speed_ratio", False),
+    "travel_time_index": ("travel_time_index", True),
+    "speed_zscore": ("speed_zscore", False),
+    "peak_drop": ("peak_drop", True),
+}
+
+
+def _time_set_speeds(periods: Dict[str, Any]) -> Dict[str, float]:
+    """{label: average speed} from either schema's time_periods"""
+    speeds = {}
+    for key, value in periods.items():
+        if isinstance(value, dict):
+            speed = _number(value.get("AVG_SPEED"))
+            label = key
+        elif key.endswith("_AVG_SPEED"):
+            speed = _number(value)
+            label = key[:-len("_AVG_SPEED")]
+        else:
+            continue
+        if speed == speed:  # not NaN
+            speeds[label] = speed
+    return speeds
+
+
+def _history_zscore(table: SegmentTable) -> np.ndarray:
+    """Per-record z-score of average speed against the segment's other months (leave-one-out)
+
+    Excluding the month itself matters: with k months, an in-sample z-score can never exceed
+    (k - 1) / sqrt(k), so a 4-month history could never flag anything at |z| >= 2.
+    """
+    speed = np.asarray(table.measure("average_speed"), dtype=np.float64)
+    present = ~np.isnan(speed)
+    values = np.where(present, speed, 0.0)
+    n = present.sum(axis=1, keepdims=True) - present
+    total = values.sum(axis=1, keepdims=True) - values
+    squares = (values ** 2).sum(axis=1, keepdims=True) - values ** 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / n
+        std = np.sqrt(np.maximum(squares - n * mean ** 2, 0) / (n - 1))  # sample std of the others
+        # A few near-identical months would make any small wobble look extreme
+        grid = (speed - mean) / np.maximum(std, MIN_STD_FRACTION * mean)
+    grid[(n < MIN_HISTORY) | ~(mean > 0)] = np.nan
+    rows, cols = table.record_segment, table.record_period
+    z = np.full(len(rows), np.nan, dtype=np.float32)
+    valid = cols >= 0
+    z[valid] = grid[rows[valid], cols[valid]]
+    return z
+
+
+class SegmentFeatures:
+    """mmap'd per-record feature columns, aligned with SegmentStore rows"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.time_sets = np.load(self.directory / TIME_SETS_FILE, mmap_mode="r")
+        self._columns = {name: np.load(self.directory / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+
+    # ---------- Writing ----------
+    @staticmethod
+    def write(segments: Sequence[Dict[str, Any]], table: SegmentTable, directory: str) -> None:
+        out = Path(directory)
+        out.mkdir(parents=True, exist_ok=True)
+
+        speed = np.array([_number(s.get("average_speed")) for s in segments], dtype=np.float32)
+        limit = np.array([_number(s.get("speed_limit")) for s in segments], dtype=np.float32)
+        distance = np.array([_number(s.get("distance")) for s in segments], dtype=np.float32)
+        travel = np.array([_number(s.get("travel_time")) for s in segments], dtype=np.float32)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = np.where(limit > 0, speed / limit, np.nan).astype(np.float32)
+            # Free-flow time: the segment driven at its speed limit (km/h → m/s)
+            free_flow = distance / (limit / 3.6)
+            tti = np.where((travel > 0) & (free_flow > 0), travel / free_flow, np.nan)
+            # No measured travel time: for a fixed distance the index is limit / speed
+            tti = np.where(np.isnan(tti) & (speed > 0) & (limit > 0), limit / speed, tti).astype(np.float32)
+
+        per_record = [_time_set_speeds(s.get("time_periods") or {}) for s in segments]
+        time_sets = sorted({label for speeds in per_record for label in speeds})
+        position = {label: i for i, label in enumerate(time_sets)}
+        set_speed = np.full((len(segments), len(time_sets)), np.nan, dtype=np.float32)
+        for i, speeds in enumerate(per_record):
+            for label, value in speeds.items():
+                set_speed[i, position[label]] = value
+        with np.errstate(invalid="ignore", divide="ignore"):
+            drop = np.where(speed[:, None] > 0, 1 - set_speed / speed[:, None], np.nan).astype(np.float32)
+        has_sets = ~np.isnan(drop).all(axis=1) if time_sets else np.zeros(len(segments), dtype=bool)
+        peak = np.full(len(segments), -1, dtype=np.int16)
+        peak_drop = np.full(len(segments), np.nan, dtype=np.float32)
+        if has_sets.any():
+            peak[has_sets] = np.nanargmax(drop[has_sets], axis=1)
+            peak_drop[has_sets] = drop[has_sets, peak[has_sets]]
+
+        z = _history_zscore(table)
+        arrays = {
+            "speed_ratio": ratio,
+            "congestion_class": congestion_class(speed, limit),
+            "travel_time_index": tti,
+            "speed_zscore": z,
+            "anomaly": np.abs(np.nan_to_num(z)) >= ANOMALY_Z,
+            "time_set_drop": drop,
+            "peak_drop": peak_drop,
+            "peak_time_set": peak,
+            # Labels last: a reader that finds them finds complete columns
+            TIME_SETS_FILE[:-4]: np.array(time_sets, dtype=str),
+        }
+        for name, values in arrays.items():
+            tmp = out / f"{name}.tmp.npy"
+            np.save(tmp, values)
+            os.replace(tmp, out / f"{name}.npy")
+        logger.info(
+            f"📈 Features for {len(segments)} records: {int(arrays['anomaly'].sum())} anomalies, "
+            f"{len(time_sets)} time sets"
+        )
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return (Path(directory) / TIME_SETS_FILE).exists()
+
+    # ---------- Reading ----------
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name]
+
+    def row(self, index: int) -> Dict[str, Any]:
+        """JSON-ready features of one record"""
+        c = self._columns
+        klass, peak = int(c["congestion_class"][index]), int(c["peak_time_set"][index])
+        value = lambda name, digits=3: None if np.isnan(c[name][index]) else round(float(c[name][index]), digits)
+        return {
+            "speed_ratio": value("speed_ratio"),
+            "congestion_class": CONGESTION_LABELS[klass] if klass >= 0 else None,
+            "travel_time_index": value("travel_time_index"),
+            "speed_zscore": value("speed_zscore", 2),
+            "anomaly": bool(c["anomaly"][index]),
+            "peak_drop": value("peak_drop"),
+            "peak_time_set": str(self.time_sets[peak]) if peak >= 0 else None,
+        }
+
+
+def _finite(value: float, digits: int) -> Optional[float]:
+    # NaN (a missing or non-numeric source value) is not valid JSON
+    return round(float(value), digits) if np.isfinite(value) else None
+
+
+def hotspots(store: Any, metric: str = "speed_ratio", k: int = 10, period: Optional[int] = None,
+             street: Optional[str] = None, min_samples: int = 0, anomalies_only: bool = False) -> Dict[str, Any]:
+    """Worst `k` records of one period by `metric` (argpartition, no full sort)
+
+    `period` is a period_key(); by default the latest ingested month, so one segment appears once.
+    """
+    features: SegmentFeatures = store.features
+    table: SegmentTable = store.table
+    column, descending = METRICS[metric]
+    values = np.asarray(features.column(column))
+    if period is None and len(table.periods):
+        period = int(table.periods[-1])
+    col = table.column(period)
+    if col is None:
+        raise KeyError(f"No data for {period_label(period) if period is not None else 'any period'}")
+
+    mask = (table.record_period == col) & ~np.isnan(values)
+    if street:
+        names, codes = table.street_index()
+        wanted = [i for i, name in enumerate(names) if street.lower() in str(name).lower()]
+        mask &= np.isin(codes[table.record_segment], wanted)
+    if min_samples:
+        samples = table.measure("sample_size")[table.record_segment, np.maximum(table.record_period, 0)]
+        mask &= samples >= min_samples
+    if anomalies_only:
+        mask &= features.column("anomaly")
+
+    candidates = np.flatnonzero(mask)
+    score = -values[candidates] if descending else values[candidates]
+    if len(candidates) > k:
+        top = np.argpartition(score, k - 1)[:k]
+    else:
+        top = np.arange(len(candidates))
+    top = top[np.argsort(score[top], kind="stable")]
+    picked = candidates[top]
+
+    names, codes = table.street_index()
+    speed = table.measure("average_speed")
+    limits = table.attribute("speed_limit")
+    results: List[Dict[str, Any]] = []
+    for record in picked:
+        seg = int(table.record_segment[record])
+        results.append({
+            "record": int(record),
+            "segment_id": str(table.segment_ids[seg]),
+            "street_name": str(names[codes[seg]]),
+            "average_speed": _finite(speed[seg, col], 2),
+            "speed_limit": _finite(limits[seg], 1),
+            **features.row(int(record)),
+        })
+    return {
+        "metric": metric,
+        "period": period_label(period),
+        "street_filter": street,
+        "candidates": int(len(candidates)),
+        "hotspots": results,
+    }
+
+
+def format_hotspots(result: Dict[str, Any], max_rows: int = 10) -> str:
+    """Compact, exact text block for the LLM context"""
+    lines = [f"EXACT HOTSPOTS {result['period']} by {result['metric']}"
+             + (f" on {result['street_filter']}" if result["street_filter"] else "")
+             + f" (worst of {result['candidates']} segments):"]
+    for row in result["hotspots"][:max_rows]:
+        detail = (f", worst in {row['peak_time_set']} ({row['peak_drop'] * 100:.0f}% below average)"
+                  if (row["peak_drop"] or 0) > 0 else "")
+        lines.append(
+            f"- {row['street_name']} (segment {row['segment_id']}): {row['average_speed']} km/h "
+            f"of {row['speed_limit'] or 'unknown'} limit, {row['congestion_class'] or 'unknown'} congestion, "
+            f"travel-time index {row['travel_time_index']}{detail}"
+        )
+    if not result["hotspots"]:
+        lines.append("- no segments match")
+    return "\n".join(lines)
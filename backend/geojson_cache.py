@@ -0,0 +1,177 @@
+"""
+Content-addressed, compressed GeoJSON download cache with conditional GETs
+Description: Source files used to be decoded, re-encoded with json.dumps and written under a name
+built from the last three URL path components, and were never revalidated. Here the raw response
+bytes are streamed to disk through a compressor (zstd when the optional `zstandard` package is
+installed, gzip otherwise) while being hashed; the object is stored under its SHA-256, and a small
+per-URL ref records the hash plus the server's ETag / Last-Modified. Later downloads send
+If-None-Match / If-Modified-Since, so an unchanged file costs one 304 and no body transfer, and
+identical content behind different URLs is stored once.
+
+Layout (under CONFIG["geojson_dir"]):
+    objects/<sha256>.json.zst|.json.gz    raw response body, compressed
+    refs/<sha256 of url>.json             {"url", "sha256", "object", "etag", "last_modified", ...}
+"""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import IO, Any, Dict, Optional
+
+from lazy import LazyModule
+from metrics import REGISTRY, record_cache
+
+aiohttp = LazyModule("aiohttp")
+
+try:  # optional: better ratio and much faster than gzip
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 1 << 20
+
+GEOJSON_BYTES = REGISTRY.counter(
+    "traffic_geojson_bytes_total", "GeoJSON bytes received over the network and written to the cache", ["kind"]
+)
+
+
+def _atomic_write_json(path: Path, payload: Dict[str, Any]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(payload))
+    os.replace(tmp, path)
+
+
+class _Compressor:
+    """Streaming writer for the configured codec"""
+
+    def __init__(self, fileobj: IO[bytes]):
+        if zstandard is not None:
+            self.suffix = ".json.zst"
+            self._writer = zstandard.ZstdCompressor(level=3).stream_writer(fileobj, closefd=False)
+        else:
+            self.suffix = ".json.gz"
+            self._writer = gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=5, mtime=0)
+
+    def write(self, data: bytes) -> None:
+        self._writer.write(data)
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class GeoJSONCache:
+    """Download cache keyed by content hash, revalidated with conditional GETs"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.objects = self.directory / "objects"
+        self.refs = self.directory / "refs"
+
+    def _ref_path(self, url: str) -> Path:
+        return self.refs / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def _read_ref(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            ref = json.loads(self._ref_path(url).read_text())
+        except (OSError, ValueError):
+            return None
+        return ref if (self.objects / ref["object"]).exists() else None
+
+    def open(self, ref: Dict[str, Any]) -> IO[bytes]:
+        """Decompressing reader over a cached object"""
+        path = self.objects / ref["object"]
+        if path.suffix == ".zst":
+            if zstandard is None:
+                raise RuntimeError(f"{path} is zstd-compressed; install `zstandard` to read it")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+        return gzip.open(path, "rb")
+
+    async def _download(self, url: str, resp: aiohttp.ClientResponse) -> Dict[str, Any]:
+        """Stream the body through the compressor into objects/, hashing the raw bytes on the way"""
+        self.objects.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        received = 0
+        tmp = self.objects / f".download-{os.getpid()}-{time.monotonic_ns()}"
+        try:
+            with open(tmp, "wb") as f:
+                compressor = _Compressor(f)
+                async for chunk in resp.content.iter_chunked(CHUNK_BYTES):
+                    digest.update(chunk)
+                    # Compression is the slow part of a download; keep it off the event loop
+                    await asyncio.to_thread(compressor.write, chunk)
+                    received += len(chunk)
+                compressor.close()
+            name = f"{digest.hexdigest()}{compressor.suffix}"
+            stored = tmp.stat().st_size
+            if (self.objects / name).exists():
+                tmp.unlink()  # same content already cached (other URL or unchanged re-upload)
+            else:
+                os.replace(tmp, self.objects / name)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        GEOJSON_BYTES.labels("received").inc(received)
+        GEOJSON_BYTES.labels("stored").inc(stored)
+        logger.info(f"💾 Cached {url}: {received / 2**20:.1f} MiB → {stored / 2**20:.1f} MiB ({compressor.suffix[6:]})")
+        return {
+            "url": url,
+            "sha256": digest.hexdigest(),
+            "object": name,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "size": received,
+            "fetched_at": time.time(),
+        }
+
+    async def fetch(self, url: str, session: aiohttp.ClientSession) -> Optional[Dict[str, Any]]:
+        """Ref for the current content of `url`, downloading only if it changed; None on failure"""
+        ref = self._read_ref(url)
+        headers = {}
+        if ref is not None:
+            if ref.get("etag"):
+                headers["If-None-Match"] = ref["etag"]
+            if ref.get("last_modified"):
+                headers["If-Modified-Since"] = ref["last_modified"]
+
+        try:
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 304 and ref is not None:
+                    record_cache("geojson", True)
+                    return ref
+                if resp.status != 200:
+                    logger.error(f"Failed to download {url}: HTTP {resp.status}")
+                    return self._stale(url, ref)
+                record_cache("geojson", False)
+                new_ref = await self._download(url, resp)
+        except (aiohttp.ClientError, OSError, TimeoutError) as e:
+            logger.error(f"Error downloading {url}: {e}")
+            return self._stale(url, ref)
+
+        self.refs.mkdir(parents=True, exist_ok=True)
+        _atomic_write_json(self._ref_path(url), new_ref)
+        return new_ref
+
+    def evict(self, url: str) -> None:
+        """Forget a URL's cached copy (e.g. a corrupted object); the next fetch downloads it again"""
+        ref = self._read_ref(url)
+        self._ref_path(url).unlink(missing_ok=True)
+        if ref is not None:
+            (self.objects / ref["object"]).unlink(missing_ok=True)
+
+    @staticmethod
+    def _stale(url: str, ref: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        # Unreachable origin: an older copy beats no data for an ingest
+        if ref is not None:
+            logger.warning(f"⚠️ Using cached copy of {url} from {time.ctime(ref['fetched_at'])} (revalidation failed)")
+            record_cache("geojson", True)
+        return ref
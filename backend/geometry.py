@@ -0,0 +1,227 @@
+"""
+Compact, deduplicated segment geometry
+Description: Road geometry is identical for a segment in every month, yet used to be kept as nested
+Python float lists inside every monthly segment dict. Here each segment_id's LineString is stored
+once, as delta-encoded int32 micro-degrees in one flat mmap'd array, alongside a per-point
+Douglas-Peucker significance (metres). Any simplification tolerance is then a single mask, and
+lines can be served as encoded polylines instead of coordinate arrays.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from lazy import LazyModule
+
+np = LazyModule("numpy")
+
+logger = logging.getLogger(__name__)
+
+COORD_SCALE = 1_000_000  # int32 micro-degrees: ~0.1 m resolution, ±2147° range
+METERS_PER_DEGREE = 111_320.0
+
+IDS_FILE = "segment_ids.npy"
+OFFSETS_FILE = "offsets.npy"
+DELTAS_FILE = "deltas.npy"
+SIGNIFICANCE_FILE = "significance.npy"
+
+
+def _significance(points: Sequence[Sequence[float]]) -> List[float]:
+    """Per-point Douglas-Peucker significance: a point survives simplification at tolerance t iff sig > t
+
+    A point's significance is its distance from the chord when it was chosen as a split point,
+    capped by its parent's, so the kept sets are nested across tolerances. Road segments are
+    short, so plain floats beat per-line NumPy calls here.
+    """
+    n = len(points)
+    sig = [0.0] * n
+    sig[0] = sig[-1] = math.inf
+    # Local equirectangular projection to metres
+    kx = math.cos(math.radians(sum(p[1] for p in points) / n)) * METERS_PER_DEGREE
+    xy = [(p[0] * kx, p[1] * METERS_PER_DEGREE) for p in points]
+
+    stack = [(0, n - 1, math.inf)]
+    while stack:
+        i, j, parent = stack.pop()
+        if j <= i + 1:
+            continue
+        (ax, ay), (bx, by) = xy[i], xy[j]
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        best, split = -1.0, i + 1
+        for k in range(i + 1, j):
+            px, py = xy[k][0] - ax, xy[k][1] - ay
+            t = 0.0 if length_sq == 0.0 else min(1.0, max(0.0, (px * dx + py * dy) / length_sq))
+            d = math.hypot(px - t * dx, py - t * dy)
+            if d > best:
+                best, split = d, k
+        sig[split] = min(best, parent)
+        stack.append((i, split, sig[split]))
+        stack.append((split, j, sig[split]))
+    return sig
+
+
+def encode_polyline(points: np.ndarray, precision: int = 5) -> str:
+    """Google encoded-polyline string for (lon, lat) points (the format itself is lat, lon)"""
+    factor = 10 ** precision
+    scaled = np.round(np.asarray(points, dtype=np.float64)[:, ::-1] * factor).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    out: List[str] = []
+    for value in deltas.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            out.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        out.append(chr(value + 63))
+    return "".join(out)
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> List[List[float]]:
+    """Inverse of encode_polyline, returning [lon, lat] pairs"""
+    values, shift, result = [], 0, 0
+    for ch in encoded:
+        byte = ord(ch) - 63
+        result |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(result >> 1) if result & 1 else result >> 1)
+            shift = result = 0
+    coords = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return coords[:, ::-1].tolist()
+
+
+def _flat_points(lines: Sequence[Sequence[Sequence[float]]]) -> Optional[np.ndarray]:
+    """(total points, 2) float64 lon/lat of many lines, or None if any point is malformed"""
+    points = itertools.chain.from_iterable(lines)
+    try:
+        if set(map(len, itertools.chain.from_iterable(lines))) == {2}:
+            # Plain [lon, lat] pairs: stream the scalars, much faster than converting nested lists
+            return np.fromiter(itertools.chain.from_iterable(points), dtype=np.float64).reshape(-1, 2)
+        return np.array([(p[0], p[1]) for p in points], dtype=np.float64)  # e.g. [lon, lat, z]
+    except (ValueError, IndexError, TypeError, KeyError):
+        return None
+
+
+class GeometryBuilder:
+    """Collects one LineString per segment_id during ingest (first occurrence wins)"""
+
+    def __init__(self):
+        self._lines: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def add(self, segment_id: object, coordinates: Sequence[Sequence[float]]) -> None:
+        key = str(segment_id)
+        if key in self._lines or not coordinates:
+            return
+        try:
+            points = np.asarray(coordinates, dtype=np.float64)[:, :2]
+        except (ValueError, IndexError, TypeError):
+            logger.warning(f"⚠️ Skipping malformed geometry for segment {key}")
+            return
+        if len(points) and np.isfinite(points).all():
+            self._lines[key] = np.round(points * COORD_SCALE).astype(np.int32)
+
+    def add_many(self, segment_ids: Sequence[object], coordinates: Sequence[Sequence[Sequence[float]]]) -> None:
+        """Same as add() for a whole file, converting every new line in one NumPy call"""
+        new: Dict[str, Sequence[Sequence[float]]] = {}
+        for key, line in zip(map(str, segment_ids), coordinates):
+            if line and key not in new and key not in self._lines:
+                new[key] = line  # the first occurrence wins, also within this batch
+        if not new:
+            return
+        keys, lines = list(new), list(new.values())
+        points = _flat_points(lines)
+        if points is None:
+            rejected = set(keys)  # some line is malformed; add() sorts out which, line by line
+        else:
+            lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+            offsets = np.concatenate(([0], np.cumsum(lengths)))
+            finite = np.logical_and.reduceat(np.isfinite(points).all(axis=1), offsets[:-1])
+            scaled = np.round(points * COORD_SCALE).astype(np.int32)
+            self._lines.update(zip(keys, np.split(scaled, offsets[1:-1])))
+            rejected = {key for key, ok in zip(keys, finite.tolist()) if not ok}
+        if rejected:
+            for key in rejected:
+                self._lines.pop(key, None)
+            # A later occurrence of the same segment may still carry a usable line
+            for segment_id, line in zip(segment_ids, coordinates):
+                if str(segment_id) in rejected:
+                    self.add(segment_id, line)
+
+    def write(self, directory: str) -> None:
+        """Write the flat arrays; rows are sorted by segment_id for binary-search lookup"""
+        out = Path(directory)
+        out.mkdir(parents=True, exist_ok=True)
+        ids = sorted(self._lines)
+        lines = [self._lines[k] for k in ids]
+        offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+        np.cumsum([len(line) for line in lines], out=offsets[1:])
+
+        points = np.concatenate(lines) if lines else np.zeros((0, 2), dtype=np.int32)
+        # Delta-encode within each line; the first point of every line stays absolute
+        deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int32))
+        deltas[offsets[:-1]] = points[offsets[:-1]]
+        significance = np.fromiter(
+            (sig for line in lines for sig in _significance((line / COORD_SCALE).tolist())),
+            dtype=np.float32, count=len(points)
+        )
+
+        arrays = {
+            IDS_FILE: np.array(ids, dtype=str),
+            DELTAS_FILE: deltas,
+            SIGNIFICANCE_FILE: significance,
+            OFFSETS_FILE: offsets,  # last, like SegmentStore: readers never see offsets past the data
+        }
+        for name, values in arrays.items():
+            tmp = out / f"{name}.tmp.npy"
+            np.save(tmp, values)
+            os.replace(tmp, out / name)
+
+
+class GeometryStore:
+    """Read-only, mmap'd geometry lookup by segment_id"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._offsets = np.load(self.directory / OFFSETS_FILE, mmap_mode="r")
+        self._ids = np.load(self.directory / IDS_FILE, mmap_mode="r")
+        self._deltas = np.load(self.directory / DELTAS_FILE, mmap_mode="r")
+        self._significance = np.load(self.directory / SIGNIFICANCE_FILE, mmap_mode="r")
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return (Path(directory) / OFFSETS_FILE).exists()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self._offsets, self._ids, self._deltas, self._significance))
+
+    def _row(self, segment_id: object) -> Optional[int]:
+        key = str(segment_id)
+        row = int(np.searchsorted(self._ids, key))
+        return row if row < len(self) and self._ids[row] == key else None
+
+    def coordinates(self, segment_id: object, tolerance_m: float = 0.0) -> Optional[np.ndarray]:
+        """(n, 2) lon/lat array, Douglas-Peucker simplified to `tolerance_m` (0 = full detail)"""
+        row = self._row(segment_id)
+        if row is None:
+            return None
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        points = np.cumsum(self._deltas[start:end], axis=0, dtype=np.int64) / COORD_SCALE
+        if tolerance_m > 0:
+            points = points[self._significance[start:end] > tolerance_m]
+        return points
+
+    def polyline(self, segment_id: object, tolerance_m: float = 0.0, precision: int = 5) -> Optional[str]:
+        points = self.coordinates(segment_id, tolerance_m)
+        return None if points is None else encode_polyline(points, precision)
@@ -0,0 +1,380 @@
+"""
+Load-testing harness with concurrency sweeps
+Description: Drives /chat and /retrieve with closed-loop virtual users at increasing concurrency and
+reports throughput, p50/p95/p99 latency, event-loop lag and RSS per level.
+
+Targets:
+    inprocess  the FastAPI app is imported and driven through an ASGI transport (shares our loop,
+               so loop lag is measured directly)
+    spawn      a uvicorn worker is started on localhost (loop lag is approximated by /health latency)
+    <url>      an already running server, e.g. http://127.0.0.1:8000 (pass --pid for RSS)
+
+In the first two modes a local OpenAI stand-in is started and the index is built through the real
+/create-embeddings endpoint from synthetic GeoJSON.
+
+Usage (from the backend directory):
+    python loadtest.py --target inprocess --concurrency 1,4,16,64 --duration 10
+    python loadtest.py --target spawn --mix chat:1,retrieve:3 --out capacity.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from fake_openai import FakeOpenAIServer, LatencyModel
+from synthetic import SCHEMAS, parse_size, write_geojson
+
+logger = logging.getLogger("loadtest")
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+QUERIES = [
+    "How was traffic on Sheikh Zayed Rd in Sep 2023?",
+    "Worst congestion on Al Khail Rd during weekday mornings",
+    "Average speed on Emirates Rd on weekends",
+    "Traffic on Al Wasl Rd from 7 AM to 9 AM",
+    "Which corridors were free-flowing in Sep 2023?",
+    "Slowest segments on Sheikh Rashid Rd",
+]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = q * (len(ordered) - 1)
+    lo = int(rank)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
+
+
+def rss_bytes(pid: Optional[int] = None) -> Optional[int]:
+    """Current resident set size from /proc; peak RSS via getrusage as a fallback for ourselves"""
+    path = f"/proc/{pid or 'self'}/status"
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition(":")
+        if name not in ("chat", "retrieve"):
+            raise ValueError(f"Unknown endpoint in mix: {name}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+class LoopLagProbe:
+    """Measures how late a periodic timer fires on the current event loop"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self) -> None:
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+class HealthLagProbe(LoopLagProbe):
+    """Out-of-process proxy for loop lag: latency of the trivial /health endpoint"""
+
+    def __init__(self, client: httpx.AsyncClient, interval: float = 0.05):
+        super().__init__(interval)
+        self.client = client
+
+    async def _run(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                await self.client.get("/health")
+            except httpx.HTTPError:
+                pass
+            self.samples.append(time.perf_counter() - t0)
+            await asyncio.sleep(self.interval)
+
+
+class Target:
+    """A running backend plus the client used to reach it"""
+
+    def __init__(self, client: httpx.AsyncClient, probe: LoopLagProbe, pid: Optional[int]):
+        self.client = client
+        self.probe = probe
+        self.pid = pid
+        self._cleanup: List[Any] = []
+
+    async def close(self) -> None:
+        await self.client.aclose()
+        for fn in reversed(self._cleanup):
+            result = fn()
+            if asyncio.iscoroutine(result):
+                await result
+
+
+async def _build_index(client: httpx.AsyncClient, fake: FakeOpenAIServer, args: argparse.Namespace) -> None:
+    """Ingest synthetic months through /create-embeddings on the target"""
+    files, keys = [], []
+    for i, month in enumerate(args.months.split(",")):
+        name = f"{args.schema}_{month}.geojson"
+        write_geojson(fake.geojson_dir / name, parse_size(args.dataset_size), args.schema, seed=args.seed + i)
+        files.append(f"{fake.url}/geojson/{name}")
+        keys.append(month)
+    logger.info(f"🗄️ Building index from {len(files)} synthetic file(s) of {args.dataset_size} segments...")
+    resp = await client.post(
+        "/create-embeddings", params={"files": files, "file_keys": keys}, timeout=None
+    )
+    resp.raise_for_status()
+    logger.info(f"✅ Index ready: {resp.json().get('total_embeddings')} embeddings")
+
+
+def _start_fake(args: argparse.Namespace, workdir: Path) -> FakeOpenAIServer:
+    fake = FakeOpenAIServer(
+        dimension=args.dim,
+        embed_latency=LatencyModel(args.embed_latency_ms, args.embed_jitter_ms),
+        chat_latency=LatencyModel(args.chat_latency_ms, args.chat_jitter_ms),
+        geojson_dir=str(workdir / "geojson_src"),
+    )
+    return fake.start_in_thread()
+
+
+async def open_target(args: argparse.Namespace) -> Target:
+    if args.target not in ("inprocess", "spawn"):
+        client = httpx.AsyncClient(base_url=args.target, timeout=args.timeout)
+        return Target(client, HealthLagProbe(client), args.pid)
+
+    workdir = Path(tempfile.mkdtemp(prefix="traffic-load-"))
+    fake = _start_fake(args, workdir)
+    env_overrides = {"OPENAI_BASE_URL": fake.openai_base_url, "OPENAI_API_KEY": "sk-loadtest"}
+    # Never load a published artifact or route through real shard servers instead of the load-test data
+    inherited = {k: v for k, v in os.environ.items() if k not in ("INDEX_ARTIFACT_DIR", "SHARD_SERVER_URLS")}
+
+    if args.target == "inprocess":
+        os.environ.pop("INDEX_ARTIFACT_DIR", None)
+        os.environ.pop("SHARD_SERVER_URLS", None)
+        os.environ.update(env_overrides)
+        sys.path.insert(0, str(BACKEND_DIR))
+        import main as backend
+
+        logging.getLogger(backend.__name__).setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        backend.CONFIG["embedding_dimension"] = args.dim
+        # Same paths as bench.py: nothing under the real embeddings/ can leak into a load test
+        for key in backend.BUILD_PATH_KEYS + ("metadata_path", "artifact_root", "checkpoint_dir"):
+            backend.CONFIG[key] = str(workdir / backend.CONFIG[key])
+        backend.CONFIG["geojson_dir"] = str(workdir / "geojson_cache")
+
+        transport = httpx.ASGITransport(app=backend.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://inprocess", timeout=args.timeout)
+        target = Target(client, LoopLagProbe(), None)
+    else:
+        port = _free_port()
+        env = {**inherited, **env_overrides}
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(BACKEND_DIR),
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=workdir, env=env,
+        )
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout)
+        for _ in range(200):
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass  # not listening yet
+            await asyncio.sleep(0.1)  # also while it answers non-200 (still loading)
+        else:
+            proc.terminate()
+            raise RuntimeError("Spawned server did not become healthy")
+        target = Target(client, HealthLagProbe(client), proc.pid)
+
+        def _stop_proc() -> None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+        target._cleanup.append(_stop_proc)
+
+    target._cleanup.append(fake.stop_thread)
+    target._cleanup.append(lambda: shutil.rmtree(workdir, ignore_errors=True))
+    await _build_index(client, fake, args)
+    return target
+
+
+async def _issue(client: httpx.AsyncClient, endpoint: str, args: argparse.Namespace, rng: random.Random) -> int:
+    query = rng.choice(QUERIES)
+    if endpoint == "chat":
+        resp = await client.post("/chat", json={"query": query, "top_k": args.top_k, "language": "en"})
+    else:
+        resp = await client.post("/retrieve", params={"query": query, "top_k": args.top_k})
+    return resp.status_code
+
+
+async def run_level(target: Target, concurrency: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Closed-loop run: `concurrency` virtual users issue requests back-to-back for `duration` seconds"""
+    mix = _parse_mix(args.mix)
+    names = [m[0] for m in mix]
+    weights = [m[1] for m in mix]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    statuses: Dict[str, int] = {}
+    deadline = time.perf_counter() + args.duration
+
+    async def _user(uid: int) -> None:
+        rng = random.Random(f"{args.seed}:{concurrency}:{uid}")
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                status = await _issue(target.client, endpoint, args, rng)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - t0
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 200:
+                latencies[endpoint].append(elapsed)
+
+    rss_before = rss_bytes(target.pid)
+    target.probe.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(_user(i) for i in range(concurrency)))
+    wall = time.perf_counter() - started
+    await target.probe.stop()
+    rss_after = rss_bytes(target.pid)
+
+    all_ok = [x for values in latencies.values() for x in values]
+    total = sum(statuses.values())
+    level: Dict[str, Any] = {
+        "concurrency": concurrency,
+        "duration_s": wall,
+        "requests": total,
+        "ok": len(all_ok),
+        "errors": total - len(all_ok),
+        "throughput_rps": len(all_ok) / wall if wall else 0.0,
+        "statuses": statuses,
+        "latency_ms": {
+            "p50": percentile(all_ok, 0.50) * 1000,
+            "p95": percentile(all_ok, 0.95) * 1000,
+            "p99": percentile(all_ok, 0.99) * 1000,
+        },
+        "per_endpoint": {
+            name: {
+                "ok": len(values),
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+            }
+            for name, values in latencies.items()
+        },
+        "loop_lag_ms": {
+            "source": "event_loop" if type(target.probe) is LoopLagProbe else "health_latency",
+            "p50": percentile(target.probe.samples, 0.50) * 1000,
+            "p99": percentile(target.probe.samples, 0.99) * 1000,
+            "max": max(target.probe.samples, default=0.0) * 1000,
+        },
+        "rss_bytes": {"before": rss_before, "after": rss_after},
+    }
+    logger.info(
+        f"📈 c={concurrency:<4} rps={level['throughput_rps']:8.1f}  "
+        f"p50={level['latency_ms']['p50']:8.1f}ms p95={level['latency_ms']['p95']:8.1f}ms "
+        f"p99={level['latency_ms']['p99']:8.1f}ms  lag_p99={level['loop_lag_ms']['p99']:7.1f}ms  "
+        f"errors={level['errors']}  rss={(rss_after or 0) / 2**20:7.1f}MiB"
+    )
+    return level
+
+
+async def sweep(args: argparse.Namespace) -> Dict[str, Any]:
+    target = await open_target(args)
+    levels = []
+    try:
+        if args.warmup:
+            await run_level(target, 1, argparse.Namespace(**{**vars(args), "duration": args.warmup}))
+        for concurrency in [int(c) for c in args.concurrency.split(",") if c]:
+            levels.append(await run_level(target, concurrency, args))
+    finally:
+        await target.close()
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "target": args.target,
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "levels": levels,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrency sweep for /chat and /retrieve")
+    parser.add_argument("--target", default="inprocess", help="inprocess, spawn, or a base URL")
+    parser.add_argument("--pid", type=int, default=None, help="Server PID for RSS when --target is a URL")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32,64")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of single-user warmup")
+    parser.add_argument("--mix", default="chat:1,retrieve:1", help="Weighted endpoint mix")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--dataset-size", default="1k", help="Segments per synthetic month")
+    parser.add_argument("--months", default="2022_Sep,2023_Sep", help="Synthetic months to ingest")
+    parser.add_argument("--schema", default="dash", choices=SCHEMAS)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--embed-latency-ms", type=float, default=60.0)
+    parser.add_argument("--embed-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=800.0)
+    parser.add_argument("--chat-jitter-ms", type=float, default=300.0)
+    parser.add_argument("--out", default=None, help="Write JSON report here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    report = asyncio.run(sweep(args))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        logger.info(f"💾 Wrote report to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
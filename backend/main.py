@@ -2,70 +2,208 @@
 Enterprise-Level FastAPI Traffic Analysis with OpenAI Embeddings + FAISS Vector Database
 Author: AI Assistant
 Description: Advanced traffic analysis system using semantic search and AI-powered insights
+
+Importing this module is cheap and side-effect free: numpy, faiss, aiohttp and openai are imported
+on first use, the OpenAI client is built on demand, and the index is loaded in the background by
+the application lifespan. Run with `uvicorn main:app` or `uvicorn main:create_app --factory`.
 """
 
+from __future__ import annotations
+
 import os
 import json
+import hashlib
 import asyncio
 import logging
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple
-import numpy as np
-import aiohttp
-import uvicorn
+from typing import List, Dict, Any, Callable, Literal, Optional, Sequence, Tuple
 import re
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, FastAPI, HTTPException, BackgroundTasks, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from dotenv import load_dotenv
-import faiss
-import openai
-from openai import AsyncOpenAI
-
-
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
+
+from admission import AdmissionController, AdmissionRejected
+from batcher import MicroBatcher
+from cancellation import ABANDONED, ClientDisconnected, DeadlineExceeded, run_until_disconnect, within_deadline
+from artifacts import CURRENT_LINK, artifact_paths, is_artifact, read_manifest, verify
+from cascade import CascadeRouter, Route, TierStats, make_router, query_signals, template_answer
+from checkpoint import EmbeddingCheckpoint, EmbeddingRunAborted
+from coalesce import SingleFlight, normalize_query
+from comparison import compare_periods, format_comparison, match_street, parse_period
+from diversify import mmr
+from extraction import extract_columns, gc_paused
+from features import METRICS as HOTSPOT_METRICS, format_hotspots, hotspots
+from prompt_budget import answer_kind, count_message_tokens, count_tokens, fit_lines, pack
+from embedding_providers import EmbeddingRouter, GeminiEmbeddingProvider, OpenAIEmbeddingProvider
+from geojson_cache import GeoJSONCache
+from geometry import GeometryBuilder, encode_polyline
+from segment_table import period_key
+from lazy import LazyModule
+from metrics import (
+    REGISTRY, CONTENT_TYPE, INDEX_VECTORS, INDEX_BYTES, LLM_TOKENS,
+    RequestTimer, request_timer, span, track_upstream
+)
+from scatter import ShardScatter, ShardsUnavailable
+from search_executor import SearchExecutor, SearchQueueFull, default_workers, default_omp_threads
+from shards import ShardSet, write_shards
+from store import SegmentStore
 
-# Load environment variables
-load_dotenv()
+np = LazyModule("numpy")
+faiss = LazyModule("faiss")
+aiohttp = LazyModule("aiohttp")
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Initialize FastAPI backend
-app = FastAPI(
-    title="Traffic Analysis AI - Embeddings + Vector Search",
-    description="Enterprise-level traffic analysis using OpenAI embeddings and FAISS vector database",
-    version="2.0.0"
-)
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+router = APIRouter()
 
 # Configuration
 CONFIG = {
     "openai_model": "text-embedding-3-small",
     "embedding_dimension": 1536,
     "faiss_index_path": "embeddings/faiss_index.bin",
-    "metadata_path": "embeddings/metadata.json",
+    "metadata_path": "embeddings/metadata.json",  # legacy format, migrated on load
+    "metadata_store_dir": "embeddings/metadata",
+    "index_info_path": "embeddings/index_info.json",  # records the embedding space the index was built in
     "geojson_dir": "data/geojson",
     "top_k_results": 5,
-    "max_tokens": 4000
+    "chat_model": "gpt-4o-mini",
+    "cascade": {
+        "router": "rules",  # "full" sends every answer to chat_model
+        "small_model": "gpt-4.1-nano",
+        "rules": {"min_top_score": 0.45, "min_margin": 0.03, "max_simple_words": 16, "max_short_words": 10},
+    },
+    "max_tokens": 4000,  # ceiling for any answer
+    "completion_tokens": {"lookup": 300, "ranking": 600, "comparison": 800, "analysis": 1200},
+    "prompt_token_budget": 3000,  # input tokens per chat request; segments beyond it are left out
+    "search_workers": default_workers(),
+    "search_max_queue": 64,
+    "warm_index_pages": True,
+    "query_batch_window_ms": 5.0,  # 0 sends each query embedding on its own
+    "query_batch_max": 64,
+    "llm_max_concurrent": 8,
+    "llm_max_queue": 32,
+    "chat_deadline_s": 30.0,  # per-request budget; the LLM stage gets whatever is left
+    "llm_rate_limit_cooldown_s": 5.0,
+    "retrieve_deadline_s": 10.0,
+    "embedding_hedge_quantile": 0.95,  # backup request fires after the primary's recent p95
+    "embedding_hedge_default_delay_s": 0.25,  # until enough latency samples exist
+    "geometry_tolerance_m": 5.0,  # Douglas-Peucker tolerance for geometry in responses
+    "compare_top_n": 10,
+    "hotspots_top_n": 10,
+    "mmr_fetch_factor": 4,  # shortlist size for diversified results, as a multiple of top_k
+    "mmr_max_candidates": 200,
+    "shard_dir": "embeddings/shards",  # per-month indexes; filtered queries only scan their months
+    "shard_memory_budget_mb": 1024,  # open shards beyond this are closed, least recently used first
+    "shard_timeout_s": 0.5,  # shard servers slower than this are left out of the merged results
+    "checkpoint_dir": "embeddings/checkpoints",  # embedding progress of unfinished ingest runs
+    "artifact_root": "embeddings/builds",  # build_index.py output; <root>/current is served read-only if present
+    "verify_artifact_checksums": False,  # sizes are always checked at load; full SHA-256 reads every byte
+    "ingest_max_consecutive_failures": 3,  # batches in a row that fail outright before a run stops
 }
+CONFIG["faiss_omp_threads"] = default_omp_threads(CONFIG["search_workers"])
+# Outputs of one index build (all relocated together for artifacts)
+BUILD_PATH_KEYS = ("faiss_index_path", "metadata_store_dir", "shard_dir", "index_info_path")
+
+# Async OpenAI client (shared across backend), built on first use by get_openai_client()
+openai_client: Optional[Any] = None
+_env_loaded = False
+
+
+def load_environment() -> None:
+    """Load .env once; existing environment variables take precedence"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def require_api_key() -> str:
+    """The OpenAI API key; raises if unset (cheap: no `openai` import, no client)"""
+    load_environment()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        logger.error("❌ OPEN_AI_API_KEY not found in environment variables")
+        raise RuntimeError("OpenAI API key is required")
+    return api_key
+
+
+def get_openai_client() -> Any:
+    """Return the shared AsyncOpenAI client, creating it on first use"""
+    global openai_client
+    if openai_client is None:
+        api_key = require_api_key()
+        from openai import AsyncOpenAI
+        openai_client = AsyncOpenAI(api_key=api_key)
+    return openai_client
+
+
+def _lazy_openai_client(**kwargs: Any) -> Callable[[], Any]:
+    """Factory for an extra AsyncOpenAI client, built on its first call like the shared one"""
+    client = None
+
+    def get() -> Any:
+        nonlocal client
+        if client is None:
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(**kwargs)
+        return client
+    return get
+
+embedding_router: Optional[EmbeddingRouter] = None
+cascade_router: Optional[CascadeRouter] = None
+tier_stats = TierStats()
+shard_scatter: Optional[ShardScatter] = None
+_shard_scatter_configured = False
+
+
+def get_embedding_router() -> EmbeddingRouter:
+    """Return the shared embedding router, building the provider list on first use.
+
+    The primary is the OpenAI client above. EMBEDDING_FALLBACK_BASE_URLS (comma-separated) adds
+    OpenAI-compatible endpoints serving the same model; GEMINI_API_KEY adds a Gemini provider, which
+    is only routed to for indexes built in its embedding space.
+    """
+    global embedding_router
+    if embedding_router is None:
+        load_environment()
+        providers = [OpenAIEmbeddingProvider("openai", get_openai_client, CONFIG["openai_model"], CONFIG["embedding_dimension"])]
+
+        fallback_urls = [u.strip() for u in os.getenv("EMBEDDING_FALLBACK_BASE_URLS", "").split(",") if u.strip()]
+        for i, base_url in enumerate(fallback_urls, 1):
+            client = _lazy_openai_client(
+                api_key=os.getenv("EMBEDDING_FALLBACK_API_KEY") or os.getenv("OPENAI_API_KEY"), base_url=base_url
+            )
+            providers.append(OpenAIEmbeddingProvider(
+                f"openai-fallback-{i}", client, CONFIG["openai_model"], CONFIG["embedding_dimension"]
+            ))
+
+        gemini_key = os.getenv("GEMINI_API_KEY")
+        if gemini_key:
+            try:
+                providers.append(GeminiEmbeddingProvider("gemini", gemini_key, dimension=CONFIG["embedding_dimension"]))
+            except RuntimeError as e:
+                logger.warning(f"⚠️ Gemini embeddings disabled: {e}")
+
+        embedding_router = EmbeddingRouter(
+            providers,
+            hedge_quantile=CONFIG["embedding_hedge_quantile"],
+            default_hedge_delay_s=CONFIG["embedding_hedge_default_delay_s"]
+        )
+        logger.info(f"🧭 Embedding providers: {', '.join(f'{p.name} ({p.space})' for p in providers)}")
+    return embedding_router
 
-# API Keys
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    logger.error("❌ OPEN_AI_API_KEY not found in environment variables")
-    raise RuntimeError("OpenAI API key is required")
-# Initialize async OpenAI client (shared across backend)
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+def get_cascade_router() -> CascadeRouter:
+    """Return the shared answer-tier router configured by CONFIG["cascade"]"""
+    global cascade_router
+    if cascade_router is None:
+        cascade_router = make_router(CONFIG["cascade"])
+        logger.info(f"🪜 Answer cascade router: {cascade_router.name}")
+    return cascade_router
 
 # GeoJSON URLs for traffic data
 # GEOJSON_URLS = {
@@ -76,10 +214,19 @@ openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 # }
 
 # Pydantic Models
+GeometryMode = Literal["polyline", "coordinates", "none"]  # how segment lines are returned
+
 class ChatRequest(BaseModel):
     query: str
     top_k: Optional[int] = 5
     language: Optional[str] = "en"  # "en" for English, "ar" for Arabic
+    timeout_s: Optional[float] = None  # defaults to CONFIG["chat_deadline_s"]
+    geometry: Optional[GeometryMode] = "polyline"
+    allow_degraded: Optional[bool] = True  # return retrieval-only results when the LLM is overloaded
+    mmr_lambda: Optional[float] = Field(None, ge=0.0, le=1.0)  # MMR re-ranking (1.0 = relevance only); None = off
+    dedup_segments: Optional[bool] = False  # at most one result per segment_id (e.g. not every month of one road)
+    prompt_token_budget: Optional[int] = Field(None, ge=200, le=100_000)  # defaults to CONFIG["prompt_token_budget"]
+    model_tier: Optional[Literal["template", "small", "full"]] = None  # force a cascade tier; None = router decides
 
 class ChatResponse(BaseModel):
     query: str
@@ -92,53 +239,95 @@ class EmbeddingStatus(BaseModel):
     status: str
     total_embeddings: int
     files_processed: List[str]
+    resumed_embeddings: int = 0  # taken from the checkpoint of an earlier, interrupted run
+    failed_embeddings: int = 0  # left out of the index, retried by the next run over the same data
     processing_time: Optional[float] = None
+    stage_timings_ms: Optional[Dict[str, float]] = None
 
 class HealthResponse(BaseModel):
     status: str
     embeddings_available: bool
     total_segments: int
     last_updated: Optional[str] = None
+    ready: bool = False
+    index_state: str = "starting"
+    index_load_seconds: Optional[float] = None
+
+def get_shard_scatter() -> Optional[ShardScatter]:
+    """Scatter-gather client when SHARD_SERVER_URLS (comma-separated) names shard servers, else None"""
+    global shard_scatter, _shard_scatter_configured
+    if not _shard_scatter_configured:
+        load_environment()
+        urls = [url.strip() for url in os.getenv("SHARD_SERVER_URLS", "").split(",") if url.strip()]
+        if urls:
+            shard_scatter = ShardScatter(urls, timeout_s=CONFIG["shard_timeout_s"])
+            logger.info(f"🔗 Searching through {len(urls)} shard servers")
+        _shard_scatter_configured = True
+    return shard_scatter
 
 # Global variables for FAISS and metadata
 faiss_index: Optional[faiss.Index] = None
-segment_metadata: List[Dict[str, Any]] = []
+segment_metadata: Sequence[Dict[str, Any]] = []
 embeddings_array_global: Optional[np.ndarray] = None
+shard_set: Optional[ShardSet] = None
+
+# Index lifecycle: starting → loading → ready | empty | error
+index_state: Dict[str, Any] = {
+    "state": "starting", "error": None, "load_seconds": None, "loaded_at": None, "embedding_space": None,
+    "snapshot": 0,  # bumped whenever the served index/metadata are swapped
+    "artifact": None,  # {"version", "path", ...} when serving a build_index.py artifact
+}
+
+# /embeddings/info body and ETag, computed once per index snapshot
+index_info: Dict[str, Any] = {"snapshot": None, "body": b"", "etag": ""}
+
+# CPU-bound retrieval runs here instead of on the event loop
+search_executor = SearchExecutor(
+    workers=CONFIG["search_workers"],
+    max_queue=CONFIG["search_max_queue"],
+    omp_threads=CONFIG["faiss_omp_threads"]
+)
+
+# Identical concurrent work shares one in-flight task
+embedding_flight = SingleFlight("embedding")
+retrieve_flight = SingleFlight("retrieve")
+chat_flight = SingleFlight("chat")
+
+# Bounds concurrent chat completions; overflow is rejected fast instead of queueing unbounded
+llm_admission = AdmissionController("llm", CONFIG["llm_max_concurrent"], CONFIG["llm_max_queue"])
+
+# Query embeddings from concurrent requests are sent upstream together
+query_embedding_batcher = MicroBatcher(
+    "query_embedding",
+    lambda texts: EmbeddingManager.embed_texts(texts),
+    max_batch=CONFIG["query_batch_max"],
+    window_ms=CONFIG["query_batch_window_ms"]
+)
+
+# Index size is read at scrape time so every code path that swaps the index is covered
+INDEX_VECTORS.set_function(lambda: faiss_index.ntotal if faiss_index is not None else 0)
+INDEX_BYTES.set_function(lambda: embeddings_array_global.nbytes if embeddings_array_global is not None else 0)
 
 class GeoJSONProcessor:
     """Processes GeoJSON traffic data for embedding creation"""
 
     # ---------- Local-file cache ----------
     @staticmethod
-    def _local_path(url: str) -> Path:
-        parts = url.split("/")
-        # Keep last 3 path components (e.g. 2023/Oct/Sheikh …geojson)
-        tail = "_".join(parts[-3:]).replace(" ", "_")
-        cache_dir = Path(CONFIG["geojson_dir"])
-        cache_dir.mkdir(parents=True, exist_ok=True)
-        return cache_dir / tail
-
-    # ---------- Downloader ----------
-    @staticmethod
     async def download_geojson(url: str, session: aiohttp.ClientSession) -> Dict[str, Any]:
-        """Download GeoJSON with local-file caching."""
-        local_path = GeoJSONProcessor._local_path(url)
-
-        if local_path.exists():
+        """Download GeoJSON through the compressed, revalidating download cache"""
+        cache = GeoJSONCache(CONFIG["geojson_dir"])
+        for attempt in range(2):
+            ref = await cache.fetch(url, session)
+            if ref is None:
+                return {}
             try:
-                return json.loads(local_path.read_text())
-            except Exception:
-                logger.warning(f"⚠️ Cache file {local_path} is corrupted, redownloading…")
-
-        try:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    local_path.write_text(json.dumps(data))
-                    return data
-                logger.error(f"Failed to download {url}: HTTP {resp.status}")
-        except Exception as e:
-            logger.error(f"Error downloading {url}: {e}")
+                def _load() -> Dict[str, Any]:
+                    with cache.open(ref) as f:
+                        return json.load(f)
+                return await asyncio.to_thread(_load)
+            except (OSError, EOFError, ValueError) as e:
+                logger.warning(f"⚠️ Cached copy of {url} is corrupted ({e}), redownloading…")
+                cache.evict(url)
         return {}
 
     # ---------- GeoJSON → list[segment] ----------
@@ -146,73 +335,21 @@ class GeoJSONProcessor:
     def extract_traffic_segments(
         geojson_data: Dict[str, Any],
         month: str,
-        year: int
+        year: int,
+        geometries: Optional[GeometryBuilder] = None
     ) -> List[Dict[str, Any]]:
-        """Extract traffic segments, handling both legacy and Dubai-dash schemas."""
-        segments: List[Dict[str, Any]] = []
-        if not geojson_data or "features" not in geojson_data:
-            return segments
-
-        for feat in geojson_data["features"]:
-            if not isinstance(feat, dict):
-                continue
-            geom = feat.get("geometry") or {}
-            prop = feat.get("properties") or {}
-            if geom.get("type") != "LineString":
-                continue
+        """Extract traffic segments, handling both legacy and Dubai-dash schemas.
 
-            # Common fields
-            seg_id = prop.get("SEGMENT_ID") or prop.get("segmentId") or prop.get("newSegmentId") or "unknown"
-            street = prop.get("STREET_NAME") or prop.get("streetName") or "Unknown Street"
-            speed_lim = prop.get("SPEED_LIMIT") or prop.get("speedLimit") or 100
-            dist = prop.get("DISTANCE") or prop.get("distance") or 0
-            samples = prop.get("SAMPLE_SIZE") or prop.get("sampleSize") or 0
-
-            avg_spd = prop.get("AVG_SPEED")
-            med_spd = prop.get("MEDIAN_SPEED")
-            travel_t = prop.get("AVG_TRAVEL_TIME")
-            time_periods: Dict[str, Any] = {}
-
-            # New schema
-            if avg_spd is None and "segmentTimeResults" in prop:
-                arr = prop["segmentTimeResults"]
-                if isinstance(arr, list) and arr:
-                    head = arr[0]
-                    avg_spd = head.get("averageSpeed") or head.get("harmonicAverageSpeed") or 0
-                    med_spd = head.get("medianSpeed") or 0
-                    travel_t = head.get("averageTravelTime") or 0
-                    for r in arr:
-                        label = f"time_set_{r.get('timeSet', 'na')}"
-                        time_periods[label] = {
-                            "AVG_SPEED": r.get("averageSpeed") or r.get("harmonicAverageSpeed"),
-                            "MEDIAN_SPEED": r.get("medianSpeed"),
-                        }
-
-            # Legacy schema
-            if not time_periods:
-                for k, v in prop.items():
-                    if isinstance(k, str) and ("WD_" in k or "WE_" in k):
-                        time_periods[k] = v
-                avg_spd = avg_spd or prop.get("AVG_SPEED", 0)
-                med_spd = med_spd or prop.get("MEDIAN_SPEED", 0)
-                travel_t = travel_t or prop.get("AVG_TRAVEL_TIME", 0)
-
-            segments.append({
-                "month": month,
-                "year": year,
-                "segment_id": seg_id,
-                "street_name": street,
-                "average_speed": avg_spd or 0,
-                "median_speed": med_spd or 0,
-                "distance": dist,
-                "sample_size": samples,
-                "travel_time": travel_t or 0,
-                "speed_limit": speed_lim,
-                "coordinates": geom.get("coordinates") or [],
-                "time_periods": time_periods,
-            })
-
-        return segments
+        The file's property layout is compiled once into field accessors and every field is
+        extracted as a column (see extraction.py). With `geometries`, each segment's LineString is
+        recorded there once per segment_id instead of being copied into every monthly segment dict.
+        """
+        with gc_paused():
+            columns = extract_columns(geojson_data, month, year)
+            if geometries is None:
+                return columns.records(with_coordinates=True)
+            geometries.add_many(columns.columns["segment_id"], columns.coordinates)
+            return columns.records()
 
     # ---------- Segment → text ----------
     @staticmethod
@@ -281,6 +418,12 @@ class QueryParser:
             def _24(h,p): return (int(h)%12) + (12 if p.upper()=="PM" else 0)
             out["hours"] = (_24(h1,p1), _24(h2,p2))
 
+        # Ranking questions ('worst bottlenecks', 'unusual slowdowns') are answered from features
+        if re.search(r"anomal|unusual", q, re.I):
+            out["hotspots"] = "speed_zscore"
+        elif re.search(r"bottleneck|hot\s*spots?|worst|most congested|slowest", q, re.I):
+            out["hotspots"] = "speed_ratio"
+
         return out
 
 
@@ -289,44 +432,74 @@ class EmbeddingManager:
 
     @staticmethod
     async def create_embedding(text: str) -> List[float]:
-        """Create embedding for given text using OpenAI API"""
+        """Create embedding for given text, sharing the call with identical concurrent requests"""
+        return await embedding_flight.do(
+            (CONFIG["openai_model"], normalize_query(text)),
+            lambda: EmbeddingManager._create_embedding(text)
+        )
+
+    @staticmethod
+    async def _create_embedding(text: str) -> List[float]:
+        """Create embedding for given text using OpenAI API, micro-batched with concurrent queries"""
         try:
-            response = await openai_client.embeddings.create(
-                model=CONFIG["openai_model"],
-                input=text
-            )
-            return response.data[0].embedding
+            if CONFIG["query_batch_window_ms"] > 0:
+                return await query_embedding_batcher.submit(text)
+            return (await EmbeddingManager.embed_texts([text]))[0]
         except Exception as e:
             logger.warning(f"Error creating embedding: {str(e)}")
             return []
 
     @staticmethod
-    async def create_embeddings_batch(texts: List[str], batch_size: int = 96) -> List[List[float]]:
+    async def embed_texts(texts: List[str]) -> List[List[float]]:
+        """One hedged embeddings call for several inputs in the index's space, results in input order"""
+        with track_upstream("embeddings"):
+            return await get_embedding_router().embed(texts, space=index_state.get("embedding_space"))
+
+    @staticmethod
+    async def create_embeddings_batch(texts: List[str], batch_size: int = 96,
+                                      checkpoint: Optional[EmbeddingCheckpoint] = None) -> EmbeddingCheckpoint:
         """
         Create embeddings in larger batches (OpenAI accepts multiple inputs in one call).
+
+        Progress is recorded in `checkpoint` after every batch and only items not yet embedded are
+        sent, so re-running over the same texts resumes. Items that still fail are marked failed
+        there, never stored as zero vectors.
         """
-        embeddings: List[List[float]] = []
+        router = get_embedding_router()
+        if checkpoint is None:
+            checkpoint = EmbeddingCheckpoint(None, texts, router.primary.space, CONFIG["embedding_dimension"])
+        consecutive_failures = 0
 
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
+        for batch in checkpoint.pending_batches(batch_size):
             try:
-                response = await openai_client.embeddings.create(
-                    model=CONFIG["openai_model"],
-                    input=batch
-                )
-                batch_embeddings = [d.embedding for d in response.data]
-                embeddings.extend(batch_embeddings)
+                # Bulk ingest isn't latency-critical, so no hedging (it would only double the cost)
+                with track_upstream("embeddings_batch"):
+                    batch_embeddings = await router.embed([texts[i] for i in batch], hedge=False)
+                checkpoint.record(batch, batch_embeddings)
+                consecutive_failures = 0
             except Exception as e:
                 logger.error(f"Error creating batch embeddings: {str(e)}")
                 # Fallback to single‑item processing when batch fails
-                for text in batch:
-                    single = await EmbeddingManager.create_embedding(text)
-                    embeddings.append(single if single else [0.0] * CONFIG["embedding_dimension"])
+                embedded = 0
+                for i in batch:
+                    try:
+                        with track_upstream("embeddings_batch"):
+                            single = await router.embed([texts[i]], hedge=False)
+                        checkpoint.record([i], single)
+                        embedded += 1
+                    except Exception as item_error:
+                        checkpoint.record_failure([i], str(item_error))
+                consecutive_failures = 0 if embedded else consecutive_failures + 1
+                if consecutive_failures >= CONFIG["ingest_max_consecutive_failures"]:
+                    raise EmbeddingRunAborted(
+                        f"{consecutive_failures} consecutive batches failed ({str(e)}); "
+                        f"{checkpoint.done_count}/{len(texts)} embeddings are checkpointed, re-run to resume"
+                    )
 
             # Small pause to respect rate limits
             await asyncio.sleep(0.2)
 
-        return embeddings
+        return checkpoint
 
 class FAISSManager:
     """Manages FAISS vector database operations"""
@@ -344,6 +517,13 @@ class FAISSManager:
         faiss.normalize_L2(embeddings)
         index.add(embeddings)
     
+    @staticmethod
+    def build_subindex(vectors: np.ndarray, candidate_ids: np.ndarray) -> faiss.Index:
+        """Build a flat index over a subset of rows (fancy indexing copies, so the source is untouched)"""
+        sub_index = FAISSManager.create_index(vectors.shape[1])
+        FAISSManager.add_embeddings(sub_index, np.ascontiguousarray(vectors[np.asarray(candidate_ids, dtype=np.int64)]))
+        return sub_index
+
     @staticmethod
     def search_similar(index: faiss.Index, query_embedding: np.ndarray, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
         """Search for similar embeddings"""
@@ -354,33 +534,80 @@ class FAISSManager:
     
     @staticmethod
     def save_index(index: faiss.Index, filepath: str) -> None:
-        """Save FAISS index to disk"""
+        """Save FAISS index to disk (write-then-rename so live mmaps of the old file stay valid)"""
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        faiss.write_index(index, filepath)
+        tmp_path = f"{filepath}.tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, filepath)
     
     @staticmethod
-    def load_index(filepath: str) -> Optional[faiss.Index]:
-        """Load FAISS index from disk"""
+    def load_index(filepath: str, mmap: bool = True) -> Optional[faiss.Index]:
+        """Load FAISS index from disk, memory-mapped read-only by default"""
         try:
-            if os.path.exists(filepath):
-                return faiss.read_index(filepath)
-            return None
+            if not os.path.exists(filepath):
+                return None
+            if mmap:
+                # IO_FLAG_MMAP_IFC maps flat codes in place; older builds only know IO_FLAG_MMAP
+                flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+                return faiss.read_index(filepath, flag | faiss.IO_FLAG_READ_ONLY)
+            return faiss.read_index(filepath)
         except Exception as e:
             logger.error(f"Error loading FAISS index: {str(e)}")
             return None
 
+    @staticmethod
+    def vectors_view(index: faiss.Index) -> np.ndarray:
+        """Stored vectors as an (ntotal, d) array; zero-copy (read-only) for flat indexes"""
+        if isinstance(index, faiss.IndexFlat) and index.ntotal:
+            view = faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+            view.flags.writeable = False
+            return view
+        return index.reconstruct_n(0, index.ntotal).astype(np.float32, copy=False)
+
 class OpenAIResponseGenerator:
     """Generates AI responses using OpenAI ChatCompletion"""
 
     @staticmethod
-    async def generate_traffic_analysis(query: str, similar_segments: List[Dict[str, Any]], language: str = "en") -> str:
-        """Generate traffic analysis using OpenAI ChatCompletion."""
+    def summarize_without_llm(similar_segments: List[Dict[str, Any]], language: str = "en") -> str:
+        """Retrieval-only answer used when the LLM is overloaded (degraded mode)"""
+        if language == "ar":
+            lines = ["* الخدمة مزدحمة حاليًا، هذه أقرب بيانات المرور لسؤالك:"]
+            for segment in similar_segments:
+                lines.append(
+                    f"* {segment['street_name']} ({segment['month']} {segment['year']}): "
+                    f"متوسط السرعة {segment['average_speed']:.1f} كم/س، المسافة {segment['distance']:.0f}م"
+                )
+        else:
+            lines = ["* Analysis is temporarily unavailable; the closest matching traffic data is:"]
+            for segment in similar_segments:
+                lines.append(
+                    f"* {segment['street_name']} ({segment['month']} {segment['year']}): "
+                    f"avg speed {segment['average_speed']:.1f} km/h over {segment['distance']:.0f}m"
+                )
+        return "\n".join(lines)
+
+    @staticmethod
+    async def generate_traffic_analysis(query: str, similar_segments: List[Dict[str, Any]], language: str = "en",
+                                        deadline: Optional[float] = None, exact_context: Optional[str] = None,
+                                        kind: str = "analysis", prompt_token_budget: Optional[int] = None,
+                                        model: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        """Generate traffic analysis using OpenAI ChatCompletion.
+
+        `exact_context` (e.g. a period comparison) is placed ahead of the retrieved segments, and
+        both are packed into `prompt_token_budget` input tokens, segments in relevance order.
+        `kind` (see prompt_budget.answer_kind) sets max_tokens; `model` defaults to
+        CONFIG["chat_model"]. Returns the answer and its token usage. Raises AdmissionRejected
+        when the call can't be admitted or finished before `deadline` (a time.monotonic() value),
+        so callers can answer fast or degrade.
+        """
 
         if language == "ar":
-            context = "بيانات المرور ذات الصلة:\n"
-            for i, segment in enumerate(similar_segments, 1):
-                context += f"\n{i}. {segment['month']} {segment['year']} - {segment['street_name']}\n"
-                context += f"   متوسط السرعة: {segment['average_speed']:.1f} كم/س، المسافة: {segment['distance']:.0f}م\n"
+            header = "بيانات المرور ذات الصلة:\n"
+            blocks = [
+                f"\n{i}. {segment['month']} {segment['year']} - {segment['street_name']}\n"
+                f"   متوسط السرعة: {segment['average_speed']:.1f} كم/س، المسافة: {segment['distance']:.0f}م\n"
+                for i, segment in enumerate(similar_segments, 1)
+            ]
 
             system_prompt = (
                 "أنت مساعد مروري في دبي مفيد ومعتمد على البيانات. "
@@ -388,80 +615,235 @@ class OpenAIResponseGenerator:
                 "اجب برؤى قابلة للتطبيق ونقاط قصيرة تبدأ بـ '*'. "
                 "يجب أن تكون إجابتك باللغة العربية."
             )
-            user_prompt = (
-                f"{context}\n\n"
+            question = (
                 f"سؤال المستخدم: {query}\n\n"
                 f"الجواب:"
             )
         else:
-            context = "RELEVANT TRAFFIC DATA:\n"
-            for i, segment in enumerate(similar_segments, 1):
-                context += f"\n{i}. {segment['month']} {segment['year']} - {segment['street_name']}\n"
-                context += f"   Avg Speed: {segment['average_speed']:.1f} km/h, Distance: {segment['distance']:.0f}m\n"
+            header = "RELEVANT TRAFFIC DATA:\n"
+            blocks = [
+                f"\n{i}. {segment['month']} {segment['year']} - {segment['street_name']}\n"
+                f"   Avg Speed: {segment['average_speed']:.1f} km/h, Distance: {segment['distance']:.0f}m\n"
+                for i, segment in enumerate(similar_segments, 1)
+            ]
 
             system_prompt = (
                 "You are a helpful and data-driven Dubai traffic assistant. "
                 "Use the provided context to answer the user's traffic-related query. "
                 "Respond with actionable insights and short bullet points starting with '*'."
             )
-            user_prompt = (
-                f"{context}\n\n"
+            question = (
                 f"User Question: {query}\n\n"
                 f"Answer:"
             )
 
+        # Fixed parts first, then the exact context, then as many segments as still fit
+        budget = prompt_token_budget or CONFIG["prompt_token_budget"]
+        left = budget - count_message_tokens([
+            {"role": "system", "content": system_prompt}, {"role": "user", "content": f"{header}\n\n{question}"}
+        ])
+        if exact_context:
+            exact_context = fit_lines(exact_context, max(left - 2, 0))
+            left -= count_tokens(exact_context) + 2
+        packed = pack(blocks, max(left, 0))
+        context = header + "".join(blocks[:packed])
+        if exact_context:
+            context = f"{exact_context}\n\n{context}"
+        user_prompt = f"{context}\n\n{question}"
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        max_tokens = min(CONFIG["completion_tokens"].get(kind, CONFIG["max_tokens"]), CONFIG["max_tokens"])
+        model = model or CONFIG["chat_model"]
+        usage: Dict[str, Any] = {
+            "model": model,
+            "answer_kind": kind,
+            "prompt_token_budget": budget,
+            "prompt_tokens_estimated": count_message_tokens(messages),
+            "max_tokens": max_tokens,
+            "segments_in_prompt": packed,
+            "segments_dropped": len(blocks) - packed,
+        }
+        if packed < len(blocks):
+            logger.info(f"✂️ Prompt budget {budget}: {packed}/{len(blocks)} segments included")
+
         try:
-            chat = await openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=CONFIG["max_tokens"]
-            )
-            return chat.choices[0].message.content.strip()
+            async with llm_admission.slot(deadline):
+                with track_upstream("chat"):
+                    chat = await asyncio.wait_for(
+                        get_openai_client().chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            max_tokens=max_tokens
+                        ),
+                        None if deadline is None else max(deadline - time.monotonic(), 0.001)
+                    )
+            if chat.usage is not None:
+                usage.update(prompt_tokens=chat.usage.prompt_tokens, completion_tokens=chat.usage.completion_tokens,
+                             total_tokens=chat.usage.total_tokens)
+                LLM_TOKENS.labels("prompt").inc(chat.usage.prompt_tokens)
+                LLM_TOKENS.labels("completion").inc(chat.usage.completion_tokens or 0)
+            return chat.choices[0].message.content.strip(), usage
+        except AdmissionRejected:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("⏱️ Chat completion exceeded the request deadline")
+            raise AdmissionRejected("deadline")
         except Exception as e:
+            if getattr(e, "status_code", None) == 429:
+                retry_after = CONFIG["llm_rate_limit_cooldown_s"]
+                try:
+                    retry_after = float(e.response.headers.get("retry-after", retry_after))
+                except (AttributeError, TypeError, ValueError):
+                    pass
+                llm_admission.cool_down(retry_after)
+                raise AdmissionRejected("upstream_rate_limited", 429, retry_after)
             logger.error(f"Error generating OpenAI chat response: {str(e)}")
             if language == "ar":
-                return "غير قادر على إنشاء التحليل في هذا الوقت."
-            return "Unable to generate analysis at this time."
+                return "غير قادر على إنشاء التحليل في هذا الوقت.", usage
+            return "Unable to generate analysis at this time.", usage
 
 # Initialize components on startup
+def _select_artifact() -> Optional[Dict[str, Any]]:
+    """Point the build paths at a read-only artifact: INDEX_ARTIFACT_DIR, else <artifact_root>/current"""
+    load_environment()
+    requested = os.getenv("INDEX_ARTIFACT_DIR")
+    directory = requested or str(Path(CONFIG["artifact_root"]) / CURRENT_LINK)
+    if not is_artifact(directory):
+        if requested:
+            raise RuntimeError(f"{requested} is not an index artifact (no manifest.json)")
+        return None
+    # Resolve `current` once: publishing a newer build must not swap files under this process
+    directory = str(Path(directory).resolve())
+    problems = verify(directory, checksums=CONFIG["verify_artifact_checksums"])
+    if problems:
+        raise RuntimeError(f"Artifact {directory} failed verification: {'; '.join(problems[:5])}")
+    paths = artifact_paths(directory)
+    CONFIG.update({key: paths[key] for key in BUILD_PATH_KEYS})
+    version = read_manifest(directory)["version"]
+    logger.info(f"📦 Serving index artifact {version} from {directory} (read-only)")
+    return {"version": version, "path": directory, "stats_path": paths["stats_path"]}
+
+def _load_artifacts() -> Tuple[Optional[faiss.Index], Sequence[Dict[str, Any]], Optional[np.ndarray]]:
+    """Map the index and segment store from disk (blocking; runs in a worker thread)"""
+    artifact = index_state["artifact"] = _select_artifact()
+
+    # Load FAISS index (memory-mapped, shared between worker processes via the page cache)
+    index = FAISSManager.load_index(CONFIG["faiss_index_path"])
+    
+    # Migrate a legacy metadata.json into the memory-mapped segment store
+    store_dir = CONFIG["metadata_store_dir"]
+    legacy_path = CONFIG["metadata_path"]
+    if artifact is None and os.path.exists(legacy_path) and (
+        not SegmentStore.exists(store_dir)
+        or os.path.getmtime(legacy_path) > os.path.getmtime(Path(store_dir) / "offsets.npy")
+    ):
+        logger.info(f"📦 Converting {legacy_path} to the memory-mapped segment store...")
+        with open(legacy_path, 'r') as f:
+            SegmentStore.write(json.load(f), store_dir)
+    
+    # Load metadata
+    metadata: Sequence[Dict[str, Any]] = SegmentStore(store_dir) if SegmentStore.exists(store_dir) else []
+    vectors = FAISSManager.vectors_view(index) if index is not None and index.ntotal else None
+    return index, metadata, vectors
+
+def _open_shards() -> Optional[ShardSet]:
+    """Open the per-month shard manifest; shards themselves are mapped on first search"""
+    if not ShardSet.exists(CONFIG["shard_dir"]):
+        return None
+    return ShardSet(CONFIG["shard_dir"], int(CONFIG["shard_memory_budget_mb"] * 2**20))
+
+def _read_index_space() -> Optional[str]:
+    """Embedding space recorded when the index was built (None for indexes predating the record)"""
+    try:
+        with open(CONFIG["index_info_path"], "r") as f:
+            return json.load(f).get("embedding_space")
+    except (OSError, ValueError):
+        return None
+
+def _write_index_space(space: str, path: Optional[str] = None) -> None:
+    path = path or CONFIG["index_info_path"]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"embedding_space": space, "created_at": datetime.now().isoformat()}, f)
+    os.replace(tmp_path, path)
+
+def _warm_pages(vectors: np.ndarray, chunk_rows: int = 65536) -> None:
+    """Fault mapped vector pages into the page cache so the first searches don't pay for disk reads"""
+    for start in range(0, len(vectors), chunk_rows):
+        float(vectors[start:start + chunk_rows, 0].sum())  # touching one column per row faults each page
+
 async def load_embeddings():
-    """Load FAISS index and metadata on startup"""
-    global faiss_index, segment_metadata
+    """Load FAISS index and metadata (in a thread, so the event loop keeps serving /health)"""
+    global faiss_index, segment_metadata, embeddings_array_global, shard_set
     
+    index_state.update(state="loading", error=None)
+    started = time.perf_counter()
     try:
-        # Load FAISS index
-        faiss_index = FAISSManager.load_index(CONFIG["faiss_index_path"])
-        
-        # Load metadata
-        if os.path.exists(CONFIG["metadata_path"]):
-            with open(CONFIG["metadata_path"], 'r') as f:
-                segment_metadata = json.load(f)
+        index, metadata, vectors = await asyncio.to_thread(_load_artifacts)
         
-        if faiss_index and segment_metadata:
+        if index and metadata:
+            faiss_index, segment_metadata, embeddings_array_global = index, metadata, vectors
+            index_state["embedding_space"] = _read_index_space()
+            shard_set = await asyncio.to_thread(_open_shards)
+            index_state["snapshot"] += 1
+            await asyncio.to_thread(_refresh_index_info)
             logger.info(f"✅ Loaded {len(segment_metadata)} embeddings from FAISS database")
-            global embeddings_array_global
-            embeddings_array_global = np.array(
-                [faiss_index.reconstruct(i) for i in range(faiss_index.ntotal)],
-                dtype=np.float32
-            )
+            if shard_set is not None:
+                logger.info(f"🧩 {len(shard_set.shards)} period shards available (mapped on demand)")
+            # With shards, queries touch only their months' pages; warming everything would defeat the budget
+            if CONFIG["warm_index_pages"] and vectors is not None and shard_set is None:
+                index_state["state"] = "warming"
+                await asyncio.to_thread(_warm_pages, vectors)
+            index_state.update(state="ready", loaded_at=datetime.now().isoformat())
         else:
+            index_state["state"] = "empty"
             logger.warning("⚠️ No existing embeddings found. Use /create-embeddings to build database.")
             
     except Exception as e:
+        index_state.update(state="error", error=str(e))
         logger.error(f"❌ Error loading embeddings: {str(e)}")
+    finally:
+        index_state["load_seconds"] = time.perf_counter() - started
+
+def _require_index(detail: str = "Embeddings database not found. Please create embeddings first using /create-embeddings") -> None:
+    """404 when no database exists, 503 while one is still being loaded"""
+    if faiss_index is not None and len(segment_metadata) > 0:
+        return
+    if index_state["state"] in ("starting", "loading"):
+        raise HTTPException(
+            status_code=503,
+            detail="Embeddings database is still loading, retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    raise HTTPException(status_code=404, detail=detail)
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize the application"""
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """Initialize clients and start loading the index without blocking startup"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     logger.info("🚀 Starting Traffic Analysis AI with Embeddings...")
-    await load_embeddings()
+    require_api_key()  # fail fast on a missing key; the client itself is built on first use
+    get_embedding_router()
+    get_shard_scatter()
+
+    loader: Optional[asyncio.Task] = None
+    # serve.py may have preloaded the index before forking workers
+    if faiss_index is None:
+        loader = asyncio.create_task(load_embeddings())
+    try:
+        yield
+    finally:
+        if loader is not None and not loader.done():
+            loader.cancel()
+        if shard_scatter is not None:
+            await shard_scatter.close()
+        search_executor.shutdown()
 
 # API Endpoints
 
-@app.get("/", response_model=Dict[str, Any])
+@router.get("/", response_model=Dict[str, Any])
 async def root():
     """Root endpoint with API information"""
     return {
@@ -472,7 +854,13 @@ async def root():
             "/create-embeddings": "POST - Create embeddings from GeoJSON files (one-time setup)",
             "/chat": "POST - Query traffic data using natural language",
             "/health": "GET - System health check",
-            "/embeddings/info": "GET - Embedding database statistics"
+            "/embeddings/info": "GET - Embedding database statistics",
+            "/segments/{segment_id}/geometry": "GET - Segment line as encoded polyline or coordinates",
+            "/segments/{segment_id}/series": "GET - Monthly measurements for one segment",
+            "/compare": "GET - Exact period-over-period speed and congestion changes",
+            "/hotspots": "GET - Worst segments of a month by precomputed congestion features",
+            "/cascade/stats": "GET - Answer latency per cascade tier (template / small / full model)",
+            "/metrics": "GET - Prometheus metrics (stage latencies, upstream calls, caches)"
         },
         "features": [
             "OpenAI Embeddings with semantic search",
@@ -481,9 +869,9 @@ async def root():
         ]
     }
 
-@app.get("/health", response_model=HealthResponse)
+@router.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (liveness; `ready` and `index_state` report readiness)"""
     global faiss_index, segment_metadata
     
     embeddings_available = faiss_index is not None and len(segment_metadata) > 0
@@ -492,41 +880,175 @@ async def health_check():
         status="healthy",
         embeddings_available=embeddings_available,
         total_segments=len(segment_metadata),
-        last_updated=datetime.now().isoformat() if embeddings_available else None
+        last_updated=index_state["loaded_at"] if embeddings_available else None,
+        ready=index_state["state"] == "ready",
+        index_state=index_state["state"],
+        index_load_seconds=index_state["load_seconds"]
     )
 
-@app.get("/embeddings/info", response_model=Dict[str, Any])
-async def embeddings_info():
-    """Get information about the embedding database"""
-    global faiss_index, segment_metadata
-    
-    if not faiss_index or not segment_metadata:
-        raise HTTPException(status_code=404, detail="Embeddings database not found. Create embeddings first.")
-    
-    # Analyze metadata
-    months = set()
-    years = set()
-    streets = set()
-    
-    for segment in segment_metadata:
-        months.add(segment.get('month', 'Unknown'))
-        years.add(segment.get('year', 0))
-        streets.add(segment.get('street_name', 'Unknown'))
-    
+@router.get("/health/ready", include_in_schema=False)
+async def readiness_check():
+    """Readiness probe: 200 once the index is loaded and warm (or known to be empty)"""
+    state = index_state["state"]
+    ready = state in ("ready", "empty")
+    return Response(
+        content=json.dumps({"ready": ready, "index_state": state, "error": index_state["error"]}),
+        media_type="application/json",
+        status_code=200 if ready else 503
+    )
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+def index_stats(index: faiss.Index, metadata: SegmentStore, shards: Optional[ShardSet],
+                paths: Dict[str, str]) -> Dict[str, Any]:
+    """/embeddings/info statistics for one build (column scans, no JSON decoding)"""
+    months = np.unique(metadata.column("month")).tolist()
+    years = np.unique(metadata.column("year")).tolist()
+    streets = np.unique(metadata.column("street_name")).tolist()
+    table = getattr(metadata, "table", None)
+
     return {
-        "total_segments": len(segment_metadata),
+        "total_segments": len(metadata),
         "embedding_dimension": CONFIG["embedding_dimension"],
-        "available_months": sorted(list(months)),
-        "available_years": sorted(list(years)),
-        "streets_covered": sorted(list(streets)),
-        "index_size": faiss_index.ntotal,
+        "available_months": months,
+        "available_years": years,
+        "streets_covered": streets,
+        "distinct_road_segments": len(table) if table is not None else None,
+        "index_size": index.ntotal,
+        "shards": sorted(shards.shards) if shards is not None else None,
         "database_files": {
-            "faiss_index": os.path.exists(CONFIG["faiss_index_path"]),
-            "metadata": os.path.exists(CONFIG["metadata_path"])
+            "faiss_index": os.path.exists(paths["faiss_index_path"]),
+            "metadata": SegmentStore.exists(paths["metadata_store_dir"])
         }
     }
 
-@app.post("/create-embeddings", response_model=EmbeddingStatus)
+def _refresh_index_info() -> None:
+    """Compute the /embeddings/info body for the current snapshot (blocking; column scans)"""
+    snapshot = index_state["snapshot"]
+    artifact = index_state.get("artifact")
+    if artifact and os.path.exists(artifact["stats_path"]):
+        # Precomputed by build_index.py
+        body = Path(artifact["stats_path"]).read_bytes()
+    else:
+        body = json.dumps(index_stats(faiss_index, segment_metadata, shard_set, CONFIG)).encode()
+    # Content hash rather than the snapshot counter, so every worker serving the same files agrees
+    index_info.update(snapshot=snapshot, body=body, etag=f'"{hashlib.sha1(body).hexdigest()[:20]}"')
+
+@router.get("/embeddings/info", response_model=Dict[str, Any])
+async def embeddings_info(http_request: Request):
+    """Get information about the embedding database (ETag / If-None-Match revalidation)"""
+    _require_index("Embeddings database not found. Create embeddings first.")
+
+    if index_info["snapshot"] != index_state["snapshot"]:
+        await asyncio.to_thread(_refresh_index_info)
+    headers = {"ETag": index_info["etag"], "Cache-Control": "no-cache"}
+    if_none_match = http_request.headers.get("if-none-match", "")
+    if index_info["etag"] in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=index_info["body"], media_type="application/json", headers=headers)
+
+@router.get("/cascade/stats", response_model=Dict[str, Any])
+async def cascade_stats():
+    """Recent answers and latency per cascade tier"""
+    return {
+        "router": get_cascade_router().name,
+        "models": {"small": CONFIG["cascade"]["small_model"], "full": CONFIG["chat_model"]},
+        "tiers": tier_stats.snapshot(),
+    }
+
+@router.get("/segments/{segment_id}/geometry", response_model=Dict[str, Any])
+async def segment_geometry(
+    segment_id: str,
+    tolerance_m: float = Query(0.0, ge=0.0, description="Douglas-Peucker tolerance in metres (0 = full detail)"),
+    format: Literal["polyline", "coordinates"] = "polyline"
+):
+    """Line geometry for one segment from the deduplicated geometry store"""
+    _require_index()
+    geometry = getattr(segment_metadata, "geometry", None)
+    points = geometry.coordinates(segment_id, tolerance_m) if geometry is not None else None
+    if points is None:
+        raise HTTPException(status_code=404, detail=f"No geometry for segment {segment_id}")
+
+    result = {"segment_id": segment_id, "tolerance_m": tolerance_m, "points": len(points)}
+    if format == "coordinates":
+        result["coordinates"] = points.tolist()
+    else:
+        result["polyline"] = encode_polyline(points)
+    return result
+
+@router.get("/segments/{segment_id}/series", response_model=Dict[str, Any])
+async def segment_series(segment_id: str):
+    """Monthly speed, travel time and sample size for one segment from the segment table"""
+    _require_index()
+    table = getattr(segment_metadata, "table", None)
+    series = table.series(segment_id) if table is not None else None
+    if series is None:
+        raise HTTPException(status_code=404, detail=f"No measurements for segment {segment_id}")
+    return series
+
+@router.get("/compare", response_model=Dict[str, Any])
+async def compare_endpoint(
+    base: str = Query(..., description="Earlier period, e.g. 'Sep 2022', '2022_Sep' or '2022-09'"),
+    target: str = Query(..., description="Later period, e.g. 'Sep 2023'"),
+    street: Optional[str] = Query(None, description="Case-insensitive street name filter"),
+    top_n: int = Query(10, ge=1, le=100)
+):
+    """Join two periods on segment_id; per-segment and per-street speed/congestion deltas"""
+    _require_index()
+    table = getattr(segment_metadata, "table", None)
+    if table is None:
+        raise HTTPException(status_code=404, detail="Segment table not found; rebuild embeddings to enable comparisons")
+
+    base_key, target_key = parse_period(base), parse_period(target)
+    if base_key is None or target_key is None:
+        raise HTTPException(status_code=400, detail="Periods must look like 'Sep 2023', '2023_Sep' or '2023-09'")
+
+    with request_timer("compare") as timer:
+        try:
+            result = await search_executor.run("compare", compare_periods, table, base_key, target_key, street, top_n)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=f"{e.args[0]}; available: {', '.join(table.period_labels)}")
+        except SearchQueueFull:
+            raise HTTPException(status_code=503, detail="Search capacity exhausted, retry shortly",
+                                headers={"Retry-After": "1"})
+        result["processing_time_ms"] = round(timer.elapsed() * 1000, 2)
+    return result
+
+@router.get("/hotspots", response_model=Dict[str, Any])
+async def hotspots_endpoint(
+    metric: Literal[tuple(HOTSPOT_METRICS)] = "speed_ratio",
+    period: Optional[str] = Query(None, description="Month, e.g. 'Sep 2023' (default: latest ingested)"),
+    street: Optional[str] = Query(None, description="Case-insensitive street name filter"),
+    min_samples: int = Query(0, ge=0, description="Ignore records with fewer vehicle samples"),
+    anomalies_only: bool = Query(False, description="Only records flagged as anomalous for their segment"),
+    top_n: int = Query(10, ge=1, le=500)
+):
+    """Rank one month's segments by a precomputed congestion feature (vectorized top-k)"""
+    _require_index()
+    if getattr(segment_metadata, "features", None) is None:
+        raise HTTPException(status_code=404, detail="Congestion features not found; rebuild embeddings to enable hotspots")
+
+    period_key_ = parse_period(period) if period else None
+    if period and period_key_ is None:
+        raise HTTPException(status_code=400, detail="Period must look like 'Sep 2023', '2023_Sep' or '2023-09'")
+
+    with request_timer("hotspots") as timer:
+        try:
+            result = await search_executor.run(
+                "hotspots", hotspots, segment_metadata, metric, top_n, period_key_, street, min_samples, anomalies_only
+            )
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=f"{e.args[0]}; available: {', '.join(segment_metadata.table.period_labels)}")
+        except SearchQueueFull:
+            raise HTTPException(status_code=503, detail="Search capacity exhausted, retry shortly",
+                                headers={"Retry-After": "1"})
+        result["processing_time_ms"] = round(timer.elapsed() * 1000, 2)
+    return result
+
+@router.post("/create-embeddings", response_model=EmbeddingStatus)
 async def create_embeddings_endpoint(
     background_tasks: BackgroundTasks,
     files: List[str] = Query(
@@ -541,229 +1063,594 @@ async def create_embeddings_endpoint(
     )
 ):
     """Create embeddings from GeoJSON files (dynamic URLs)"""
-    global faiss_index, segment_metadata
+    with request_timer("create-embeddings") as timer:
+        return await _create_embeddings(files, file_keys, timer)
 
-    start_time = datetime.now()
-    logger.info("🔄 Starting embedding creation process...")
+async def build_index(files: List[str], file_keys: Optional[List[str]], paths: Dict[str, str]) -> Dict[str, Any]:
+    """Download → parse → embed → index → save pipeline, writing to `paths` (CONFIG keys).
 
-    try:
-        all_segments = []
-        processed_files = []
+    Shared by /create-embeddings and the offline builder (build_index.py); stages are timed as spans.
+    """
+    all_segments = []
+    geometries = GeometryBuilder()
+    processed_files = []
 
-        if file_keys and len(file_keys) != len(files):
-            raise ValueError("Number of file_keys must match number of files")
+    if file_keys and len(file_keys) != len(files):
+        raise ValueError("Number of file_keys must match number of files")
 
-        async with aiohttp.ClientSession() as session:
-            for i, url in enumerate(files):
-                key = file_keys[i] if file_keys else f"file_{i+1}"
-                logger.info(f"📥 Downloading {key} from {url}...")
+    async with aiohttp.ClientSession() as session:
+        for i, url in enumerate(files):
+            key = file_keys[i] if file_keys else f"file_{i+1}"
+            logger.info(f"📥 Downloading {key} from {url}...")
 
-                # Extract month/year if in key
-                try:
-                    year, month = key.split('_')
-                    year = int(year)
-                except ValueError:
-                    logger.warning(f"⚠️ Unable to extract year/month from key: {key}. Skipping.")
-                    continue
+            # Extract month/year if in key
+            try:
+                year, month = key.split('_')
+                year = int(year)
+            except ValueError:
+                logger.warning(f"⚠️ Unable to extract year/month from key: {key}. Skipping.")
+                continue
 
-                # Download GeoJSON
+            # Download GeoJSON
+            with span("download"):
                 geojson_data = await GeoJSONProcessor.download_geojson(url, session)
 
-                if geojson_data:
-                    segments = GeoJSONProcessor.extract_traffic_segments(geojson_data, month, year)
-                    all_segments.extend(segments)
-                    processed_files.append(key)
-                    logger.info(f"✅ Processed {len(segments)} segments from {key}")
-                else:
-                    logger.warning(f"⚠️ Failed to process {key}")
-        
-        if not all_segments:
-            raise HTTPException(status_code=500, detail="No traffic segments found in GeoJSON files")
-        
-        logger.info(f"📊 Total segments to process: {len(all_segments)}")
-        
-        # Convert segments to text for embedding
-        logger.info("📝 Converting segments to text...")
+            if geojson_data:
+                with span("parse"):
+                    segments = GeoJSONProcessor.extract_traffic_segments(geojson_data, month, year, geometries)
+                all_segments.extend(segments)
+                processed_files.append(key)
+                logger.info(f"✅ Processed {len(segments)} segments from {key}")
+            else:
+                logger.warning(f"⚠️ Failed to process {key}")
+    
+    if not all_segments:
+        raise ValueError("No traffic segments found in GeoJSON files")
+    
+    logger.info(f"📊 Total segments to process: {len(all_segments)}")
+    
+    # Convert segments to text for embedding
+    logger.info("📝 Converting segments to text...")
+    with span("to_text"):
         texts = []
         for segment in all_segments:
             text = GeoJSONProcessor.convert_segment_to_text(segment)
             texts.append(text)
-        
-        # Create embeddings
-        logger.info("🤖 Creating embeddings with OpenAI...")
-        embeddings = await EmbeddingManager.create_embeddings_batch(texts)
-        
-        if len(embeddings) != len(all_segments):
-            logger.warning(f"⚠️ Embedding count mismatch: {len(embeddings)} vs {len(all_segments)}")
-        
-        # Create FAISS index
-        logger.info("🗄️ Building FAISS vector database...")
+    
+    # Create embeddings (checkpointed: an interrupted run over the same data resumes here)
+    logger.info("🤖 Creating embeddings with OpenAI...")
+    space = get_embedding_router().primary.space
+    with span("embed"):
+        checkpoint = EmbeddingCheckpoint(CONFIG["checkpoint_dir"], texts, space, CONFIG["embedding_dimension"])
+        resumed = checkpoint.done_count
+        await EmbeddingManager.create_embeddings_batch(texts, checkpoint=checkpoint)
+
+    # Segments whose embedding failed stay out of the index until a re-run embeds them
+    embedded = checkpoint.done
+    failed = len(texts) - int(embedded.sum())
+    if failed:
+        logger.warning(f"⚠️ {failed} segments failed to embed; they are kept in the checkpoint for retry")
+        all_segments = [segment for segment, ok in zip(all_segments, embedded) if ok]
+        if not all_segments:
+            raise ValueError("No segments could be embedded")
+    
+    # Create FAISS index
+    logger.info("🗄️ Building FAISS vector database...")
+    with span("index_build"):
         index = FAISSManager.create_index(CONFIG["embedding_dimension"])
-        embeddings_array = np.array(embeddings, dtype=np.float32)
-        global embeddings_array_global
-        embeddings_array_global = embeddings_array
-        FAISSManager.add_embeddings(index, embeddings_array)
-        
-        # Save to disk
-        logger.info("💾 Saving embeddings to disk...")
-        FAISSManager.save_index(index, CONFIG["faiss_index_path"])
-        
+        embeddings_array = np.array(checkpoint.vectors[embedded], dtype=np.float32)
+        await search_executor.run("index_build", FAISSManager.add_embeddings, index, embeddings_array)
+    
+    # Save to disk
+    logger.info("💾 Saving embeddings to disk...")
+    with span("save"):
+        FAISSManager.save_index(index, paths["faiss_index_path"])
+        _write_index_space(space, paths["index_info_path"])
+    
         # Save metadata
-        with open(CONFIG["metadata_path"], 'w') as f:
-            json.dump(all_segments, f, indent=2)
+        SegmentStore.write(all_segments, paths["metadata_store_dir"], geometries)
+
+        # Per-month shards (vectors were normalized in place by add_embeddings)
+        await search_executor.run(
+            "index_build", write_shards, embeddings_array,
+            [period_key(s.get("month"), s.get("year")) for s in all_segments], paths["shard_dir"]
+        )
+
+    # The index now holds the paid-for vectors; keep the checkpoint only while items remain
+    if not failed:
+        checkpoint.remove()
+
+    return {
+        "index": index,
+        "vectors": embeddings_array,
+        "embedding_space": space,
+        "total_embeddings": len(all_segments),
+        "files_processed": processed_files,
+        "resumed_embeddings": resumed,
+        "failed_embeddings": failed,
+    }
+
+async def _create_embeddings(files: List[str], file_keys: Optional[List[str]], timer: RequestTimer) -> EmbeddingStatus:
+    """Build into the configured paths and swap the result in, timing each stage on the request timer"""
+    global faiss_index, segment_metadata, shard_set, embeddings_array_global
+    logger.info("🔄 Starting embedding creation process...")
+
+    if index_state.get("artifact"):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Serving read-only artifact {index_state['artifact']['version']}; build with build_index.py"
+        )
+
+    try:
+        result = await build_index(files, file_keys, {key: CONFIG[key] for key in BUILD_PATH_KEYS})
         
         # Update global variables
-        faiss_index = index
-        segment_metadata = all_segments
+        faiss_index = result["index"]
+        embeddings_array_global = result["vectors"]
+        segment_metadata = SegmentStore(CONFIG["metadata_store_dir"])
+        shard_set = _open_shards()
+        index_state["snapshot"] += 1
+        await asyncio.to_thread(_refresh_index_info)
+        index_state.update(state="ready", error=None, loaded_at=datetime.now().isoformat(),
+                           embedding_space=result["embedding_space"])
         
-        processing_time = (datetime.now() - start_time).total_seconds()
+        processing_time = timer.elapsed()
         
         logger.info(f"✅ Embedding creation completed in {processing_time:.2f} seconds")
         
         return EmbeddingStatus(
-            status="success",
-            total_embeddings=len(embeddings),
-            files_processed=processed_files,
-            processing_time=processing_time
+            status="partial" if result["failed_embeddings"] else "success",
+            total_embeddings=result["total_embeddings"],
+            files_processed=result["files_processed"],
+            resumed_embeddings=result["resumed_embeddings"],
+            failed_embeddings=result["failed_embeddings"],
+            processing_time=processing_time,
+            stage_timings_ms=timer.as_dict()
         )
         
+    except EmbeddingRunAborted as e:
+        logger.error(f"❌ Embedding run stopped: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"Embedding run stopped: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error creating embeddings: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create embeddings: {str(e)}")
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
-    """Main chat endpoint for traffic queries with semantic search"""
-    global faiss_index, segment_metadata
+def _attach_geometry(segment: Dict[str, Any], mode: Optional[str]) -> Dict[str, Any]:
+    """Add the segment's line from the deduplicated geometry store, simplified for transfer"""
+    geometry = getattr(segment_metadata, "geometry", None)
+    if mode in (None, "none") or geometry is None or "coordinates" in segment:
+        return segment
+    if mode == "coordinates":
+        points = geometry.coordinates(segment.get("segment_id"), CONFIG["geometry_tolerance_m"])
+        segment["coordinates"] = [] if points is None else points.tolist()
+    else:
+        segment["polyline"] = geometry.polyline(segment.get("segment_id"), CONFIG["geometry_tolerance_m"])
+    return segment
 
-    start_time = datetime.now()
 
-    # Check if embeddings are available
-    if not faiss_index or not segment_metadata:
-        raise HTTPException(
-            status_code=404,
-            detail="Embeddings database not found. Please create embeddings first using /create-embeddings"
-        )
+def _attach_trend(segment: Dict[str, Any]) -> Dict[str, Any]:
+    """Add month-over-month / year-over-year speed change from the segment table"""
+    table = getattr(segment_metadata, "table", None)
+    if table is not None:
+        segment["trend"] = table.trend(segment.get("segment_id"), segment.get("month"), segment.get("year"))
+    return segment
+
+
+def _attach_features(segment: Dict[str, Any], row: int) -> Dict[str, Any]:
+    """Add the record's precomputed congestion features"""
+    features = getattr(segment_metadata, "features", None)
+    if features is not None:
+        segment["features"] = features.row(row)
+    return segment
+
+
+def _shortlist_size(top_k: int, mmr_lambda: Optional[float], dedup_segments: bool) -> int:
+    """How many neighbours to fetch so that re-ranking still has `top_k` good picks left"""
+    if not _diversified(mmr_lambda, dedup_segments):
+        return top_k
+    return max(top_k, min(top_k * CONFIG["mmr_fetch_factor"], CONFIG["mmr_max_candidates"]))
 
-    try:
-        logger.info(f"🔍 Processing query: {request.query}")
 
-        # ---- metadata filters based on user query ----
+def _diversify(query_array: np.ndarray, scores: np.ndarray, rows: np.ndarray, top_k: int,
+               mmr_lambda: Optional[float], dedup_segments: bool) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Re-rank a (scores, rows) shortlist by MMR over its embeddings and/or one-per-segment_id
+
+    Also returns what was applied: a scatter front holds no embeddings, so MMR there falls back
+    to the relevance order (deduplicated when asked).
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    valid = rows >= 0
+    scores, rows = scores[valid], rows[valid]
+    vectors = None
+    if mmr_lambda is not None and embeddings_array_global is not None:
+        vectors = embeddings_array_global[rows]
+    groups = segment_metadata.column("segment_id")[rows] if dedup_segments else None
+    order = mmr(query_array[0], vectors, top_k, 1.0 if mmr_lambda is None else mmr_lambda, groups, scores)
+    info = {"mmr_lambda": mmr_lambda, "dedup_segments": dedup_segments, "shortlist": int(len(rows)),
+            "mmr_applied": vectors is not None}
+    if mmr_lambda is not None and vectors is None:
+        info["fallback"] = "dedup_only" if dedup_segments else "relevance_only"
+        info["fallback_reason"] = "no stored embeddings on this node"
+    return scores[order], rows[order], info
+
+
+def _diversified(mmr_lambda: Optional[float], dedup_segments: bool) -> bool:
+    return mmr_lambda is not None or bool(dedup_segments)
+
+
+def _sharded() -> bool:
+    return get_shard_scatter() is not None or shard_set is not None
+
+
+async def _search_shards(query_array: np.ndarray, k: int, periods: Optional[List[int]], day_type: Optional[str],
+                         day_mask: Optional[np.ndarray], deadline: float) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Per-month shard search, on the shard servers when configured, otherwise in this process"""
+    scatter = get_shard_scatter()
+    if scatter is not None:
+        return await within_deadline(scatter.search(query_array, k, periods, day_type), deadline, "search")
+    scores, rows = await within_deadline(search_executor.run(
+        "search", shard_set.search, query_array, k, periods, day_mask
+    ), deadline, "search")
+    return scores, rows, {"shards_searched": len(shard_set.route(periods))}
+
+
+async def _run_chat_pipeline(request: ChatRequest) -> Tuple[List[Dict[str, Any]], str, Dict[str, Any]]:
+    """Filter → embed → search → LLM for one query; shared by coalesced identical requests"""
+    deadline = time.monotonic() + (request.timeout_s or CONFIG["chat_deadline_s"])
+
+    # ---- metadata filters based on user query ----
+    with span("filter"):
         qp = QueryParser.parse(request.query)
-        candidate_ids = list(range(len(segment_metadata)))
+        candidate_ids = np.arange(len(segment_metadata))
+        day_mask = None
 
-        # Month / Year filters
-        if "filters" in qp:
-            allowed = set()
-            for f in qp["filters"]:
-                for idx, seg in enumerate(segment_metadata):
-                    if seg["month"].startswith(f["month"]) and seg["year"] == f["year"]:
-                        allowed.add(idx)
-            candidate_ids = list(allowed) if allowed else candidate_ids
+        # Month / Year filters (with shards, routing to the month's shard replaces the row filter)
+        if "filters" in qp and not _sharded():
+            allowed = np.unique(np.concatenate([
+                segment_metadata.select_period(f["month"], f["year"]) for f in qp["filters"]
+            ]))
+            candidate_ids = allowed if len(allowed) else candidate_ids
 
         # Day‑type filter
         if "day_type" in qp:
-            key_prefix = "WD_" if qp["day_type"] == "weekday" else "WE_"
-            candidate_ids = [
-                idx for idx in candidate_ids
-                if any(key_prefix in k for k in segment_metadata[idx].get("time_periods", {}))
-            ] or candidate_ids
-
-        # Create embedding for user query
-        query_embedding = await EmbeddingManager.create_embedding(request.query)
+            flags = segment_metadata.column("has_weekday" if qp["day_type"] == "weekday" else "has_weekend")
+            narrowed = candidate_ids[flags[candidate_ids]]
+            if len(narrowed):
+                candidate_ids, day_mask = narrowed, flags
+
+    # Two or more periods named ("Sep 2023 vs Sep 2022"): attach the exact comparison
+    comparison = None
+    table = getattr(segment_metadata, "table", None)
+    street = match_street(request.query, table) if table is not None else None
+    periods = sorted({period_key(f["month"], f["year"]) for f in qp.get("filters", [])} - {None})
+    if table is not None and len(periods) >= 2:
+        with span("compare"):
+            try:
+                comparison = await search_executor.run(
+                    "compare", compare_periods, table, periods[0], periods[-1],
+                    street, CONFIG["compare_top_n"]
+                )
+            except KeyError as e:
+                logger.info(f"ℹ️ Skipping comparison: {e}")
 
-        if not query_embedding:
-            raise HTTPException(status_code=500, detail="Failed to create query embedding")
+    # "Worst bottlenecks in Sep 2023": exact ranking from the feature columns, not semantic luck
+    ranking = None
+    if "hotspots" in qp and getattr(segment_metadata, "features", None) is not None:
+        with span("hotspots"):
+            try:
+                ranking = await search_executor.run(
+                    "hotspots", hotspots, segment_metadata, qp["hotspots"], CONFIG["hotspots_top_n"],
+                    periods[-1] if periods else None, street
+                )
+            except KeyError as e:
+                logger.info(f"ℹ️ Skipping hotspots: {e}")
 
-        # Build a tiny sub‑index for the candidate set
-        query_array = np.array([query_embedding], dtype=np.float32)
+    # Create embedding for user query
+    with span("embed_query"):
+        query_embedding = await within_deadline(
+            EmbeddingManager.create_embedding(request.query), deadline, "embed_query"
+        )
 
-        # Build a tiny sub‑index for the candidate set
-        sub_index = FAISSManager.create_index(CONFIG["embedding_dimension"])
-        sub_vectors = np.array([embeddings_array_global[i] for i in candidate_ids], dtype=np.float32)
-        FAISSManager.add_embeddings(sub_index, sub_vectors)
+    if not query_embedding:
+        raise HTTPException(status_code=500, detail="Failed to create query embedding")
 
-        scores, local_indices = FAISSManager.search_similar(sub_index, query_array, request.top_k)
-        # Map local indices back to absolute IDs
-        indices = [[candidate_ids[i] for i in local_indices[0]]]
+    query_array = np.array([query_embedding], dtype=np.float32)
 
-        # Retrieve similar segments with metadata
+    shard_info: Dict[str, Any] = {}
+    fetch_k = _shortlist_size(request.top_k, request.mmr_lambda, request.dedup_segments)
+    if _sharded():
+        # Only the named months' shards are scanned; the day-type flags filter inside the scan
+        with span("search"):
+            scores, rows, shard_info = await _search_shards(
+                query_array, fetch_k, periods, qp.get("day_type") if day_mask is not None else None,
+                day_mask, deadline
+            )
+        rows = rows[0]
+    else:
+        # Build a tiny sub‑index for the candidate set (off the event loop)
+        with span("build_subindex"):
+            sub_index = await within_deadline(search_executor.run(
+                "build_subindex", FAISSManager.build_subindex, embeddings_array_global, candidate_ids
+            ), deadline, "build_subindex")
+
+        with span("search"):
+            scores, local_indices = await within_deadline(search_executor.run(
+                "search", FAISSManager.search_similar, sub_index, query_array, fetch_k
+            ), deadline, "search")
+        # Map local indices back to absolute IDs (FAISS pads with -1 when k > candidates)
+        rows = [candidate_ids[local] if local >= 0 else -1 for local in local_indices[0]]
+
+    diversity = None
+    # Gate on the options, not on fetch_k: at top_k >= mmr_max_candidates the shortlist is just top_k
+    if _diversified(request.mmr_lambda, request.dedup_segments):
+        with span("rerank"):
+            picked_scores, rows, diversity = await within_deadline(search_executor.run(
+                "rerank", _diversify, query_array, scores[0], rows, request.top_k,
+                request.mmr_lambda, request.dedup_segments
+            ), deadline, "rerank")
+            scores = picked_scores[None, :]
+
+    with span("fetch"):
         similar_segments = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(segment_metadata):
-                segment = segment_metadata[idx].copy()
-                segment['similarity_score'] = float(scores[0][i])
-                similar_segments.append(segment)
-
-        # Generate AI analysis using OpenAI Chat
-        logger.info("🧠 Generating AI analysis...")
-        ai_analysis = await OpenAIResponseGenerator.generate_traffic_analysis(
-            request.query,
-            similar_segments,
-            request.language
-        )
+        for score, row in zip(scores[0], rows):
+            if row < 0:
+                continue
+            segment = segment_metadata[int(row)]
+            segment['similarity_score'] = float(score)
+            similar_segments.append(_attach_features(_attach_trend(_attach_geometry(segment, request.geometry)), int(row)))
+    # Scores of real hits only: FAISS pads a short candidate set with -1 rows and -3.4e38 scores
+    hit_scores = [segment["similarity_score"] for segment in similar_segments]
+
+    exact_context = "\n\n".join(
+        block for block in (format_comparison(comparison) if comparison else "",
+                            format_hotspots(ranking) if ranking else "") if block
+    )
 
-        processing_time = (datetime.now() - start_time).total_seconds()
-
-        logger.info(f"✅ Query processed in {processing_time:.2f} seconds")
-
-        return ChatResponse(
-            query=request.query,
-            similar_segments=similar_segments,
-            ai_analysis=ai_analysis,
-            search_metadata={
-                "total_segments_searched": len(segment_metadata),
-                "top_k_returned": len(similar_segments),
-                "average_similarity": float(np.mean(scores[0])) if len(scores[0]) > 0 else 0.0,
-                "search_method": "FAISS cosine similarity"
-            },
-            processing_time=processing_time
-        )
+    # Generate AI analysis using OpenAI Chat
+    logger.info("🧠 Generating AI analysis...")
+    degraded = None
+    tokens = None
+    kind = answer_kind(request.query, comparison is not None, ranking is not None)
+    route = get_cascade_router().route(
+        query_signals(request.query, qp, kind, hit_scores, comparison is not None, ranking is not None, street)
+    )
+    if request.model_tier:
+        route = Route(request.model_tier, "requested", route.signals)
+    with span("llm"):
+        t0 = time.perf_counter()
+        ai_analysis = None
+        if route.tier == "template":
+            ai_analysis = template_answer(
+                similar_segments, ranking, request.language, street=street, filters=qp.get("filters", ())
+            )
+            if ai_analysis is None:
+                route = Route("small", "no_template_data", route.signals)
+        if ai_analysis is None:
+            try:
+                ai_analysis, tokens = await OpenAIResponseGenerator.generate_traffic_analysis(
+                    request.query,
+                    similar_segments,
+                    request.language,
+                    deadline=deadline,
+                    exact_context=exact_context or None,
+                    kind=kind,
+                    prompt_token_budget=request.prompt_token_budget,
+                    model=CONFIG["cascade"]["small_model"] if route.tier == "small" else None
+                )
+            except AdmissionRejected as e:
+                if not request.allow_degraded:
+                    raise
+                logger.warning(f"⚠️ LLM not admitted ({e.reason}), answering with retrieval-only results")
+                ai_analysis = OpenAIResponseGenerator.summarize_without_llm(similar_segments, request.language)
+                degraded = e.reason
+        if degraded is None:
+            tier_stats.record(route, time.perf_counter() - t0)
+
+    search_metadata = {
+        "total_segments_searched": len(segment_metadata),
+        "top_k_returned": len(similar_segments),
+        "average_similarity": float(np.mean(hit_scores)) if hit_scores else 0.0,
+        "search_method": "FAISS cosine similarity" + (" + MMR" if diversity and diversity["mmr_applied"] else ""),
+        **shard_info,
+        "degraded": degraded is not None,
+    }
+    search_metadata["cascade"] = route.as_dict()
+    if tokens:
+        search_metadata["tokens"] = tokens
+    if diversity:
+        search_metadata["diversity"] = diversity
+    if comparison:
+        search_metadata["comparison"] = comparison
+    if ranking:
+        search_metadata["hotspots"] = ranking
+    if degraded:
+        search_metadata["degraded_reason"] = degraded
+    return similar_segments, ai_analysis, search_metadata
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest, http_request: Request):
+    """Main chat endpoint for traffic queries with semantic search"""
+    global faiss_index, segment_metadata
 
-    except Exception as e:
-        logger.error(f"❌ Error processing chat query: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to process query: {str(e)}")
+    # Check if embeddings are available
+    _require_index()
 
+    with request_timer("chat") as timer:
+        try:
+            logger.info(f"🔍 Processing query: {request.query}")
+
+            key = (normalize_query(request.query), request.top_k, request.language, request.allow_degraded,
+                   request.geometry, request.mmr_lambda, request.dedup_segments, request.prompt_token_budget,
+                   request.model_tier, request.timeout_s or CONFIG["chat_deadline_s"])
+            coalesced = chat_flight.in_flight(key)
+            # Work is cancelled (down to the OpenAI call) as soon as the client goes away
+            similar_segments, ai_analysis, search_metadata = await run_until_disconnect(
+                http_request, chat_flight.do(key, lambda: _run_chat_pipeline(request)), "chat"
+            )
 
-@app.post("/retrieve")
-async def retrieve_chunks(query: str, top_k: int = 5):
-    """
-    Retrieve top-k most similar traffic chunks based on query.
-    """
-    global faiss_index, segment_metadata, embeddings_array_global
+            processing_time = timer.elapsed()
 
-    if not faiss_index or not segment_metadata:
-        raise HTTPException(
-            status_code=404,
-            detail="Embeddings database not found. Please create embeddings first using /create-embeddings"
-        )
+            logger.info(f"✅ Query processed in {processing_time:.2f} seconds")
 
-    try:
-        logger.info(f"🔍 Retrieving chunks for query: {query}")
+            return ChatResponse(
+                query=request.query,
+                similar_segments=similar_segments,
+                ai_analysis=ai_analysis,
+                search_metadata={
+                    **search_metadata,
+                    "coalesced": coalesced,
+                    "stage_timings_ms": timer.as_dict()
+                },
+                processing_time=processing_time
+            )
+
+        except ClientDisconnected:
+            raise HTTPException(status_code=499, detail="Client closed request")
+        except DeadlineExceeded as e:
+            ABANDONED.labels("chat", "deadline").inc()
+            logger.warning(f"⏱️ Chat query {e}")
+            raise HTTPException(status_code=504, detail=f"Query exceeded its deadline ({e.stage})")
+        except SearchQueueFull as e:
+            logger.warning(f"⚠️ Rejecting chat query: {e}")
+            raise HTTPException(status_code=503, detail="Search capacity exhausted, retry shortly",
+                                headers={"Retry-After": "1"})
+        except ShardsUnavailable as e:
+            logger.error(f"❌ {e}")
+            raise HTTPException(status_code=503, detail="Search shards unavailable, retry shortly",
+                                headers={"Retry-After": "1"})
+        except AdmissionRejected as e:
+            logger.warning(f"⚠️ Rejecting chat query: LLM {e.reason}")
+            raise HTTPException(status_code=e.status_code, detail=f"Analysis capacity exhausted ({e.reason}), retry shortly",
+                                headers=e.headers)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error processing chat query: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to process query: {str(e)}")
+
+
+async def _run_retrieval(query: str, top_k: int, geometry: str = "polyline", mmr_lambda: Optional[float] = None,
+                         dedup_segments: bool = False) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Embed → search for one query; shared by coalesced identical requests"""
+    deadline = time.monotonic() + CONFIG["retrieve_deadline_s"]
 
-        # Create embedding for the query
-        query_embedding = await EmbeddingManager.create_embedding(query)
-        if not query_embedding:
-            raise HTTPException(status_code=500, detail="Failed to create query embedding")
+    # Create embedding for the query
+    with span("embed_query"):
+        query_embedding = await within_deadline(EmbeddingManager.create_embedding(query), deadline, "embed_query")
+    if not query_embedding:
+        raise HTTPException(status_code=500, detail="Failed to create query embedding")
 
-        query_array = np.array([query_embedding], dtype=np.float32)
+    query_array = np.array([query_embedding], dtype=np.float32)
 
-        # Perform search
-        scores, indices = FAISSManager.search_similar(faiss_index, query_array, top_k)
+    # Perform search (unfiltered: every shard, merged, when the index is sharded)
+    fetch_k = _shortlist_size(top_k, mmr_lambda, dedup_segments)
+    with span("search"):
+        if _sharded():
+            scores, indices, _ = await _search_shards(query_array, fetch_k, None, None, None, deadline)
+        else:
+            scores, indices = await within_deadline(search_executor.run(
+                "search", FAISSManager.search_similar, faiss_index, query_array, fetch_k
+            ), deadline, "search")
+    diversity = None
+    if _diversified(mmr_lambda, dedup_segments):
+        with span("rerank"):
+            top_scores, top_indices, diversity = await within_deadline(search_executor.run(
+                "rerank", _diversify, query_array, scores[0], indices[0], top_k, mmr_lambda, dedup_segments
+            ), deadline, "rerank")
+            scores, indices = top_scores[None, :], top_indices[None, :]
+
+    with span("fetch"):
         top_indices = indices[0]
         top_scores = scores[0]
 
         # Fetch segments and add score
         results = []
         for i, idx in enumerate(top_indices):
-            if idx < len(segment_metadata):
-                seg = segment_metadata[idx].copy()
+            if 0 <= idx < len(segment_metadata):
+                seg = segment_metadata[int(idx)]
                 seg['similarity_score'] = float(top_scores[i])
-                results.append(seg)
+                results.append(_attach_features(_attach_trend(_attach_geometry(seg, geometry)), int(idx)))
+    return results, diversity
 
-        return {"query": query, "results": results}
 
-    except Exception as e:
-        logger.exception("❌ Error in retrieval")
-        raise HTTPException(status_code=500, detail=str(e))
+@router.post("/retrieve")
+async def retrieve_chunks(http_request: Request, query: str, top_k: int = 5, geometry: GeometryMode = "polyline",
+                          mmr_lambda: Optional[float] = Query(None, ge=0.0, le=1.0,
+                                                              description="MMR re-ranking weight (1.0 = relevance only)"),
+                          dedup_segments: bool = Query(False, description="At most one result per segment_id")):
+    """
+    Retrieve top-k most similar traffic chunks based on query.
+    """
+    global faiss_index, segment_metadata, embeddings_array_global
+
+    _require_index()
+
+    with request_timer("retrieve") as timer:
+        try:
+            logger.info(f"🔍 Retrieving chunks for query: {query}")
+
+            key = (normalize_query(query), top_k, geometry, mmr_lambda, dedup_segments)
+            coalesced = retrieve_flight.in_flight(key)
+            results, diversity = await run_until_disconnect(
+                http_request,
+                retrieve_flight.do(key, lambda: _run_retrieval(query, top_k, geometry, mmr_lambda, dedup_segments)),
+                "retrieve"
+            )
+
+            response = {
+                "query": query,
+                "results": results,
+                "coalesced": coalesced,
+                "stage_timings_ms": timer.as_dict()
+            }
+            if diversity:
+                response["diversity"] = diversity
+            return response
+
+        except ClientDisconnected:
+            raise HTTPException(status_code=499, detail="Client closed request")
+        except DeadlineExceeded as e:
+            ABANDONED.labels("retrieve", "deadline").inc()
+            logger.warning(f"⏱️ Retrieval {e}")
+            raise HTTPException(status_code=504, detail=f"Retrieval exceeded its deadline ({e.stage})")
+        except SearchQueueFull as e:
+            logger.warning(f"⚠️ Rejecting retrieval: {e}")
+            raise HTTPException(status_code=503, detail="Search capacity exhausted, retry shortly",
+                                headers={"Retry-After": "1"})
+        except ShardsUnavailable as e:
+            logger.error(f"❌ {e}")
+            raise HTTPException(status_code=503, detail="Search shards unavailable, retry shortly",
+                                headers={"Retry-After": "1"})
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.exception("❌ Error in retrieval")
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+def create_app() -> FastAPI:
+    """Application factory; cheap to call, heavy initialization happens in the lifespan"""
+    application = FastAPI(
+        title="Traffic Analysis AI - Embeddings + Vector Search",
+        description="Enterprise-level traffic analysis using OpenAI embeddings and FAISS vector database",
+        version="2.0.0",
+        lifespan=lifespan
+    )
+
+    # Add CORS middleware
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    application.include_router(router)
+    return application
+
 
+# Initialize FastAPI backend (`uvicorn main:app`)
+app = create_app()
@@ -0,0 +1,375 @@
+"""
+Request-scoped timing spans and Prometheus-format metrics
+Description: Dependency-free counters, gauges and histograms rendered in the Prometheus text
+exposition format, plus monotonic-clock spans that attribute request latency to pipeline stages.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [(n, v) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        key = tuple(str(v) for v in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._new_child()
+                self._children[key] = child
+            return child
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} requires labels {self.labelnames}")
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def render(self, name: str, labelnames: Sequence[str], key: Sequence[str]) -> List[str]:
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self._value)}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+        self._fn: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = float(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        """Evaluate fn at scrape time instead of storing a value"""
+        self._fn = fn
+
+    @property
+    def value(self) -> float:
+        if self._fn is not None:
+            try:
+                return float(self._fn())
+            except Exception:
+                return float("nan")
+        return self._value
+
+    def render(self, name: str, labelnames: Sequence[str], key: Sequence[str]) -> List[str]:
+        value = self.value
+        return [f"{name}{_format_labels(labelnames, key)} {'NaN' if math.isnan(value) else _format_value(value)}"]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default().dec(amount)
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        self._default().set_function(fn)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self._upper = list(buckets) + [float("inf")]
+        self._counts = [0] * len(self._upper)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, upper in enumerate(self._upper):
+                if value <= upper:
+                    self._counts[i] += 1
+                    break
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def quantile(self, q: float) -> float:
+        """Bucket-resolution quantile estimate (upper bound of the bucket holding q)"""
+        with self._lock:
+            total = self._count
+            counts = list(self._counts)
+        if not total:
+            return float("nan")
+        target = q * total
+        running = 0
+        for upper, count in zip(self._upper, counts):
+            running += count
+            if running >= target:
+                return upper
+        return self._upper[-1]
+
+    def render(self, name: str, labelnames: Sequence[str], key: Sequence[str]) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total, total_sum = self._count, self._sum
+        lines = []
+        running = 0
+        for upper, count in zip(self._upper, counts):
+            running += count
+            labels = _format_labels(labelnames, key, ("le", _format_value(upper)))
+            lines.append(f"{name}_bucket{labels} {running}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(total_sum)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, key)} {total}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket latency/size distribution"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+
+class Registry:
+    """Ordered collection of metrics rendered together on /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Re-importing a module must not duplicate series
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---- Core application metrics ----
+REQUEST_SECONDS = REGISTRY.histogram(
+    "traffic_request_duration_seconds", "End-to-end handler latency", ["endpoint"]
+)
+REQUESTS_TOTAL = REGISTRY.counter(
+    "traffic_requests_total", "Handled requests by outcome", ["endpoint", "outcome"]
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "traffic_stage_duration_seconds", "Latency of individual pipeline stages", ["endpoint", "stage"]
+)
+UPSTREAM_INFLIGHT = REGISTRY.gauge(
+    "traffic_upstream_inflight", "Upstream (OpenAI) calls currently in flight", ["kind"]
+)
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "traffic_upstream_duration_seconds", "Upstream call latency", ["kind", "outcome"]
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "traffic_cache_requests_total", "Cache lookups by result (hit/miss)", ["cache", "result"]
+)
+INDEX_VECTORS = REGISTRY.gauge("traffic_index_vectors", "Vectors in the live FAISS index")
+INDEX_BYTES = REGISTRY.gauge("traffic_index_vector_bytes", "Bytes held by the live embedding matrix")
+LLM_TOKENS = REGISTRY.counter(
+    "traffic_llm_tokens_total", "Chat-completion tokens reported by the upstream", ["kind"]
+)
+
+
+# ---- Request-scoped spans ----
+class RequestTimer:
+    """Collects per-stage durations for one request using the monotonic clock"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+            STAGE_SECONDS.labels(self.endpoint, stage).observe(elapsed)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict[str, float]:
+        """Stage durations in milliseconds, rounded for JSON responses"""
+        return {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+
+
+_current_timer: ContextVar[Optional[RequestTimer]] = ContextVar("traffic_request_timer", default=None)
+
+
+@contextmanager
+def request_timer(endpoint: str) -> Iterator[RequestTimer]:
+    """Open a request scope; spans opened anywhere below (same task) attach to it"""
+    timer = RequestTimer(endpoint)
+    token = _current_timer.set(timer)
+    outcome = "error"
+    try:
+        yield timer
+        outcome = "ok"
+    finally:
+        _current_timer.reset(token)
+        REQUEST_SECONDS.labels(endpoint).observe(timer.elapsed())
+        REQUESTS_TOTAL.labels(endpoint, outcome).inc()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a stage of the current request (no-op outside a request scope)"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.span(stage):
+        yield
+
+
+@contextmanager
+def track_upstream(kind: str) -> Iterator[None]:
+    """Count an in-flight upstream call and record its latency and outcome"""
+    gauge = UPSTREAM_INFLIGHT.labels(kind)
+    gauge.inc()
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        gauge.dec()
+        UPSTREAM_SECONDS.labels(kind, outcome).observe(time.perf_counter() - t0)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
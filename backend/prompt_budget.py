@@ -0,0 +1,117 @@
+"""
+Token-budgeted prompt assembly
+Description: generate_traffic_analysis used to paste every retrieved segment into the prompt
+unmeasured and reserve max_tokens=4000 for every answer, so a large top_k inflated prompt cost and
+latency while a one-line lookup still held a 4000-token completion budget. Here the prompt is
+measured locally before the call: the exact context (comparison, hotspots) and then the segments,
+most relevant first, are packed into a per-request input budget, and the completion budget follows
+the kind of question.
+
+Counts use tiktoken's o200k_base (the gpt-4o family's encoding) when tiktoken is installed and its
+encoding loads, else an offline estimate from a tokenizer-like split of the text; either way no
+request waits on the network to count.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+ENCODING = "o200k_base"
+MESSAGE_OVERHEAD = 3  # role and separators per chat message
+REPLY_PRIMING = 3  # every reply is primed with <|start|>assistant<|message|>
+
+# Kinds of answer, each with its own completion budget (CONFIG["completion_tokens"] in main)
+ANSWER_KINDS = ("lookup", "ranking", "comparison", "analysis")
+
+_LOOKUP = re.compile(r"^\s*(what(?:'s| is| was| are)?|how (?:fast|slow|long|far|busy)|which|when)\b", re.I)
+_OPEN_ENDED = re.compile(r"\b(why|explain|recommend|suggest|improve|reduce|analy[sz]|trend|pattern|insight|plan)", re.I)
+
+# Estimator pieces: ASCII words, 1-3 digit groups (as o200k splits numbers), runs of other letters
+# (e.g. Arabic), newline runs, and any other single visible character
+_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|[^\W\d_A-Za-z]+|\n+|\S")
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Optional[Any]:
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(ENCODING)
+    except Exception as e:  # not installed, or the encoding file can't be loaded offline
+        logger.info(f"ℹ️ Estimating prompt tokens locally (tiktoken {ENCODING} unavailable: {e})")
+        return None
+
+
+def _estimate(text: str) -> int:
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        first = piece[0]
+        if first.isascii() and first.isalpha():
+            tokens += 1 + (len(piece) - 1) // 8
+        elif first.isdigit() or first == "\n" or len(piece) == 1:
+            tokens += 1
+        else:
+            tokens += (len(piece) + 1) // 2
+    return tokens
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in `text` (exact with tiktoken, otherwise estimated)"""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return _estimate(text)
+
+
+def count_message_tokens(messages: Sequence[Dict[str, str]]) -> int:
+    """Prompt tokens of a chat.completions `messages` list"""
+    return sum(MESSAGE_OVERHEAD + count_tokens(m["content"]) for m in messages) + REPLY_PRIMING
+
+
+def fit_lines(text: str, budget: int) -> str:
+    """Leading lines of `text` that fit in `budget` tokens (exact context is line-structured)"""
+    if count_tokens(text) <= budget:
+        return text
+    kept: List[str] = []
+    used = 0
+    for line in text.split("\n"):
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+def pack(blocks: Sequence[str], budget: int) -> int:
+    """How many leading `blocks` (already in relevance order) fit in `budget` tokens"""
+    used = 0
+    for n, block in enumerate(blocks):
+        used += count_tokens(block)
+        if used > budget:
+            return n
+    return len(blocks)
+
+
+def is_open_ended(query: str) -> bool:
+    """Asks for explanation or advice rather than numbers ("why …", "suggest …")"""
+    return bool(_OPEN_ENDED.search(query))
+
+
+def answer_kind(query: str, comparison: bool = False, ranking: bool = False) -> str:
+    """Which completion budget a question needs: short lookups need far fewer tokens than open analysis"""
+    if is_open_ended(query):
+        return "analysis"
+    if comparison:
+        return "comparison"
+    if ranking:
+        return "ranking"
+    if _LOOKUP.search(query) and len(query.split()) <= 14:
+        return "lookup"
+    return "analysis"
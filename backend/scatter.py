@@ -0,0 +1,184 @@
+"""
+Scatter-gather search across shard-server processes
+Description: The front routes a query to shards by period exactly like a local ShardSet, then sends
+one request per shard server that owns any of those shards (over a pooled keep-alive HTTP session,
+query vector as raw float32 bytes) and merges the per-server top-k. Servers that miss the timeout
+or fail are dropped from the answer instead of stalling it; the result says which shards were
+missing. Which server owns which shard is learned from /shard/info and refreshed periodically and
+after failures.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from lazy import LazyModule
+from metrics import REGISTRY
+
+np = LazyModule("numpy")
+aiohttp = LazyModule("aiohttp")
+
+logger = logging.getLogger(__name__)
+
+SCATTER_REQUESTS = REGISTRY.counter(
+    "traffic_scatter_requests_total", "Shard-server search requests by outcome", ["outcome"]
+)
+SCATTER_SECONDS = REGISTRY.histogram("traffic_scatter_seconds", "Shard-server search latency")
+
+
+class ShardsUnavailable(Exception):
+    """No shard server answered for any of the routed shards"""
+
+
+class ShardScatter:
+    """Fans searches out to shard servers and merges their top-k"""
+
+    def __init__(self, urls: Sequence[str], timeout_s: float = 0.5, refresh_interval_s: float = 30.0,
+                 max_connections: int = 64):
+        self.urls = [url.rstrip("/") for url in urls]
+        self.timeout_s = timeout_s
+        self.refresh_interval_s = refresh_interval_s
+        self.max_connections = max_connections
+        self._owners: Dict[str, List[str]] = {}  # shard name → servers holding it
+        self._by_period: Dict[int, str] = {}
+        self._periods: Dict[str, int] = {}
+        self._next_refresh = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+        self._replica = itertools.count()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # One keep-alive pool per event loop (tests and serve.py workers each run their own loop)
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session_loop is not loop or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout_s),
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    # ---------- Shard catalog ----------
+    async def _fetch_info(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            async with self._get_session().get(f"{url}/shard/info") as resp:
+                resp.raise_for_status()
+                return await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"⚠️ Shard server {url} unavailable: {e!r}")
+            return None
+
+    async def _refresh(self) -> None:
+        infos = await asyncio.gather(*(self._fetch_info(url) for url in self.urls))
+        owners: Dict[str, List[str]] = {}
+        by_period: Dict[int, str] = {}
+        for url, info in zip(self.urls, infos):
+            if info is None:
+                # Keep routing to an unreachable server's last known shards so they are reported missing
+                shards = {name: self._periods.get(name) for name, urls in self._owners.items() if url in urls}
+            else:
+                shards = {name: shard["period_key"] for name, shard in info.get("shards", {}).items()}
+            for name, key in shards.items():
+                owners.setdefault(name, []).append(url)
+                by_period[key] = name
+        self._periods = {name: key for key, name in by_period.items()}
+        self._owners, self._by_period = owners, by_period
+        # Retry soon while some server is down, otherwise on the regular interval
+        self._next_refresh = time.monotonic() + (1.0 if None in infos else self.refresh_interval_s)
+        logger.info(f"🔗 {len(owners)} shards on {sum(i is not None for i in infos)}/{len(self.urls)} shard servers")
+
+    async def refresh(self) -> None:
+        """Refresh the catalog; concurrent callers share one round of /shard/info requests"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        await asyncio.shield(self._refreshing)
+
+    def route(self, period_keys: Optional[Sequence[int]]) -> List[str]:
+        """Same semantics as ShardSet.route, over the shards the servers reported"""
+        if period_keys:
+            names = [self._by_period[k] for k in period_keys if k in self._by_period]
+            if names:
+                return names
+        return list(self._owners)
+
+    # ---------- Search ----------
+    async def _search_server(self, url: str, payload: bytes, k: int, names: List[str],
+                             day_type: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        params = {"k": str(k), "shards": ",".join(names)}
+        if day_type:
+            params["day_type"] = day_type
+        started = time.perf_counter()
+        async with self._get_session().post(
+            f"{url}/shard/search", params=params, data=payload,
+            headers={"Content-Type": "application/octet-stream"}
+        ) as resp:
+            resp.raise_for_status()
+            body = await resp.json()
+        SCATTER_SECONDS.observe(time.perf_counter() - started)
+        return np.asarray(body["scores"], dtype=np.float32), np.asarray(body["rows"], dtype=np.int64)
+
+    async def search(self, query: np.ndarray, k: int, period_keys: Optional[Sequence[int]] = None,
+                     day_type: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+        """Merged top-k as FAISS-style (1, k) scores and SegmentStore rows, plus what was searched"""
+        if time.monotonic() >= self._next_refresh:
+            await self.refresh()
+        names = self.route(period_keys)
+        if not names:
+            raise ShardsUnavailable("No shard servers reachable")
+
+        # One request per server; replicated shards alternate between their owners
+        plan: Dict[str, List[str]] = {}
+        for name in names:
+            owners = self._owners[name]
+            plan.setdefault(owners[next(self._replica) % len(owners)], []).append(name)
+
+        payload = np.ascontiguousarray(query, dtype="<f4").tobytes()
+        tasks = {
+            asyncio.ensure_future(self._search_server(url, payload, k, shard_names, day_type)): url
+            for url, shard_names in plan.items()
+        }
+        for task in tasks:
+            # Abandoned requests end in CancelledError/TimeoutError; nobody needs to see those
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=self.timeout_s)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        all_scores, all_rows, missing, failed = [], [], [], False
+        for task, url in tasks.items():
+            if task in pending:
+                SCATTER_REQUESTS.labels("timeout").inc()
+                missing.extend(plan[url])
+                logger.warning(f"⏱️ Shard server {url} missed the {self.timeout_s * 1000:.0f} ms timeout")
+            elif task.exception() is not None:
+                SCATTER_REQUESTS.labels("error").inc()
+                missing.extend(plan[url])
+                failed = True
+                logger.warning(f"⚠️ Shard server {url} failed: {task.exception()!r}")
+            else:
+                SCATTER_REQUESTS.labels("ok").inc()
+                scores, rows = task.result()
+                all_scores.append(scores)
+                all_rows.append(rows)
+        if failed:
+            self._next_refresh = 0.0
+        if not all_scores:
+            raise ShardsUnavailable(f"No shard server answered for {len(names)} shards")
+
+        scores = np.concatenate(all_scores)
+        rows = np.concatenate(all_rows)
+        top = np.argsort(-scores, kind="stable")[:k]
+        info = {"shards_searched": len(names), "shard_servers": len(plan), "shards_missing": sorted(missing)}
+        return scores[top][None, :], rows[top][None, :], info
@@ -0,0 +1,118 @@
+"""
+Dedicated executor for CPU-bound retrieval work
+Description: Runs FAISS searches, sub-index builds and vector math on a bounded thread pool so the
+asyncio event loop keeps serving other requests. FAISS and NumPy release the GIL inside their
+kernels, so searches on the pool genuinely overlap with request handling.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = REGISTRY.gauge("traffic_search_queue_depth", "Retrieval jobs waiting for a pool thread")
+ACTIVE_JOBS = REGISTRY.gauge("traffic_search_active", "Retrieval jobs currently running on the pool")
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "traffic_search_queue_wait_seconds", "Time retrieval jobs spent queued", ["op"]
+)
+RUN_SECONDS = REGISTRY.histogram(
+    "traffic_search_run_seconds", "Time retrieval jobs spent running", ["op"]
+)
+REJECTED = REGISTRY.counter(
+    "traffic_search_rejected_total", "Retrieval jobs rejected because the queue was full", ["op"]
+)
+
+
+class SearchQueueFull(Exception):
+    """Raised when the retrieval queue is at capacity; handlers map this to 503"""
+
+
+def default_workers() -> int:
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+def default_omp_threads(workers: int) -> int:
+    # Split cores between pool threads so concurrent searches don't oversubscribe the CPU
+    return max(1, (os.cpu_count() or 1) // max(workers, 1))
+
+
+class SearchExecutor:
+    """Bounded thread pool with queue-depth accounting and per-op metrics"""
+
+    def __init__(self, workers: int, max_queue: int, omp_threads: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.omp_threads = omp_threads
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def _init_thread(self) -> None:
+        # OpenMP thread counts are per-thread state, so each pool thread sets its own
+        import faiss
+        faiss.omp_set_num_threads(self.omp_threads)
+
+    def _ensure_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix="faiss-search",
+                        initializer=self._init_thread,
+                    )
+                    logger.info(
+                        f"🧵 Search executor: {self.workers} threads × {self.omp_threads} OpenMP threads, "
+                        f"queue limit {self.max_queue}"
+                    )
+        return self._pool
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def run(self, op: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) on the pool; raises SearchQueueFull instead of queueing without bound"""
+        pool = self._ensure_pool()
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                REJECTED.labels(op).inc()
+                raise SearchQueueFull(f"Search queue full ({self._pending} pending)")
+            self._pending += 1
+        QUEUE_DEPTH.inc()
+        submitted = time.perf_counter()
+
+        def _job() -> Any:
+            QUEUE_DEPTH.dec()
+            ACTIVE_JOBS.inc()
+            t0 = time.perf_counter()
+            QUEUE_WAIT_SECONDS.labels(op).observe(t0 - submitted)
+            try:
+                return fn(*args)
+            finally:
+                RUN_SECONDS.labels(op).observe(time.perf_counter() - t0)
+                ACTIVE_JOBS.dec()
+
+        def _release(done: Any) -> None:
+            # Fires when the job finishes or is cancelled before it started running
+            if done.cancelled():
+                QUEUE_DEPTH.dec()
+            with self._lock:
+                self._pending -= 1
+
+        future = pool.submit(_job)
+        future.add_done_callback(_release)
+        # Cancelling the awaiting task cancels the job too if it has not started yet
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
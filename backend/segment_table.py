@@ -0,0 +1,202 @@
+"""
+Segment dimension table and monthly measurement arrays
+Description: Every monthly ingest used to repeat a segment's static attributes in its own dict, and
+months were linked by string matching. Here segments are normalized into a dimension table keyed by
+segment_id (street, speed limit, distance) plus dense (segments × periods) float32 arrays for each
+measurement, with NaN where a segment has no data for a month. Month-over-month and year-over-year
+changes are then plain array arithmetic over two columns.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from lazy import LazyModule
+
+np = LazyModule("numpy")
+
+logger = logging.getLogger(__name__)
+
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+MEASURES = ("average_speed", "median_speed", "travel_time", "sample_size")
+ATTRIBUTES = ("street_name", "speed_limit", "distance")
+
+IDS_FILE = "segment_ids.npy"
+PERIODS_FILE = "periods.npy"
+
+
+def period_key(month: Any, year: Any) -> Optional[int]:
+    """Months since year 0 for ('Sep', 2023) or ('September', '2023'); None if unparseable"""
+    try:
+        return int(year) * 12 + MONTHS.index(str(month)[:3].title())
+    except (ValueError, TypeError):
+        return None
+
+
+def period_label(key: int) -> str:
+    return f"{MONTHS[key % 12]} {key // 12}"
+
+
+def _number(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _json_value(value: Any) -> Any:
+    # float32 → float carries representation noise (697.7000122); 3 decimals is the data's precision
+    return round(value, 3) if isinstance(value, float) else value
+
+
+def _last_occurrence(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct keys and the position of each one's last occurrence
+
+    NumPy does not define which value wins when a fancy-index assignment repeats an index, so
+    duplicates are resolved here (np.unique's return_index is the first occurrence, hence the
+    reversal).
+    """
+    distinct, first_reversed = np.unique(keys[::-1], return_index=True)
+    return distinct, len(keys) - 1 - first_reversed
+
+
+class SegmentTable:
+    """mmap'd dimension table plus (segments × periods) measurement arrays"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        load = lambda name: np.load(self.directory / f"{name}.npy", mmap_mode="r")
+        self.segment_ids = np.load(self.directory / IDS_FILE, mmap_mode="r")
+        self.periods = np.load(self.directory / PERIODS_FILE, mmap_mode="r")
+        self._attributes = {name: load(name) for name in ATTRIBUTES}
+        self._measures = {name: load(name) for name in MEASURES}
+        # Per SegmentStore record: which table row and period column it came from
+        self.record_segment = load("record_segment")
+        self.record_period = load("record_period")
+        self._street_index: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    # ---------- Writing ----------
+    @staticmethod
+    def write(segments: Sequence[Dict[str, Any]], directory: str) -> None:
+        """Normalize monthly segment dicts; the last record for a (segment, month) wins"""
+        out = Path(directory)
+        out.mkdir(parents=True, exist_ok=True)
+
+        keys = [period_key(s.get("month"), s.get("year")) for s in segments]
+        periods = np.array(sorted({k for k in keys if k is not None}), dtype=np.int32)
+        ids = np.array([str(s.get("segment_id", "unknown")) for s in segments], dtype=str)
+        segment_ids, record_segment = np.unique(ids, return_inverse=True)
+        record_period = np.searchsorted(periods, np.array([-1 if k is None else k for k in keys], dtype=np.int32))
+        record_period[np.array([k is None for k in keys], dtype=bool)] = -1
+
+        # Static attributes from each segment's latest record (latest period, then last in input order)
+        order = np.argsort(record_period, kind="stable")
+        _, last = _last_occurrence(record_segment[order])
+        latest = order[last]  # every segment has a record, so the unique keys are 0..n-1
+        arrays: Dict[str, np.ndarray] = {
+            "street_name": np.array([str(segments[i].get("street_name", "Unknown")) for i in latest], dtype=str),
+            "speed_limit": np.array([_number(segments[i].get("speed_limit")) for i in latest], dtype=np.float32),
+            "distance": np.array([_number(segments[i].get("distance")) for i in latest], dtype=np.float32),
+        }
+
+        valid = np.flatnonzero(record_period >= 0)
+        cells, last = _last_occurrence(record_segment[valid].astype(np.int64) * len(periods) + record_period[valid])
+        winners = valid[last]
+        for name in MEASURES:
+            grid = np.full((len(segment_ids), len(periods)), np.nan, dtype=np.float32)
+            grid.reshape(-1)[cells] = np.array([_number(segments[i].get(name)) for i in winners], dtype=np.float32)
+            arrays[name] = grid
+
+        arrays["record_segment"] = record_segment.astype(np.int32)
+        arrays["record_period"] = record_period.astype(np.int16)
+        arrays[PERIODS_FILE[:-4]] = periods
+        # Ids last: a reader that finds them finds a complete table
+        arrays[IDS_FILE[:-4]] = segment_ids
+        for name, values in arrays.items():
+            tmp = out / f"{name}.tmp.npy"
+            np.save(tmp, values)
+            os.replace(tmp, out / f"{name}.npy")
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return (Path(directory) / IDS_FILE).exists()
+
+    # ---------- Lookup ----------
+    def __len__(self) -> int:
+        return len(self.segment_ids)
+
+    def row(self, segment_id: object) -> Optional[int]:
+        key = str(segment_id)
+        row = int(np.searchsorted(self.segment_ids, key))
+        return row if row < len(self) and self.segment_ids[row] == key else None
+
+    def column(self, key: Optional[int]) -> Optional[int]:
+        """Period column for a period_key(), or None when that month wasn't ingested"""
+        if key is None:
+            return None
+        col = int(np.searchsorted(self.periods, key))
+        return col if col < len(self.periods) and int(self.periods[col]) == key else None
+
+    def attribute(self, name: str) -> np.ndarray:
+        return self._attributes[name]
+
+    def street_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(unique street names, per-segment code), computed once for filters and group-bys"""
+        if self._street_index is None:
+            self._street_index = np.unique(self._attributes["street_name"], return_inverse=True)
+        return self._street_index
+
+    def measure(self, name: str) -> np.ndarray:
+        """(segments × periods) array, NaN where a segment has no data for a month"""
+        return self._measures[name]
+
+    @property
+    def period_labels(self) -> List[str]:
+        return [period_label(int(k)) for k in self.periods]
+
+    # ---------- Time series ----------
+    def change(self, measure: str, from_key: Optional[int], to_key: Optional[int]) -> Optional[np.ndarray]:
+        """Per-segment change of `measure` between two periods (NaN where either is missing)"""
+        a, b = self.column(from_key), self.column(to_key)
+        if a is None or b is None:
+            return None
+        values = self.measure(measure)
+        return values[:, b] - values[:, a]
+
+    def month_over_month(self, measure: str, key: int) -> Optional[np.ndarray]:
+        return self.change(measure, key - 1, key)
+
+    def year_over_year(self, measure: str, key: int) -> Optional[np.ndarray]:
+        return self.change(measure, key - 12, key)
+
+    def series(self, segment_id: object) -> Optional[Dict[str, Any]]:
+        """All months for one segment as JSON-ready lists (None for missing months)"""
+        row = self.row(segment_id)
+        if row is None:
+            return None
+        return {
+            "segment_id": str(segment_id),
+            **{name: _json_value(self._attributes[name][row].item()) for name in ATTRIBUTES},
+            "periods": self.period_labels,
+            **{
+                name: [None if np.isnan(v) else round(float(v), 3) for v in self._measures[name][row]]
+                for name in MEASURES
+            },
+        }
+
+    def trend(self, segment_id: object, month: Any, year: Any, measure: str = "average_speed") -> Dict[str, Optional[float]]:
+        """Month-over-month and year-over-year change of one segment's measure"""
+        row, key = self.row(segment_id), period_key(month, year)
+        result: Dict[str, Optional[float]] = {f"{measure}_mom": None, f"{measure}_yoy": None}
+        now = self.column(key)
+        if row is None or now is None:
+            return result
+        values = self._measures[measure][row]
+        for suffix, offset in (("mom", 1), ("yoy", 12)):
+            before = self.column(key - offset)
+            if before is not None and not np.isnan(values[now]) and not np.isnan(values[before]):
+                result[f"{measure}_{suffix}"] = round(float(values[now] - values[before]), 3)
+        return result
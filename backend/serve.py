@@ -0,0 +1,172 @@
+"""
+Production serving entry point: N uvicorn workers sharing one read-only index
+Description: The FAISS index is opened with IO_FLAG_MMAP_IFC, stored vectors are a zero-copy view of
+it, and segment metadata lives in the memory-mapped SegmentStore. With --preload (default) the master
+maps everything once, freezes the GC heap and forks workers that inherit the mappings. With
+--no-preload each worker maps the same files itself. Either way the pages come from one shared page
+cache, so N workers cost roughly one worker's index memory.
+
+Usage (from the directory holding embeddings/):
+    python backend/serve.py --workers 4 --port 8000
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import uvicorn
+
+logger = logging.getLogger("serve")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _memory_kb(pid: int) -> Dict[str, int]:
+    """RSS and PSS (proportional share of shared pages) from /proc"""
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Private_Dirty"):
+                    usage[key.lower()] = int(rest.split()[0])
+    except OSError:
+        pass
+    return usage
+
+
+def _run_worker(sock: socket.socket, args: argparse.Namespace) -> None:
+    import main
+
+    config = uvicorn.Config(
+        main.app,
+        log_level=args.log_level,
+        timeout_keep_alive=args.keep_alive,
+        access_log=args.access_log,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks workers, restarts crashed ones, and forwards shutdown signals"""
+
+    def __init__(self, sock: socket.socket, args: argparse.Namespace):
+        self.sock = sock
+        self.args = args
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+
+    def spawn(self, slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # Child: let uvicorn install its own handlers
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                _run_worker(self.sock, self.args)
+            except Exception:
+                logger.exception(f"❌ Worker {slot} crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = slot
+        logger.info(f"👷 Worker {slot} started (pid {pid})")
+
+    def _on_signal(self, signum: int, _frame: Optional[object]) -> None:
+        if not self.stopping:
+            logger.info(f"🛑 Received {signal.Signals(signum).name}, stopping workers...")
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report_memory(self) -> None:
+        rows = {pid: _memory_kb(pid) for pid in self.children}
+        total_rss = sum(r.get("rss", 0) for r in rows.values())
+        total_pss = sum(r.get("pss", 0) for r in rows.values()) + _memory_kb(os.getpid()).get("pss", 0)
+        logger.info(
+            f"🧠 {len(rows)} workers: summed RSS {total_rss / 1024:.1f} MiB, "
+            f"actual (PSS incl. master) {total_pss / 1024:.1f} MiB"
+        )
+
+    def run(self) -> None:
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+        for slot in range(self.args.workers):
+            self.spawn(slot)
+
+        next_report = time.monotonic() + self.args.memory_report_interval
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.2)
+                if self.args.memory_report_interval and time.monotonic() >= next_report:
+                    self.report_memory()
+                    next_report = time.monotonic() + self.args.memory_report_interval
+                continue
+            slot = self.children.pop(pid)
+            if not self.stopping:
+                logger.warning(f"⚠️ Worker {slot} (pid {pid}) exited with status {status}, restarting")
+                self.spawn(slot)
+        logger.info("✅ All workers stopped")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Multi-worker Traffic Analysis AI server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction, default=True,
+                        help="Map the index in the master and fork workers (default)")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--memory-report-interval", type=float, default=0.0,
+                        help="Log summed worker RSS/PSS every N seconds (0 disables)")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        parser.error("serve.py needs a POSIX platform (os.fork); use `uvicorn main:app` instead")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.preload:
+        import main as backend
+
+        asyncio.run(backend.load_embeddings())
+        # Move everything allocated so far out of GC tracking so collections in the
+        # workers don't touch (and copy-on-write) the inherited heap pages
+        gc.freeze()
+
+    sock = _bind(args.host, args.port, args.backlog)
+    logger.info(f"🚀 Serving on {args.host}:{args.port} with {args.workers} workers (preload={args.preload})")
+    Supervisor(sock, args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Shard server: search over one partition of the per-month index shards
+Description: One process can only keep so many months of city-wide vectors in RAM. A shard server
+maps just its share of the shards (see shards.partition) and answers top-k searches over them; the
+front (main.py with SHARD_SERVER_URLS set) fans each query out to the servers that own the routed
+shards and merges their results, see scatter.ShardScatter.
+
+Wire format:
+    GET  /shard/info                                  → {"shards": {name: {"period_key", "vectors"}}, ...}
+    POST /shard/search?k=5&shards=2023-09,2023-10[&day_type=weekend]
+         body: the query vector as raw little-endian float32 bytes
+                                                      → {"scores": [...], "rows": [...]}
+Rows are SegmentStore rows, so servers and front must share one index build.
+
+Usage (from the directory holding embeddings/), e.g. three partitions on one box:
+    python backend/shard_server.py --spawn 3 --base-port 8101
+    SHARD_SERVER_URLS=http://127.0.0.1:8101,http://127.0.0.1:8102,http://127.0.0.1:8103 \\
+        uvicorn main:app --app-dir backend
+or a single partition:
+    python backend/shard_server.py --partition 0 --partitions 3 --port 8101
+"""
+
+import argparse
+import json
+import logging
+import signal
+import subprocess
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+
+from lazy import LazyModule
+from metrics import CONTENT_TYPE, REGISTRY
+from search_executor import SearchExecutor, SearchQueueFull, default_workers, default_omp_threads
+from shards import MANIFEST_FILE, ShardSet, partition
+from store import SegmentStore
+
+np = LazyModule("numpy")
+
+logger = logging.getLogger("shard_server")
+
+DAY_TYPE_COLUMNS = {"weekday": "has_weekday", "weekend": "has_weekend"}
+
+
+def create_shard_app(shard_dir: str, store_dir: str, index: int, count: int,
+                     memory_budget_mb: float, workers: int = default_workers()) -> FastAPI:
+    """FastAPI app serving partition `index` of `count` of the shards in `shard_dir`"""
+    manifest = json.loads((Path(shard_dir) / MANIFEST_FILE).read_text())
+    names = partition(manifest["shards"], index, count)
+    shard_set = ShardSet(shard_dir, int(memory_budget_mb * 2**20), names)
+    executor = SearchExecutor(workers=workers, max_queue=64, omp_threads=default_omp_threads(workers))
+    # Only the day-type flag columns are read from the store, and only when a query asks for them
+    store: Dict[str, Any] = {}
+
+    def day_mask(day_type: Optional[str]) -> Optional[np.ndarray]:
+        if day_type is None:
+            return None
+        if "store" not in store:
+            store["store"] = SegmentStore(store_dir)
+        return store["store"].column(DAY_TYPE_COLUMNS[day_type])
+
+    @asynccontextmanager
+    async def lifespan(application: FastAPI):
+        try:
+            yield
+        finally:
+            executor.shutdown()
+
+    app = FastAPI(title=f"Traffic shard server {index}/{count}", lifespan=lifespan)
+
+    @app.get("/shard/info")
+    async def info():
+        return {"partition": index, "partitions": count, "dimension": shard_set.dimension,
+                "shards": shard_set.shards, "status": shard_set.status()}
+
+    @app.post("/shard/search")
+    async def search(request: Request, k: int = Query(5, ge=1, le=1000), shards: str = "",
+                     day_type: Optional[str] = Query(None, pattern="^(weekday|weekend)$")):
+        query = np.frombuffer(await request.body(), dtype="<f4")
+        if query.size != shard_set.dimension:
+            raise HTTPException(status_code=400, detail=f"Expected a {shard_set.dimension}-dim float32 vector")
+        wanted = [name for name in shards.split(",") if name] or list(shard_set.shards)
+        try:
+            scores, rows = await executor.run(
+                "shard_search", shard_set.search, query[None, :], k, None, day_mask(day_type), wanted
+            )
+        except SearchQueueFull:
+            raise HTTPException(status_code=503, detail="Shard server busy", headers={"Retry-After": "1"})
+        return {"scores": scores[0].tolist(), "rows": rows[0].tolist()}
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    logger.info(f"🧩 Shard server {index}/{count} serving {len(names)} shards: {', '.join(names)}")
+    return app
+
+
+def _spawn(args: argparse.Namespace) -> None:
+    """Run `--spawn N` partitions as child processes on consecutive ports until interrupted"""
+    children: List[subprocess.Popen] = []
+    for i in range(args.spawn):
+        cmd = [
+            sys.executable, __file__, "--partition", str(i), "--partitions", str(args.spawn),
+            "--host", args.host, "--port", str(args.base_port + i), "--shard-dir", args.shard_dir,
+            "--store-dir", args.store_dir, "--memory-budget-mb", str(args.memory_budget_mb),
+            "--workers", str(args.workers),
+        ]
+        children.append(subprocess.Popen(cmd))
+        logger.info(f"👷 Shard server {i}/{args.spawn} on port {args.base_port + i} (pid {children[-1].pid})")
+    urls = ",".join(f"http://{args.host}:{args.base_port + i}" for i in range(args.spawn))
+    logger.info(f"🔗 Start the front with SHARD_SERVER_URLS={urls}")
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.send_signal(signal.SIGTERM)
+        for child in children:
+            child.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve one partition of the per-month index shards")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--partition", type=int, default=0)
+    parser.add_argument("--partitions", type=int, default=1)
+    parser.add_argument("--spawn", type=int, default=0, help="Start this many partitions as local processes")
+    parser.add_argument("--base-port", type=int, default=8101, help="First port for --spawn")
+    parser.add_argument("--shard-dir", default="embeddings/shards")
+    parser.add_argument("--store-dir", default="embeddings/metadata")
+    parser.add_argument("--memory-budget-mb", type=float, default=1024)
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Search threads")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.spawn:
+        _spawn(args)
+        return
+    if not 0 <= args.partition < args.partitions:
+        parser.error("--partition must be in [0, --partitions)")
+
+    import uvicorn
+
+    app = create_shard_app(args.shard_dir, args.store_dir, args.partition, args.partitions,
+                           args.memory_budget_mb, args.workers)
+    uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
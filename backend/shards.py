@@ -0,0 +1,205 @@
+"""
+Per-(year, month) FAISS shards with filter routing and an LRU memory budget
+Description: Instead of scanning one flat index and filtering afterwards, vectors are partitioned
+into one flat index file per period. A query that names periods only searches those shards, so its
+cost scales with the filtered period rather than the whole history; unfiltered queries search every
+shard and merge the per-shard top-k. Shards are memory-mapped on first use and the least recently
+used ones are closed once the open set exceeds the memory budget.
+
+Layout (under CONFIG["shard_dir"]):
+    shards.json             manifest: shard name → period key, vector count
+    2023-09/index.bin       flat inner-product index over that month's (normalized) vectors
+    2023-09/ids.npy         int64 SegmentStore row for each shard vector
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from lazy import LazyModule
+from metrics import REGISTRY
+
+np = LazyModule("numpy")
+faiss = LazyModule("faiss")
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "shards.json"
+UNKNOWN_SHARD = "unknown"
+
+SHARD_EVENTS = REGISTRY.counter("traffic_shard_events_total", "Shard loads and LRU evictions", ["event"])
+SHARDS_SEARCHED = REGISTRY.histogram(
+    "traffic_shards_searched", "Shards searched per query", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+SHARD_RESIDENT_BYTES = REGISTRY.gauge("traffic_shard_open_bytes", "Vector bytes of currently open shards")
+
+
+def partition(names: Sequence[str], index: int, count: int) -> List[str]:
+    """Round-robin share of the (chronologically sorted) shards for server `index` of `count`,
+    so consecutive months - which are often queried together - land on different servers"""
+    return sorted(names)[index::count]
+
+
+def shard_name(key: Optional[int]) -> str:
+    """'2023-09' for a segment_table.period_key(), 'unknown' for records without a period"""
+    return UNKNOWN_SHARD if key is None or key < 0 else f"{key // 12:04d}-{key % 12 + 1:02d}"
+
+
+def write_shards(vectors: np.ndarray, period_keys: Sequence[Optional[int]], directory: str) -> Dict[str, Any]:
+    """Partition normalized vectors by period into one flat index per shard; returns the manifest"""
+    out = Path(directory)
+    out.mkdir(parents=True, exist_ok=True)
+    names = np.array([shard_name(k) for k in period_keys], dtype=str)
+    keys = {shard_name(k): (-1 if k is None else int(k)) for k in period_keys}
+
+    manifest: Dict[str, Any] = {"dimension": int(vectors.shape[1]) if vectors.ndim == 2 else 0, "shards": {}}
+    for name in sorted(keys):
+        rows = np.flatnonzero(names == name)
+        shard_dir = out / name
+        shard_dir.mkdir(exist_ok=True)
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(np.ascontiguousarray(vectors[rows], dtype=np.float32))
+        # Write-then-rename so processes that have the old shard mapped keep a valid file
+        faiss.write_index(index, str(shard_dir / "index.bin.tmp"))
+        os.replace(shard_dir / "index.bin.tmp", shard_dir / "index.bin")
+        np.save(shard_dir / "ids.tmp.npy", rows.astype(np.int64))
+        os.replace(shard_dir / "ids.tmp.npy", shard_dir / "ids.npy")
+        manifest["shards"][name] = {"period_key": keys[name], "vectors": int(len(rows))}
+
+    # Shards from a previous build that no longer exist are dropped from the manifest (files are left)
+    tmp = out / f"{MANIFEST_FILE}.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, out / MANIFEST_FILE)
+    logger.info(f"🧩 Wrote {len(manifest['shards'])} period shards to {out}")
+    return manifest
+
+
+class _Shard:
+    __slots__ = ("name", "index", "ids", "nbytes")
+
+    def __init__(self, name: str, index: Any, ids: np.ndarray):
+        self.name = name
+        self.index = index
+        self.ids = ids
+        self.nbytes = int(index.ntotal) * int(index.d) * 4
+
+
+class ShardSet:
+    """Lazily opened period shards with LRU eviction; safe to search from several threads
+
+    `names` restricts the set to a subset of the manifest (a shard server's partition).
+    """
+
+    def __init__(self, directory: str, memory_budget_bytes: int, names: Optional[Sequence[str]] = None):
+        self.directory = Path(directory)
+        self.memory_budget_bytes = memory_budget_bytes
+        manifest = json.loads((self.directory / MANIFEST_FILE).read_text())
+        self.dimension: int = manifest["dimension"]
+        self.shards: Dict[str, Dict[str, Any]] = (
+            manifest["shards"] if names is None
+            else {name: info for name, info in manifest["shards"].items() if name in set(names)}
+        )
+        self._by_period = {info["period_key"]: name for name, info in self.shards.items()}
+        self._open: "OrderedDict[str, _Shard]" = OrderedDict()
+        self._open_bytes = 0
+        self._lock = threading.Lock()
+        SHARD_RESIDENT_BYTES.set_function(lambda: self._open_bytes)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return (Path(directory) / MANIFEST_FILE).exists()
+
+    @property
+    def total_vectors(self) -> int:
+        return sum(info["vectors"] for info in self.shards.values())
+
+    def route(self, period_keys: Optional[Sequence[int]]) -> List[str]:
+        """Shard names for the requested periods; all shards when no (known) period was requested"""
+        if period_keys:
+            names = [self._by_period[k] for k in period_keys if k in self._by_period]
+            if names:
+                return names
+        return list(self.shards)
+
+    def _load(self, name: str) -> _Shard:
+        shard_dir = self.directory / name
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        index = faiss.read_index(str(shard_dir / "index.bin"), flag | faiss.IO_FLAG_READ_ONLY)
+        return _Shard(name, index, np.load(shard_dir / "ids.npy", mmap_mode="r"))
+
+    def get(self, name: str) -> _Shard:
+        with self._lock:
+            shard = self._open.get(name)
+            if shard is not None:
+                self._open.move_to_end(name)
+                return shard
+        # Load outside the lock: mapping a large shard must not stall searches on open ones
+        shard = self._load(name)
+        with self._lock:
+            if name in self._open:
+                return self._open[name]
+            self._open[name] = shard
+            self._open_bytes += shard.nbytes
+            SHARD_EVENTS.labels("load").inc()
+            while self._open_bytes > self.memory_budget_bytes and len(self._open) > 1:
+                evicted_name, evicted = self._open.popitem(last=False)
+                self._open_bytes -= evicted.nbytes
+                SHARD_EVENTS.labels("evict").inc()
+                logger.info(f"♻️ Evicted shard {evicted_name} ({evicted.nbytes / 2**20:.1f} MiB) under memory budget")
+        return shard
+
+    def search(self, query: np.ndarray, k: int, period_keys: Optional[Sequence[int]] = None,
+               row_mask: Optional[np.ndarray] = None,
+               names: Optional[Sequence[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k over the routed shards, as FAISS-style (1, k) scores and SegmentStore rows
+
+        `row_mask` (bool per SegmentStore row) restricts results, applied inside each shard's
+        scan via an ID selector rather than by copying vectors into a sub-index. `names`
+        bypasses period routing (the front has already routed the query).
+        """
+        query = np.array(query, dtype=np.float32, copy=True)
+        faiss.normalize_L2(query)
+        names = self.route(period_keys) if names is None else [n for n in names if n in self.shards]
+        SHARDS_SEARCHED.observe(len(names))
+
+        shards = [shard for shard in map(self.get, names) if shard.index.ntotal]
+        local_masks = [None] * len(shards)
+        if row_mask is not None:
+            local_masks = [np.asarray(row_mask[shard.ids], dtype=bool) for shard in shards]
+            # Like the row filters in main, a restriction that leaves nothing is ignored
+            if not any(local.any() for local in local_masks):
+                local_masks = [None] * len(shards)
+
+        all_scores, all_rows = [], []
+        for shard, local in zip(shards, local_masks):
+            params = None
+            if local is not None:
+                if not local.any():
+                    continue
+                bitmap = np.packbits(local, bitorder="little")
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(local), faiss.swig_ptr(bitmap)))
+            scores, local_ids = shard.index.search(query, min(k, shard.index.ntotal), params=params)
+            found = local_ids[0] >= 0
+            all_scores.append(scores[0][found])
+            all_rows.append(np.asarray(shard.ids)[local_ids[0][found]])
+
+        if not all_scores:
+            return np.zeros((1, 0), dtype=np.float32), np.zeros((1, 0), dtype=np.int64)
+        scores = np.concatenate(all_scores)
+        rows = np.concatenate(all_rows)
+        top = np.argsort(-scores, kind="stable")[:k]
+        return scores[top][None, :], rows[top][None, :]
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "shards": len(self.shards),
+            "open": list(self._open),
+            "open_mb": round(self._open_bytes / 2**20, 1),
+            "budget_mb": round(self.memory_budget_bytes / 2**20, 1),
+        }
@@ -0,0 +1,152 @@
+"""
+Read-only, memory-mapped segment metadata
+Description: Segment dicts are stored as one JSON line each, with an offsets array and a few typed
+columns (month, year, street, day-type flags) kept as .npy files. Everything is opened with mmap,
+so several worker processes share one copy through the page cache, and filters run over columns
+without decoding any JSON. Geometry is kept out of the records, deduplicated by segment_id in a
+GeometryStore under geometry/, a normalized SegmentTable (per-segment attributes plus monthly
+measurement arrays) lives under segments/, and per-record congestion features under features/.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from features import SegmentFeatures
+from geometry import GeometryBuilder, GeometryStore
+from lazy import LazyModule
+from segment_table import SegmentTable, period_key
+
+np = LazyModule("numpy")
+
+logger = logging.getLogger(__name__)
+
+RECORDS_FILE = "records.jsonl"
+OFFSETS_FILE = "offsets.npy"
+GEOMETRY_DIR = "geometry"
+TABLE_DIR = "segments"
+FEATURES_DIR = "features"
+
+
+def _atomic_write_bytes(path: Path, payload: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, path)
+
+
+def _atomic_save_npy(path: Path, array: np.ndarray) -> None:
+    # Replacing (rather than overwriting) keeps existing mmaps of the old file valid
+    tmp = path.with_name(path.name + ".tmp.npy")
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+class SegmentStore(Sequence):
+    """Sequence of segment dicts backed by mmap'd JSONL plus typed columns"""
+
+    COLUMNS = ("month", "year", "street_name", "segment_id", "has_weekday", "has_weekend")
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._offsets = np.load(self.directory / OFFSETS_FILE, mmap_mode="r")
+        self._file = open(self.directory / RECORDS_FILE, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._records = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size else b""
+        # Map every column up front so they all belong to the same snapshot as the offsets
+        self._columns: Dict[str, np.ndarray] = {
+            name: np.load(self.directory / f"{name}.npy", mmap_mode="r") for name in self.COLUMNS
+        }
+        geometry_dir = self.directory / GEOMETRY_DIR
+        self.geometry: Optional[GeometryStore] = GeometryStore(geometry_dir) if GeometryStore.exists(geometry_dir) else None
+        table_dir = self.directory / TABLE_DIR
+        self.table: Optional[SegmentTable] = SegmentTable(table_dir) if SegmentTable.exists(table_dir) else None
+        features_dir = self.directory / FEATURES_DIR
+        self.features: Optional[SegmentFeatures] = (
+            SegmentFeatures(features_dir) if self.table is not None and SegmentFeatures.exists(features_dir) else None
+        )
+
+    # ---------- Writing ----------
+    @staticmethod
+    def write(segments: List[Dict[str, Any]], directory: str, geometries: Optional[GeometryBuilder] = None) -> None:
+        """Serialize segments and their filter columns
+
+        Inline "coordinates" (legacy metadata, tools) are moved into the geometry store; ingest
+        passes `geometries` collected while parsing instead.
+        """
+        out = Path(directory)
+        out.mkdir(parents=True, exist_ok=True)
+
+        geometries = geometries if geometries is not None else GeometryBuilder()
+        lines = []
+        for s in segments:
+            if "coordinates" in s:
+                geometries.add(s.get("segment_id", "unknown"), s["coordinates"])
+                s = {k: v for k, v in s.items() if k != "coordinates"}
+            lines.append(json.dumps(s, separators=(",", ":")).encode("utf-8") + b"\n")
+        offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+        np.cumsum([len(line) for line in lines], out=offsets[1:])
+
+        periods = [s.get("time_periods") or {} for s in segments]
+        columns = {
+            "month": np.array([str(s.get("month", "Unknown")) for s in segments], dtype=str),
+            "year": np.array([int(s.get("year", 0) or 0) for s in segments], dtype=np.int32),
+            "street_name": np.array([str(s.get("street_name", "Unknown")) for s in segments], dtype=str),
+            "segment_id": np.array([str(s.get("segment_id", "unknown")) for s in segments], dtype=str),
+            "has_weekday": np.array([any("WD_" in k for k in p) for p in periods], dtype=bool),
+            "has_weekend": np.array([any("WE_" in k for k in p) for p in periods], dtype=bool),
+        }
+        for name, values in columns.items():
+            _atomic_save_npy(out / f"{name}.npy", values)
+        geometries.write(str(out / GEOMETRY_DIR))
+        SegmentTable.write(segments, str(out / TABLE_DIR))
+        SegmentFeatures.write(segments, SegmentTable(str(out / TABLE_DIR)), str(out / FEATURES_DIR))
+        _atomic_write_bytes(out / RECORDS_FILE, b"".join(lines))
+        # Offsets go last: a reader never sees offsets that point past the records file
+        _atomic_save_npy(out / OFFSETS_FILE, offsets)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return (Path(directory) / OFFSETS_FILE).exists() and (Path(directory) / RECORDS_FILE).exists()
+
+    # ---------- Sequence protocol ----------
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return json.loads(self._records[start:end])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    # ---------- Columns ----------
+    def column(self, name: str) -> np.ndarray:
+        """Typed column as a read-only mmap'd array"""
+        return self._columns[name]
+
+    def select_period(self, month: str, year: int) -> np.ndarray:
+        """Row ids whose month starts with `month` (e.g. 'Sep') in `year`"""
+        if self.table is not None:
+            col = self.table.column(period_key(month, year))
+            return np.flatnonzero(self.table.record_period == col) if col is not None else np.zeros(0, dtype=np.int64)
+        months = self.column("month")
+        mask = (self.column("year") == year) & np.char.startswith(months, month)
+        return np.flatnonzero(mask)
+
+    def close(self) -> None:
+        if isinstance(self._records, mmap.mmap):
+            self._records.close()
+        self._file.close()
@@ -0,0 +1,126 @@
+"""
+Synthetic Dubai traffic GeoJSON generators
+Description: Reproducible feature collections in both the legacy (SEGMENT_ID / AVG_SPEED / WD_* keys)
+and Dubai-dash (segmentId / segmentTimeResults) schemas, for benchmarks and load tests.
+"""
+
+import json
+import random
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+SCHEMAS = ("legacy", "dash")
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+STREETS = [
+    "Sheikh Zayed Rd", "Sheikh Rashid Rd", "Al Khail Rd", "Emirates Rd", "Al Wasl Rd",
+    "Jumeirah Beach Rd", "Al Ittihad Rd", "Airport Rd", "Al Maktoum Rd", "Oud Metha Rd",
+    "Sheikh Mohammed Bin Zayed Rd", "Al Safa St", "Umm Suqeim St", "Hessa St", "Al Asayel St",
+]
+DIRECTIONS = ["Northbound", "Southbound", "Eastbound", "Westbound"]
+SPEED_LIMITS = [60, 80, 100, 120]
+LEGACY_PERIODS = ["WD_AM_PEAK", "WD_MIDDAY", "WD_PM_PEAK", "WE_AM_PEAK", "WE_MIDDAY", "WE_PM_PEAK"]
+
+
+def parse_size(label: str) -> int:
+    """'10k' -> 10000, '1m' -> 1000000, '2500' -> 2500"""
+    label = label.strip().lower()
+    if label in SIZES:
+        return SIZES[label]
+    if label.endswith("k"):
+        return int(float(label[:-1]) * 1_000)
+    if label.endswith("m"):
+        return int(float(label[:-1]) * 1_000_000)
+    return int(label)
+
+
+def _line(rng: random.Random) -> list:
+    """Short polyline inside the Dubai bounding box"""
+    lon = rng.uniform(55.05, 55.45)
+    lat = rng.uniform(24.95, 25.35)
+    points = []
+    for _ in range(rng.randint(2, 20)):
+        points.append([round(lon, 6), round(lat, 6)])
+        lon += rng.uniform(-0.0015, 0.0015)
+        lat += rng.uniform(-0.0015, 0.0015)
+    return points
+
+
+def _feature(i: int, schema: str, rng: random.Random) -> Dict[str, Any]:
+    street = f"{rng.choice(STREETS)} - {rng.choice(DIRECTIONS)}"
+    speed_limit = rng.choice(SPEED_LIMITS)
+    distance = round(rng.uniform(40, 1500), 1)
+    avg_speed = round(speed_limit * rng.uniform(0.2, 1.05), 2)
+    median_speed = round(avg_speed * rng.uniform(0.9, 1.1), 2)
+    travel_time = round(distance / max(avg_speed / 3.6, 0.1), 2)
+    samples = rng.randint(50, 50_000)
+
+    if schema == "legacy":
+        props: Dict[str, Any] = {
+            "SEGMENT_ID": 100_000 + i,
+            "STREET_NAME": street,
+            "SPEED_LIMIT": speed_limit,
+            "DISTANCE": distance,
+            "SAMPLE_SIZE": samples,
+            "AVG_SPEED": avg_speed,
+            "MEDIAN_SPEED": median_speed,
+            "AVG_TRAVEL_TIME": travel_time,
+        }
+        for period in LEGACY_PERIODS:
+            props[f"{period}_AVG_SPEED"] = round(avg_speed * rng.uniform(0.6, 1.2), 2)
+    elif schema == "dash":
+        results = []
+        for time_set in range(1, rng.randint(2, 6) + 1):
+            speed = round(avg_speed * rng.uniform(0.6, 1.2), 2)
+            results.append({
+                "timeSet": time_set,
+                "averageSpeed": speed,
+                "harmonicAverageSpeed": round(speed * 0.97, 2),
+                "medianSpeed": round(speed * rng.uniform(0.9, 1.1), 2),
+                "averageTravelTime": round(distance / max(speed / 3.6, 0.1), 2),
+                "sampleSize": rng.randint(10, samples),
+            })
+        props = {
+            "segmentId": 100_000 + i,
+            "newSegmentId": f"S{100_000 + i}",
+            "streetName": street,
+            "speedLimit": speed_limit,
+            "distance": distance,
+            "sampleSize": samples,
+            "segmentTimeResults": results,
+        }
+    else:
+        raise ValueError(f"Unknown schema '{schema}', expected one of {SCHEMAS}")
+
+    return {
+        "type": "Feature",
+        "geometry": {"type": "LineString", "coordinates": _line(rng)},
+        "properties": props,
+    }
+
+
+def iter_features(n_segments: int, schema: str = "dash", seed: int = 42) -> Iterator[Dict[str, Any]]:
+    """Yield features one at a time (constant memory, even at 1M segments)"""
+    rng = random.Random(f"{seed}:{schema}")
+    for i in range(n_segments):
+        yield _feature(i, schema, rng)
+
+
+def generate_geojson(n_segments: int, schema: str = "dash", seed: int = 42) -> Dict[str, Any]:
+    """Build an in-memory FeatureCollection"""
+    return {"type": "FeatureCollection", "features": list(iter_features(n_segments, schema, seed))}
+
+
+def write_geojson(path: Path, n_segments: int, schema: str = "dash", seed: int = 42) -> Path:
+    """Stream a FeatureCollection to disk without materialising it"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        f.write('{"type": "FeatureCollection", "features": [')
+        for i, feature in enumerate(iter_features(n_segments, schema, seed)):
+            if i:
+                f.write(",")
+            f.write(json.dumps(feature, separators=(",", ":")))
+        f.write("]}")
+    return path
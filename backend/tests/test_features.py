@@ -0,0 +1,33 @@
+import numpy as np
+
+from features import ANOMALY_Z, _history_zscore
+from segment_table import SegmentTable
+
+
+def _table(tmp_path, speeds_by_segment):
+    months = ("Jun", "Jul", "Aug", "Sep")
+    SegmentTable.write([
+        {"segment_id": segment_id, "month": month, "year": 2023, "average_speed": speed, "speed_limit": 80}
+        for segment_id, speeds in speeds_by_segment.items()
+        for month, speed in zip(months, speeds) if speed is not None
+    ], str(tmp_path))
+    return SegmentTable(str(tmp_path))
+
+
+def test_leave_one_out_zscore_flags_an_outlier_in_a_four_month_history(tmp_path):
+    table = _table(tmp_path, {"a": [60.0, 62.0, 58.0, 30.0]})
+    z = _history_zscore(table)
+    # Against the other three months (mean 60, std 2): (30 - 60) / 3 (the 5%-of-mean std floor)
+    assert z[3] == np.float32(-10.0)
+    assert abs(z[3]) >= ANOMALY_Z
+    # An in-sample z-score over 4 months is capped at (4 - 1) / sqrt(4) = 1.5
+    speeds = np.array([60.0, 62.0, 58.0, 30.0])
+    assert abs((speeds[3] - speeds.mean()) / speeds.std()) < ANOMALY_Z
+
+
+def test_zscore_needs_three_other_months(tmp_path):
+    table = _table(tmp_path, {"a": [60.0, 62.0, None, 30.0], "b": [50.0, 52.0, 54.0, 56.0]})
+    z = _history_zscore(table)
+    records_of_a = table.record_segment == table.row("a")
+    assert np.isnan(z[records_of_a]).all()
+    assert not np.isnan(z[~records_of_a]).any()
@@ -0,0 +1,40 @@
+import numpy as np
+
+from geometry import COORD_SCALE, GeometryBuilder, GeometryStore, decode_polyline, encode_polyline
+
+LINE = [[55.27071, 25.19721], [55.27190, 25.19805], [55.27322, 25.19870], [55.27455, 25.19933]]
+
+
+def test_polyline_round_trip():
+    points = np.array(LINE + [[-0.12345, -51.98765]])
+    assert np.allclose(decode_polyline(encode_polyline(points)), points, atol=1e-5)
+    assert np.allclose(decode_polyline(encode_polyline(points, 6), 6), points, atol=1e-6)
+
+
+def test_polyline_matches_the_reference_encoding():
+    # Example from Google's encoded polyline format documentation (lat, lon there; lon, lat here)
+    points = np.array([[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]])
+    assert encode_polyline(points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_store_round_trips_delta_encoded_lines(tmp_path):
+    builder = GeometryBuilder()
+    builder.add("b", LINE)
+    builder.add("a", LINE[::-1])
+    builder.add("b", [[0.0, 0.0], [1.0, 1.0]])  # first occurrence wins
+    builder.write(str(tmp_path))
+
+    store = GeometryStore(str(tmp_path))
+    assert len(store) == 2
+    assert store.coordinates("a").tolist() == (np.round(np.array(LINE[::-1]) * COORD_SCALE) / COORD_SCALE).tolist()
+    assert np.allclose(store.coordinates("b"), LINE, atol=1 / COORD_SCALE)
+    assert np.allclose(decode_polyline(store.polyline("b")), LINE, atol=1e-5)
+    assert store.coordinates("missing") is None
+
+
+def test_simplified_lines_keep_their_endpoints(tmp_path):
+    builder = GeometryBuilder()
+    builder.add("a", LINE)
+    builder.write(str(tmp_path))
+    simplified = GeometryStore(str(tmp_path)).coordinates("a", tolerance_m=1000.0)
+    assert np.allclose(simplified, [LINE[0], LINE[-1]], atol=1 / COORD_SCALE)
@@ -0,0 +1,43 @@
+import numpy as np
+
+from segment_table import SegmentTable, _last_occurrence, period_key
+
+
+def _record(segment_id, month, year, speed, street="Hessa St", limit=80):
+    return {"segment_id": segment_id, "month": month, "year": year, "average_speed": speed,
+            "street_name": street, "speed_limit": limit, "distance": 100.0}
+
+
+def test_last_occurrence_picks_the_last_position_of_each_key():
+    distinct, last = _last_occurrence(np.array([3, 1, 3, 2, 1, 3]))
+    assert distinct.tolist() == [1, 2, 3]
+    assert last.tolist() == [4, 3, 5]
+
+
+def test_duplicate_cell_keeps_the_last_record(tmp_path):
+    SegmentTable.write([
+        _record("a", "Sep", 2023, 10.0),
+        _record("b", "Sep", 2023, 50.0),
+        _record("a", "Sep", 2023, 20.0),
+        _record("a", "September", "2023", 30.0),  # same cell, spelled differently
+    ], str(tmp_path))
+    table = SegmentTable(str(tmp_path))
+    col = table.column(period_key("Sep", 2023))
+    speed = table.measure("average_speed")
+    assert speed[table.row("a"), col] == 30.0
+    assert speed[table.row("b"), col] == 50.0
+
+
+def test_attributes_come_from_the_latest_period_then_last_in_input_order(tmp_path):
+    SegmentTable.write([
+        _record("a", "Oct", 2023, 40.0, street="Newer St", limit=100),
+        _record("a", "Sep", 2023, 30.0, street="Old St", limit=60),
+        _record("a", "Oct", 2023, 45.0, street="Newest St", limit=120),
+        _record("a", None, None, 0.0, street="Undated St", limit=20),
+    ], str(tmp_path))
+    table = SegmentTable(str(tmp_path))
+    row = table.row("a")
+    assert table.attribute("street_name")[row] == "Newest St"
+    assert table.attribute("speed_limit")[row] == 120
+    # The undated record has no period column and never overwrites a month
+    assert table.series("a")["average_speed"] == [30.0, 45.0]
@@ -64,6 +64,7 @@ export default function TrafficChatBot() {
   const [isStreaming, setIsStreaming] = useState(false);
   const chatContainerRef = useRef<HTMLDivElement>(null);
   const inputRef = useRef<HTMLInputElement>(null);
+  const abortRef = useRef<AbortController | null>(null);
   const { t, language, locale } = useI18n();
 
   // Auto-scroll to bottom when new messages are added
@@ -73,6 +74,9 @@ export default function TrafficChatBot() {
     }
   }, [chatLog, streamingMessage]);
 
+  // Abort an in-flight request on unmount so the backend stops working on it
+  useEffect(() => () => abortRef.current?.abort(), []);
+
   // Memoized API endpoint
   const apiEndpoint = useMemo(() => 
     `${process.env.NEXT_PUBLIC_API_URL ?? FASTAPI_BASE_URL}/chat`,
@@ -117,9 +121,14 @@ export default function TrafficChatBot() {
     setInput("");
     setIsLoading(true);
 
+    abortRef.current?.abort();
+    const controller = new AbortController();
+    abortRef.current = controller;
+
     try {
       const response = await fetch(apiEndpoint, {
         method: "POST",
+        signal: controller.signal,
         headers: {
           "Content-Type": "application/json",
           "Accept-Language": language,
@@ -172,6 +181,7 @@ export default function TrafficChatBot() {
       setStreamingMessage("");
       
     } catch (error) {
+      if (controller.signal.aborted) return;
       console.error("Error sending message:", error);
       setIsLoading(false);
       